@@ -0,0 +1,239 @@
+#! /usr/bin/env python3
+
+import os
+import json
+import time
+import traceback
+import multiprocessing
+import multiprocessing.connection
+from pathlib import Path
+from dataclasses import dataclass, asdict
+
+import pipeline
+
+
+@dataclass
+class Site:
+    """
+    A WordPress website whose re-posts are converted in a batch
+
+    name:  the name by which the site is reported
+    dump_filepath:  the SQL dump file, which may be compressed (see
+        's01.read_sql_dump_byte_lines')
+    textfile_filepath:  the text file of posts
+    output_path:  the directory of the site's output files, including its
+        caches, metrics and manifest, so that no two sites share any file
+    table_prefix:  the prefix of the names of the site's tables in the dump
+    """
+    name: str
+    dump_filepath: Path
+    textfile_filepath: Path
+    output_path: Path
+    table_prefix: str='_5A5_'
+
+
+@dataclass
+class SiteResult:
+    """
+    The outcome of converting the re-posts of a site
+
+    name:  the site's name
+    succeeded:  whether the site's pipeline ran without an error
+    seconds:  how long the site's pipeline ran
+    markdown_file_n:  the number of markdown files in the site's output
+        directory after the run
+    error:  the traceback of the error, if the pipeline failed
+    """
+    name: str
+    succeeded: bool
+    seconds: float
+    markdown_file_n: int=0
+    error: str | None=None
+
+
+def load_sites(filepath: Path) -> list[Site]:
+    """
+    Loads the sites of a batch from a JSON file like
+
+        {"sites": [
+            {"name": "books", "dump": "books/localhost.sql.gz",
+             "textfile": "books/01posts.txt", "output": "output/books",
+             "table_prefix": "wp_"}]}
+
+    Relative paths are relative to the directory of the file; "table_prefix"
+        may be omitted for the default prefix
+
+    An error is raised if two sites have the same name or output directory
+    """
+
+    with open(filepath, encoding='utf-8') as f:
+        sites_dict = json.load(f)
+
+    base_path = filepath.parent
+    sites = []
+    for e in sites_dict['sites']:
+        site = Site(
+            name=e['name'],
+            dump_filepath=base_path / e['dump'],
+            textfile_filepath=base_path / e['textfile'],
+            output_path=base_path / e['output'])
+        if 'table_prefix' in e:
+            site.table_prefix = e['table_prefix']
+        sites.append(site)
+
+    for attribute in ('name', 'output_path'):
+        values = [getattr(e, attribute) for e in sites]
+        duplicates = sorted({str(e) for e in values if values.count(e) > 1})
+        if duplicates:
+            raise ValueError(
+                f'Sites in {str(filepath)!r} share the same {attribute}:  '
+                f'{", ".join(duplicates)}')
+
+    return sites
+
+
+def run_site(site: Site, pipeline_kwargs: dict) -> SiteResult:
+    """
+    Runs steps 01 through 04 for a site (see 'pipeline.main') with the options
+        in 'pipeline_kwargs'; an error is returned in the result instead of
+        being raised, so that it does not stop the other sites
+    """
+
+    start_time = time.perf_counter()
+    try:
+        pipeline.main(
+            input_path=site.dump_filepath.parent,
+            output_path=site.output_path,
+            dump_filename=site.dump_filepath.name,
+            table_prefix=site.table_prefix,
+            textfile_filepath=site.textfile_filepath,
+            **pipeline_kwargs)
+    except Exception:
+        return SiteResult(
+            site.name, False, time.perf_counter() - start_time,
+            error=traceback.format_exc())
+    seconds = time.perf_counter() - start_time
+
+    markdown_file_n = sum(
+        1 for _ in (site.output_path / 'md_posts').glob('*.md'))
+
+    return SiteResult(site.name, True, seconds, markdown_file_n)
+
+
+def run_site_in_process(
+    site: Site, pipeline_kwargs: dict,
+    connection: multiprocessing.connection.Connection):
+    """
+    Runs 'run_site' in a process started by 'run_sites' and sends its result
+        back through 'connection'
+    """
+
+    connection.send(run_site(site, pipeline_kwargs))
+    connection.close()
+
+
+def run_sites(
+    sites: list[Site], site_worker_n: int | None=None,
+    **pipeline_kwargs) -> list[SiteResult]:
+    """
+    Runs the pipeline for each site (see 'run_site') in a process of its own,
+        up to 'site_worker_n' processes at a time, which defaults to the number
+        of CPUs, and returns the results in the order of 'sites'
+
+    Each site runs in a new process, so that no state, like the metrics of
+        'instrumentation.py', and no memory is carried from one site to the
+        next; if a process dies before it returns its result, e.g., because it
+        is killed for running out of memory, only its site fails
+
+    'pipeline_kwargs' are passed to 'pipeline.main'; if they include a
+        'worker_n' greater than 1, each site also starts its own pool of that
+        many processes
+    """
+
+    if not sites:
+        return []
+
+    if site_worker_n is None:
+        site_worker_n = os.cpu_count() or 1
+    site_worker_n = max(1, min(site_worker_n, len(sites)))
+
+    results = {}
+    pending = list(sites)
+    running = {}
+    mp_context = multiprocessing.get_context('spawn')
+
+    try:
+        while pending or running:
+
+            while pending and len(running) < site_worker_n:
+                site = pending.pop(0)
+                receiver, sender = mp_context.Pipe(duplex=False)
+                process = mp_context.Process(
+                    target=run_site_in_process,
+                    args=(site, pipeline_kwargs, sender))
+                process.start()
+                # the parent's copy of the sending end is closed, so that the
+                #   receiving end reaches its end if the process dies
+                sender.close()
+                running[receiver] = (site, process, time.perf_counter())
+
+            # the receiving ends, rather than the processes, are waited for,
+            #   so that a process is not left waiting to send a result that is
+            #   longer than the pipe's buffer
+            for receiver in multiprocessing.connection.wait(list(running)):
+                site, process, start_time = running.pop(receiver)
+                try:
+                    results[site.name] = receiver.recv()
+                except EOFError:
+                    process.join()
+                    results[site.name] = SiteResult(
+                        site.name, False, time.perf_counter() - start_time,
+                        error=(
+                            f'The process of site {site.name!r} exited with '
+                            f'code {process.exitcode} before it returned a '
+                            'result'))
+                receiver.close()
+                process.join()
+
+    finally:
+        for receiver, (_, process, _) in running.items():
+            process.terminate()
+            process.join()
+            receiver.close()
+
+    return [results[e.name] for e in sites]
+
+
+def format_summary(results: list[SiteResult], seconds: float) -> str:
+    """
+    Formats the results of a batch as a table of the sites, followed by the
+        error of each site that failed, and the total wall-clock time
+    """
+
+    name_width = max([len('site')] + [len(e.name) for e in results])
+    lines = [f'{"site":<{name_width}}  status  seconds  markdown files']
+    for e in results:
+        status = 'ok' if e.succeeded else 'failed'
+        lines.append(
+            f'{e.name:<{name_width}}  {status:<6}  {e.seconds:>7.1f}  '
+            f'{e.markdown_file_n:>14}')
+
+    for e in results:
+        if not e.succeeded:
+            lines.append(f'\n{e.name} failed:\n{e.error.rstrip()}')
+
+    succeeded_n = sum(e.succeeded for e in results)
+    lines.append(
+        f'\n{succeeded_n} of {len(results)} sites succeeded in '
+        f'{seconds:.1f} seconds')
+
+    return '\n'.join(lines)
+
+
+def save_summary(results: list[SiteResult], filepath: Path):
+    """
+    Saves the results of a batch to a JSON file
+    """
+
+    with open(filepath, 'w', encoding='utf-8') as f:
+        json.dump({'sites': [asdict(e) for e in results]}, f, indent=2)
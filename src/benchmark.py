@@ -0,0 +1,272 @@
+#! /usr/bin/env python3
+
+import json
+import time
+import platform
+import multiprocessing
+from pathlib import Path
+from typing import Any, Callable
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+
+import polars as pl
+
+import s01
+import s02
+import s03
+import s04
+from generate_corpus import CorpusSettings, generate_corpus
+from instrumentation import get_peak_rss
+
+
+@dataclass
+class StageBenchmark:
+    """
+    A function of a stage to time
+
+    setup:  prepares the function's inputs from the corpus directory; it is
+        not timed
+    run:  runs the function on the inputs and returns the number of rows that
+        it processed
+    input_bytes:  returns the number of bytes of the function's inputs, from
+        which its throughput is calculated
+    """
+    setup: Callable[[Path], Any]
+    run: Callable[[Any], int]
+    input_bytes: Callable[[Any], int]
+
+
+def read_posts_lines(corpus_path: Path) -> list[str]:
+
+    txt = s01.read_sql_dump_lines(corpus_path / 'localhost.sql.gz')
+    lines = list(s01.filter_sql_to_correct_table(txt))
+
+    return lines
+
+
+def read_all_posts(corpus_path: Path) -> pl.DataFrame:
+
+    df = s01.read_tables_from_sql_dump(
+        corpus_path / 'localhost.sql.gz', posts_colnames=None,
+        posts_row_filter=None)['posts']
+
+    return df
+
+
+def read_website_read_posts(corpus_path: Path) -> pl.DataFrame:
+
+    df = s01.read_tables_from_sql_dump(
+        corpus_path / 'localhost.sql.gz')['posts']
+
+    return df
+
+
+def read_merged_posts(corpus_path: Path) -> pl.DataFrame:
+
+    df = s02.select_website_read_posts(read_website_read_posts(corpus_path))
+    posts_df = s03.read_posts_text_file(corpus_path / '01posts.txt')
+    df2, _ = s03.merge_website_and_textfile_posts(df, posts_df)
+
+    return df2
+
+
+def count_string_bytes(strings) -> int:
+    return sum(
+        len(e) if isinstance(e, bytes) else len(e.encode('utf-8')) 
+        for e in strings if e is not None)
+
+
+def count_table_lines(lines: list[str] | list[bytes]) -> int:
+
+    line_n = 0
+    for _ in s01.filter_sql_to_correct_table(lines):
+        line_n += 1
+
+    return line_n
+
+
+def convert_posts_to_markdown(df: pl.DataFrame) -> int:
+
+    post_n = 0
+    for row in df.iter_rows(named=True):
+        s04.convert_post_to_markdown(row)
+        post_n += 1
+
+    return post_n
+
+
+stage_benchmarks = {
+    'filter_sql_to_correct_table': StageBenchmark(
+        setup=lambda path: list(
+            s01.read_sql_dump_lines(path / 'localhost.sql.gz')),
+        run=count_table_lines,
+        input_bytes=count_string_bytes),
+    'filter_sql_to_correct_table_bytes': StageBenchmark(
+        setup=lambda path: list(
+            s01.read_sql_dump_byte_lines(path / 'localhost.sql.gz')),
+        run=count_table_lines,
+        input_bytes=count_string_bytes),
+    'create_posts_dataframe': StageBenchmark(
+        setup=read_posts_lines,
+        run=lambda lines: len(s01.create_posts_dataframe(lines)),
+        input_bytes=count_string_bytes),
+    'create_posts_dataframe_projected': StageBenchmark(
+        setup=read_posts_lines,
+        run=lambda lines: len(s01.create_posts_dataframe(
+            lines, s01.website_read_post_columns,
+            s01.is_website_read_post)),
+        input_bytes=count_string_bytes),
+    'select_website_read_posts': StageBenchmark(
+        setup=read_all_posts,
+        run=lambda df: len(s02.select_website_read_posts(df)),
+        input_bytes=lambda df: df.estimated_size()),
+    'extract_urls_from_post_content': StageBenchmark(
+        setup=lambda path: read_website_read_posts(path)['post_content'],
+        run=lambda srs: len(s02.extract_urls_from_post_content(srs)),
+        input_bytes=lambda srs: srs.estimated_size()),
+    'read_posts_text_file': StageBenchmark(
+        setup=lambda path: path / '01posts.txt',
+        run=lambda filepath: len(s03.read_posts_text_file(filepath)),
+        input_bytes=lambda filepath: filepath.stat().st_size),
+    'convert_posts_text_file_to_dataframe': StageBenchmark(
+        setup=lambda path: s03.read_text_file_lines(path / '01posts.txt'),
+        run=lambda lines: len(s03.convert_posts_text_file_to_dataframe(lines)),
+        input_bytes=lambda lines: lines.nbytes),
+    'convert_post_to_markdown': StageBenchmark(
+        setup=read_merged_posts,
+        run=convert_posts_to_markdown,
+        input_bytes=lambda df: df.estimated_size()),
+    'render_posts_markdown': StageBenchmark(
+        setup=read_merged_posts,
+        run=lambda df: len(s04.render_posts_markdown(df)),
+        input_bytes=lambda df: df.estimated_size()),
+    }
+
+
+def run_stage_benchmark(
+    stage_name: str, corpus_path: Path, repeat_n: int) -> dict[str, Any]:
+    """
+    Times a stage benchmark 'repeat_n' times and reports its fastest time, its
+        throughput at that time, and the peak memory of the process
+
+    This is run in a new process for each benchmark, so that the peak memory
+        is that of the benchmark alone; the peak memory after the inputs are
+        prepared is also reported, so that the memory of the benchmark itself
+        can be distinguished from that of its inputs
+    """
+
+    benchmark = stage_benchmarks[stage_name]
+
+    inputs = benchmark.setup(corpus_path)
+    input_bytes = benchmark.input_bytes(inputs)
+    setup_peak_rss = get_peak_rss()
+
+    seconds = []
+    for _ in range(repeat_n):
+        start_time = time.perf_counter()
+        row_n = benchmark.run(inputs)
+        seconds.append(time.perf_counter() - start_time)
+
+    min_seconds = min(seconds)
+    result = {
+        'seconds': min_seconds,
+        'all_seconds': seconds,
+        'row_n': row_n,
+        'input_bytes': input_bytes,
+        'rows_per_second': row_n / min_seconds if min_seconds else None,
+        'mb_per_second': (
+            input_bytes / 2**20 / min_seconds if min_seconds else None),
+        'setup_peak_rss_bytes': setup_peak_rss,
+        'peak_rss_bytes': get_peak_rss()}
+
+    return result
+
+
+def run_benchmarks(
+    corpus_path: Path, stage_names: list[str] | None=None,
+    repeat_n: int=3) -> dict[str, dict[str, Any]]:
+    """
+    Runs each stage benchmark in its own process on the corpus in 'corpus_path'
+    """
+
+    if stage_names is None:
+        stage_names = list(stage_benchmarks)
+
+    results = {}
+    mp_context = multiprocessing.get_context('spawn')
+    for stage_name in stage_names:
+        with ProcessPoolExecutor(1, mp_context=mp_context) as executor:
+            results[stage_name] = executor.submit(
+                run_stage_benchmark, stage_name, corpus_path, repeat_n
+                ).result()
+
+    return results
+
+
+def compare_benchmarks(
+    baseline_filepath: Path | str,
+    comparison_filepath: Path | str) -> pl.DataFrame:
+    """
+    Compares the times and peak memory of the stages in two benchmark result
+        files; ratios below 1 mean that the comparison is faster or smaller
+        than the baseline
+    """
+
+    results = []
+    for filepath in [baseline_filepath, comparison_filepath]:
+        with open(filepath, encoding='utf-8') as f:
+            results.append(json.load(f)['results'])
+    baseline_results, comparison_results = results
+
+    rows = []
+    for stage_name, baseline in baseline_results.items():
+        if stage_name not in comparison_results:
+            continue
+        comparison = comparison_results[stage_name]
+        rows.append((
+            stage_name, baseline['seconds'], comparison['seconds'],
+            comparison['seconds'] / baseline['seconds'],
+            comparison['peak_rss_bytes'] / baseline['peak_rss_bytes']))
+
+    comparison_df = pl.DataFrame(
+        rows, orient='row',
+        schema=[
+            'stage', 'baseline_seconds', 'comparison_seconds', 'time_ratio',
+            'peak_rss_ratio'])
+
+    return comparison_df
+
+
+def main(
+    settings: CorpusSettings | None=None,
+    stage_names: list[str] | None=None, repeat_n: int=3):
+    """
+    Generates a synthetic corpus, runs the stage benchmarks on it and saves
+        the results to a JSON file in the 'benchmark' directory, named with the
+        time of the run, so that runs can be compared with 'compare_benchmarks'
+    """
+
+    benchmark_path = Path.cwd() / 'benchmark'
+    corpus_path = benchmark_path / 'input'
+
+    corpus_info = generate_corpus(corpus_path, settings)
+    results = run_benchmarks(corpus_path, stage_names, repeat_n)
+
+    benchmark_results = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'polars': pl.__version__,
+        'platform': platform.platform(),
+        'cpu_count': multiprocessing.cpu_count(),
+        'corpus': corpus_info,
+        'results': results}
+
+    output_filename = (
+        'benchmark_' + time.strftime('%Y%m%d_%H%M%S') + '.json')
+    output_filepath = benchmark_path / output_filename
+    with open(output_filepath, 'w', encoding='utf-8') as f:
+        json.dump(benchmark_results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
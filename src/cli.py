@@ -0,0 +1,497 @@
+#! /usr/bin/env python3
+
+import sys
+import time
+import argparse
+from pathlib import Path
+from dataclasses import dataclass
+
+
+# Only the standard library is imported at the top of this module; each
+#   command imports the step(s) that it runs, so that Polars, BeautifulSoup
+#   and the other dependencies are imported only when a step actually runs.
+#   This keeps commands that do not run a step, like 'status', fast.
+
+
+@dataclass
+class StageFiles:
+    """
+    The files that a step reads and writes
+
+    inputs:  names of files in the input directory
+    intermediates:  names of files in the output directory that the step reads
+    outputs:  names of files in the output directory that the step writes
+
+    The names of the files that the steps pass to each other are without the
+        suffix of the format in which they are saved (see 'intermediates.py')
+    """
+    inputs: tuple[str, ...]=()
+    intermediates: tuple[str, ...]=()
+    outputs: tuple[str, ...]=()
+
+
+# the name of the SQL dump file, unless another is given
+default_dump_filename = 'localhost.sql.gz'
+
+stage_files = {
+    's01': StageFiles(
+        inputs=(default_dump_filename,),
+        outputs=('s01_posts',)),
+    's02': StageFiles(
+        intermediates=('s01_posts',),
+        outputs=('s02_website_read_posts',)),
+    's03': StageFiles(
+        inputs=('01posts.txt',),
+        intermediates=('s02_website_read_posts',),
+        outputs=(
+            's03_website_textfile_merged',
+            's03_unmatched_url_candidates.csv')),
+    's04': StageFiles(
+        intermediates=('s03_website_textfile_merged',),
+        outputs=('md_posts',)),
+    }
+
+# the suffixes of the formats in which the steps may save their files, as in
+#   'intermediates.intermediate_suffixes', which is not imported because it 
+#   imports Polars
+intermediate_suffixes = ('', '.parquet', '.arrow')
+
+
+def get_modified_time(filepath: Path) -> float | None:
+    """
+    Returns the time at which a file or directory, in any of the intermediate
+        formats, was last modified, or 'None' if it does not exist
+
+    Step 04 updates the time of its markdown directory whenever it runs, even
+        if no markdown file changed
+    """
+
+    for e in intermediate_suffixes:
+        suffixed_filepath = filepath.with_name(filepath.name + e)
+        if suffixed_filepath.exists():
+            return suffixed_filepath.stat().st_mtime
+
+    return None
+
+
+def get_stale_stages(
+    input_path: Path, output_path: Path,
+    dump_filename: str=default_dump_filename) -> dict[str, str]:
+    """
+    Returns the steps whose outputs are missing or older than their inputs,
+        with the reason that each is stale, if the SQL dump file is named
+        'dump_filename'
+
+    Only modification times are compared, so that no dependency needs to be
+        imported to check them
+    """
+
+    stale_stages = {}
+    stale_outputs = set()
+    for stage_name, files in stage_files.items():
+
+        input_filenames = [
+            dump_filename if e == default_dump_filename else e
+            for e in files.inputs]
+        input_filepaths = (
+            [input_path / e for e in input_filenames] +
+            [output_path / e for e in files.intermediates])
+        output_filepaths = [output_path / e for e in files.outputs]
+
+        input_times = [get_modified_time(e) for e in input_filepaths]
+        output_times = [get_modified_time(e) for e in output_filepaths]
+
+        missing_filenames = [
+            e.name
+            for e, t in zip(
+                input_filepaths + output_filepaths, input_times + output_times)
+            if t is None]
+
+        if missing_filenames:
+            stale_stages[stage_name] = (
+                'missing ' + ', '.join(missing_filenames))
+        elif stale_outputs & set(files.intermediates):
+            stale_stages[stage_name] = 'an earlier step is stale'
+        elif max(input_times) > min(output_times):
+            stale_stages[stage_name] = 'inputs changed'
+        else:
+            continue
+
+        stale_outputs.update(files.outputs)
+
+    return stale_stages
+
+
+def run_status(args: argparse.Namespace) -> int:
+
+    stale_stages = get_stale_stages(
+        args.input_path, args.output_path, args.dump_filename)
+
+    for stage_name in stage_files:
+        status = stale_stages.get(stage_name, 'up to date')
+        print(f'{stage_name}:  {status}')
+
+    return 1 if stale_stages else 0
+
+
+def get_intermediate_format(args: argparse.Namespace):
+
+    from intermediates import IntermediateFormat
+    intermediate_format = IntermediateFormat(
+        file_format=args.intermediate_format,
+        partition_by_year=args.partition_by_year)
+
+    return intermediate_format
+
+
+def run_s01(args: argparse.Namespace) -> int:
+
+    import s01
+    s01.main(
+        worker_n=args.worker_n, write_csv=args.write_csv,
+        input_path=args.input_path, output_path=args.output_path,
+        intermediate_format=get_intermediate_format(args),
+        dump_filename=args.dump_filename, gzip_command=args.gzip_command,
+        table_names=args.tables, table_prefix=args.table_prefix,
+        build_index=args.build_index)
+
+    return 0
+
+
+def run_s02(args: argparse.Namespace) -> int:
+
+    import s02
+    s02.main(
+        worker_n=args.worker_n, use_cache=not args.no_cache,
+        output_path=args.output_path,
+        intermediate_format=get_intermediate_format(args),
+        batch_size=args.batch_size)
+
+    return 0
+
+
+def run_s03(args: argparse.Namespace) -> int:
+
+    import s03
+    s03.main(
+        input_path=args.input_path, output_path=args.output_path,
+        intermediate_format=get_intermediate_format(args))
+
+    return 0
+
+
+def run_s04(args: argparse.Namespace) -> int:
+
+    import s04
+    s04.main(
+        use_cache=not args.no_cache, worker_n=args.worker_n,
+        output_path=args.output_path)
+
+    return 0
+
+
+def run_all(args: argparse.Namespace) -> int:
+
+    import pipeline
+    pipeline.main(
+        worker_n=args.worker_n, use_cache=not args.no_cache,
+        write_checkpoints=args.write_checkpoints,
+        input_path=args.input_path, output_path=args.output_path,
+        incremental=args.incremental,
+        intermediate_format=get_intermediate_format(args),
+        dump_filename=args.dump_filename, gzip_command=args.gzip_command,
+        table_prefix=args.table_prefix)
+
+    return 0
+
+
+def run_build(args: argparse.Namespace) -> int:
+
+    import scheduler
+    args.output_path.mkdir(exist_ok=True, parents=True)
+    tasks = scheduler.create_pipeline_tasks(
+        args.input_path, args.output_path, dump_filename=args.dump_filename,
+        table_prefix=args.table_prefix, gzip_command=args.gzip_command,
+        worker_n=args.worker_n, use_cache=not args.no_cache,
+        intermediate_format=get_intermediate_format(args))
+
+    results = scheduler.run_tasks(
+        tasks, args.output_path / scheduler.task_state_filename,
+        worker_n=args.task_worker_n, force=args.force)
+    print(scheduler.format_task_results(results))
+
+    return 0 if all(e.status in ('ran', 'skipped') for e in results) else 1
+
+
+def run_batch(args: argparse.Namespace) -> int:
+
+    import batch
+    sites = batch.load_sites(args.sites_filepath)
+
+    start_time = time.perf_counter()
+    results = batch.run_sites(
+        sites, args.site_worker_n, worker_n=args.worker_n,
+        use_cache=not args.no_cache, 
+        write_checkpoints=args.write_checkpoints, 
+        incremental=args.incremental,
+        intermediate_format=get_intermediate_format(args),
+        gzip_command=args.gzip_command)
+    seconds = time.perf_counter() - start_time
+
+    print(batch.format_summary(results, seconds))
+    if args.summary_filepath:
+        batch.save_summary(results, args.summary_filepath)
+
+    return 0 if all(e.succeeded for e in results) else 1
+
+
+def run_lookup(args: argparse.Namespace) -> int:
+
+    import dump_index
+    df = dump_index.lookup_post(args.output_path, args.post_id)
+
+    dump_filepath = args.input_path / args.dump_filename
+    if (dump_filepath.exists() and 
+        dump_index.is_dump_index_stale(args.output_path, dump_filepath)):
+        print(
+            f'Warning:  {args.dump_filename} has changed since it was indexed; '
+            'run step 01 with --build-index again', file=sys.stderr)
+
+    if df is None:
+        print(f'No post with ID {args.post_id}', file=sys.stderr)
+        return 1
+
+    for colname, value in df.row(0, named=True).items():
+        print(f'{colname}:  {value}')
+
+    return 0
+
+
+def run_equivalence(args: argparse.Namespace) -> int:
+
+    import equivalence
+    corpus = None
+    if args.corpus_path is not None:
+        corpus = equivalence.Corpus(
+            args.corpus_path / args.dump_filename, 
+            args.corpus_path / '01posts.txt', args.table_prefix)
+
+    results = equivalence.main(
+        corpus, fuzz_case_n=args.fuzz_n, seed=args.seed)
+    print(equivalence.format_equivalence_results(results))
+
+    mismatch_n = sum(
+        e['mismatch_n'] 
+        for kind in ['checks', 'fuzzers'] for e in results[kind].values())
+
+    return 1 if mismatch_n else 0
+
+
+def create_parser() -> argparse.ArgumentParser:
+
+    parser = argparse.ArgumentParser(
+        prog='convert-reposts',
+        description=(
+            'Convert re-posts from a WordPress SQL dump file and a text file '
+            'to markdown files for a Zola website'))
+
+    paths_parser = argparse.ArgumentParser(add_help=False)
+    paths_parser.add_argument(
+        '--input-path', type=Path, default=Path.cwd() / 'input',
+        help='directory of the input files (default:  ./input)')
+    paths_parser.add_argument(
+        '--output-path', type=Path, default=Path.cwd() / 'output',
+        help='directory of the output files (default:  ./output)')
+
+    dump_parser = argparse.ArgumentParser(add_help=False)
+    dump_parser.add_argument(
+        '--dump-filename', default=default_dump_filename,
+        help=(
+            'name of the SQL dump file in the input directory, which may be '
+            'compressed with gzip, zstd, xz or bzip2 or not at all '
+            f'(default:  {default_dump_filename})'))
+    dump_parser.add_argument(
+        '--table-prefix', default='_5A5_',
+        help=(
+            'prefix of the names of the WordPress tables in the SQL dump file '
+            '(default:  _5A5_)'))
+
+    gzip_parser = argparse.ArgumentParser(add_help=False)
+    gzip_parser.add_argument(
+        '--gzip-command', default='auto',
+        type=lambda e: None if e == 'none' else e,
+        help=(
+            'command with which to decompress a gzipped SQL dump file, e.g., '
+            '"pigz"; "auto" uses igzip or pigz if either is installed, and '
+            '"none" uses Python (default:  auto)'))
+
+    run_parser = argparse.ArgumentParser(add_help=False)
+    run_parser.add_argument(
+        '--worker-n', type=int, default=1,
+        help='number of processes or threads in which to process posts')
+    run_parser.add_argument(
+        '--no-cache', action='store_true',
+        help='process every post again instead of reading cached results')
+
+    format_parser = argparse.ArgumentParser(add_help=False)
+    format_parser.add_argument(
+        '--intermediate-format', choices=['parquet', 'ipc'], default='parquet',
+        help=(
+            'format of the files that the steps pass to each other; "ipc" '
+            'files are memory-mapped by the next step (default:  parquet)'))
+    format_parser.add_argument(
+        '--partition-by-year', action='store_true',
+        help='save each Parquet file as one file per year of the posts')
+
+    pipeline_parser = argparse.ArgumentParser(add_help=False)
+    pipeline_parser.add_argument(
+        '--write-checkpoints', action='store_true',
+        help="also save each step's output file")
+    pipeline_parser.add_argument(
+        '--incremental', action='store_true',
+        help=(
+            'process only the posts that are new or changed since the last '
+            'incremental run'))
+
+    subparsers = parser.add_subparsers(
+        dest='command', required=True, metavar='command')
+
+    subparser = subparsers.add_parser(
+        'status', parents=[paths_parser, dump_parser, gzip_parser],
+        help=(
+            'list the steps whose outputs are missing or older than their '
+            'inputs; exits with 1 if any are'))
+    subparser.set_defaults(run=run_status)
+
+    subparser = subparsers.add_parser(
+        's01', 
+        parents=[
+            paths_parser, dump_parser, gzip_parser, run_parser, format_parser],
+        help='extract the posts table from the SQL dump file')
+    subparser.add_argument(
+        '--tables', nargs='+', default=['posts'], metavar='TABLE',
+        help=(
+            'names of the tables to extract, without the table prefix '
+            '(default: posts)'))
+    subparser.add_argument(
+        '--write-csv', action='store_true',
+        help='also save the posts table to a CSV file')
+    subparser.add_argument(
+        '--build-index', action='store_true',
+        help=(
+            'also save an index of the posts table, with which the "lookup" '
+            'command reads single posts'))
+    subparser.set_defaults(run=run_s01)
+
+    subparser = subparsers.add_parser(
+        's02', parents=[paths_parser, run_parser, format_parser],
+        help='select the re-posts and extract their URLs')
+    subparser.add_argument(
+        '--batch-size', type=int, default=10_000,
+        help=(
+            'number of posts to read into memory at a time (default:  '
+            '10000)'))
+    subparser.set_defaults(run=run_s02)
+
+    subparser = subparsers.add_parser(
+        's03', parents=[paths_parser, format_parser],
+        help='merge the re-posts with those in the text file')
+    subparser.set_defaults(run=run_s03)
+
+    subparser = subparsers.add_parser(
+        's04', parents=[paths_parser, run_parser],
+        help='write the merged re-posts to markdown files')
+    subparser.set_defaults(run=run_s04, worker_n=8)
+
+    subparser = subparsers.add_parser(
+        'all', 
+        parents=[
+            paths_parser, dump_parser, gzip_parser, run_parser, format_parser,
+            pipeline_parser],
+        help='run steps 01 through 04 in a single process')
+    subparser.set_defaults(run=run_all)
+
+    subparser = subparsers.add_parser(
+        'build', 
+        parents=[
+            paths_parser, dump_parser, gzip_parser, run_parser, format_parser],
+        help=(
+            'run steps 01 through 04 as tasks that each run as soon as the '
+            'tasks that they depend on finish, skipping those whose inputs and '
+            'outputs are unchanged'))
+    subparser.add_argument(
+        '--task-worker-n', type=int, default=2,
+        help=(
+            'number of tasks to run at a time, each in its own process '
+            '(default:  2, as the text file is read while the SQL dump file '
+            'is)'))
+    subparser.add_argument(
+        '--force', action='store_true',
+        help='run every task, even if its inputs and outputs are unchanged')
+    subparser.set_defaults(run=run_build)
+
+    subparser = subparsers.add_parser(
+        'batch', 
+        parents=[gzip_parser, run_parser, format_parser, pipeline_parser],
+        help=(
+            'run steps 01 through 04 for each of several sites, several sites '
+            'at a time'))
+    subparser.add_argument(
+        'sites_filepath', type=Path, metavar='sites-file',
+        help=(
+            'JSON file that lists each site\'s name, SQL dump file, text file, '
+            'output directory and, optionally, table prefix'))
+    subparser.add_argument(
+        '--site-worker-n', type=int, default=None,
+        help=(
+            'number of sites to process at a time, each in its own process '
+            '(default:  number of CPUs)'))
+    subparser.add_argument(
+        '--summary-file', type=Path, dest='summary_filepath',
+        help='also save the summary of the sites to a JSON file')
+    subparser.set_defaults(run=run_batch)
+
+    subparser = subparsers.add_parser(
+        'equivalence', parents=[dump_parser],
+        help=(
+            'check that the fast implementations of the steps give the same '
+            'outputs as their reference implementations, on a corpus and on '
+            'fuzzed inputs; exits with 1 if any differ'))
+    subparser.add_argument(
+        '--corpus-path', type=Path, default=None,
+        help=(
+            'directory of the SQL dump file and the text file to compare on '
+            '(default:  a generated corpus in ./benchmark/input)'))
+    subparser.add_argument(
+        '--fuzz-n', type=int, default=500,
+        help='number of fuzzed inputs for each implementation (default:  500)')
+    subparser.add_argument(
+        '--seed', type=int, default=0,
+        help='seed from which the fuzzed inputs are generated (default:  0)')
+    subparser.set_defaults(run=run_equivalence)
+
+    subparser = subparsers.add_parser(
+        'lookup', parents=[paths_parser, dump_parser],
+        help=(
+            'print a single post from the SQL dump file by its ID, using the '
+            'index saved by "s01 --build-index"'))
+    subparser.add_argument(
+        'post_id', type=int, metavar='ID', help='ID of the post')
+    subparser.set_defaults(run=run_lookup)
+
+    return parser
+
+
+def main(argv: list[str] | None=None) -> int:
+    """
+    Runs the command given on the command line, e.g.,
+        'convert-reposts all --input-path data --worker-n 4'
+    """
+
+    args = create_parser().parse_args(argv)
+
+    return args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+#! /usr/bin/env python3
+
+import bz2
+import gzip
+import lzma
+import shutil
+import tempfile
+import subprocess
+from pathlib import Path
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+
+
+# the first bytes of a file in each compression format
+compression_magic_numbers = {
+    'gzip': b'\x1f\x8b',
+    'zstd': b'\x28\xb5\x2f\xfd',
+    'xz': b'\xfd7zXZ\x00',
+    'bzip2': b'BZh'}
+
+# commands that decompress gzip faster than Python's 'gzip' module, in order
+#   of preference:  'igzip' from ISA-L and the parallel 'pigz'; each is run as
+#   '<command> -dc <file>'
+gzip_commands = ['igzip', 'pigz']
+
+
+def detect_compression(filepath: Path | str) -> str:
+    """
+    Returns the compression format of a file from its first bytes:  'gzip',
+        'zstd', 'xz', 'bzip2' or, if it is not compressed, 'none'
+    """
+
+    with open(filepath, 'rb') as f:
+        header = f.read(8)
+
+    for compression, magic_number in compression_magic_numbers.items():
+        if header.startswith(magic_number):
+            return compression
+
+    return 'none'
+
+
+def find_gzip_command(gzip_command: str | None='auto') -> str | None:
+    """
+    Returns the path of the external command with which to decompress gzip
+        files, or 'None' if Python's 'gzip' module is to be used
+
+    If 'gzip_command' is 'auto', the first of 'gzip_commands' that is
+        installed is used, if any; if it is 'None', no command is used;
+        otherwise, it names the command, which must be installed
+    """
+
+    if gzip_command is None:
+        return None
+
+    if gzip_command == 'auto':
+        for e in gzip_commands:
+            command_path = shutil.which(e)
+            if command_path:
+                return command_path
+        return None
+
+    command_path = shutil.which(gzip_command)
+    if not command_path:
+        raise FileNotFoundError(
+            f'The gzip decompression command {gzip_command!r} is not '
+            'installed')
+
+    return command_path
+
+
+@contextmanager
+def open_command_output(command: list[str]) -> Iterator[BinaryIO]:
+    """
+    Runs a command and yields its standard output as a binary file
+
+    If the output is read to its end, an error is raised if the command
+        failed; if it is not, e.g., because only the start of a file was
+        needed, the command is stopped
+
+    The command's standard error goes to a temporary file rather than to a
+        pipe, which is not read while the output is, so that a command that
+        writes many warnings does not fill the pipe and wait forever
+    """
+
+    # a larger buffer than the default means fewer reads from the pipe
+    with tempfile.TemporaryFile() as stderr_file, subprocess.Popen(
+        command, bufsize=2**20, stdout=subprocess.PIPE,
+        stderr=stderr_file) as process:
+
+        assert process.stdout is not None
+        try:
+            yield process.stdout
+        finally:
+            is_read = process.stdout.read(1) == b''
+            if not is_read:
+                process.kill()
+
+        process.wait()
+        if is_read and process.returncode != 0:
+            # only the end of a long error output, where the error is likely
+            #   to be, is reported
+            stderr_file.seek(0)
+            error = stderr_file.read()[-2**12:].decode('utf-8', 'replace')
+            error = error.strip()
+            raise OSError(
+                f'{command[0]!r} exited with code {process.returncode}:  '
+                f'{error}')
+
+
+def open_zstd(filepath: Path | str):
+    """
+    Opens a zstd file with the optional 'zstandard' package or, if it is not
+        installed, the 'zstd' command
+    """
+
+    try:
+        import zstandard
+    except ImportError:
+        command_path = shutil.which('zstd')
+        if not command_path:
+            raise ImportError(
+                'Reading a zstd file needs the "zstandard" package or the '
+                '"zstd" command')
+        return open_command_output([command_path, '-dc', str(filepath)])
+
+    return zstandard.open(filepath, 'rb')
+
+
+def open_compressed_file(
+    filepath: Path | str, gzip_command: str | None='auto'):
+    """
+    Opens a file as binary for reading, decompressing it if it is compressed
+        with gzip, zstd, xz or bzip2, as detected from its content rather than
+        from its name
+
+    A gzip file is decompressed by an external command, if one is found (see
+        'find_gzip_command')
+    """
+
+    compression = detect_compression(filepath)
+
+    if compression == 'gzip':
+        command_path = find_gzip_command(gzip_command)
+        if command_path:
+            return open_command_output([command_path, '-dc', str(filepath)])
+        return gzip.open(filepath, 'rb')
+    elif compression == 'zstd':
+        return open_zstd(filepath)
+    elif compression == 'xz':
+        return lzma.open(filepath, 'rb')
+    elif compression == 'bzip2':
+        return bz2.open(filepath, 'rb')
+    else:
+        return open(filepath, 'rb')
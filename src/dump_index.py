@@ -0,0 +1,267 @@
+#! /usr/bin/env python3
+
+import json
+import zlib
+import shutil
+import polars as pl
+from pathlib import Path
+
+from s01 import (
+    read_sql_dump_byte_lines, filter_sql_to_correct_table, parse_sql_values,
+    create_posts_columns, append_sql_rows_to_columns,
+    convert_posts_columns_to_dataframe)
+from intermediates import replace_path
+from instrumentation import instrumented, record_metrics
+
+
+# Python's 'zlib' cannot resume decompressing a gzip stream in the middle, as
+#   an index of checkpoints into the dump itself would need, so the index
+#   keeps its own copy of the lines of the posts table, compressed in blocks
+#   that are each decompressed by themselves, as in the BGZF format; looking
+#   up a post decompresses only the block that holds it
+
+# increment when a change to the index changes its files, so that an index
+#   built by the earlier code is rebuilt instead of being read
+dump_index_version = 1
+
+# the name of the directory in the output directory in which the index is
+#   saved
+dump_index_dirname = 's01_dump_index'
+
+# the number of uncompressed bytes of lines after which a block is ended; a
+#   longer line is a block by itself
+index_block_bytes = 2**16
+
+
+class DumpIndexWriter:
+    """
+    Writes an index of the posts table of the SQL dump file, with which a
+        single post can be read by its ID without reading the dump (see
+        'lookup_post'), from the lines of the table as they are added by
+        'add_line', so that the index can be built while step 01 reads the
+        dump, instead of reading it again (see 's01.read_tables_from_sql_dump')
+
+    Used as a context manager, the index replaces any earlier index in
+        'output_path' only after all lines have been added and it is completely
+        written; if an error is raised, the partial index is deleted
+    """
+
+    def __init__(
+        self, dump_filepath: Path, output_path: Path,
+        table_prefix: str='_5A5_'):
+
+        self.dump_filepath = Path(dump_filepath)
+        self.table_prefix = table_prefix
+        self.index_path = output_path / dump_index_dirname
+        self.temp_index_path = self.index_path.with_name(
+            '.' + self.index_path.name + '.tmp')
+
+        self.entries = {
+            'ID': [], 'block_offset': [], 'block_bytes': [],
+            'line_offset': [], 'line_bytes': []}
+        self.block_lines = []
+        self.block_line_ids = []
+        self.block_offset = 0
+        self.block_len = 0
+
+        # the dump is described as it was when its lines began to be read
+        dump_stat = self.dump_filepath.stat()
+        self.info = {
+            'version': dump_index_version,
+            'dump_filename': self.dump_filepath.name,
+            'dump_bytes': dump_stat.st_size,
+            'dump_mtime_ns': dump_stat.st_mtime_ns,
+            'table_prefix': table_prefix}
+
+        shutil.rmtree(self.temp_index_path, ignore_errors=True)
+        self.temp_index_path.mkdir(parents=True)
+        self.blocks_file = open(self.temp_index_path / 'blocks.bin', 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def add_line(self, line: str):
+        """
+        Adds a line of the posts table to the index
+        """
+
+        # the 'INSERT' line of a dump with one row per line holds no rows
+        ids = [row[0] for row in parse_sql_values(line, unescape=False)]
+        if not ids:
+            return
+        line_bytes = line.encode('utf-8')
+        self.block_lines.append(line_bytes)
+        self.block_line_ids.append(ids)
+        self.block_len += len(line_bytes)
+        if self.block_len >= index_block_bytes:
+            self.write_block()
+
+    def write_block(self):
+
+        block = zlib.compress(b''.join(self.block_lines))
+        self.blocks_file.write(block)
+
+        line_offset = 0
+        for line, ids in zip(self.block_lines, self.block_line_ids):
+            for e in ids:
+                self.entries['ID'].append(e)
+                self.entries['block_offset'].append(self.block_offset)
+                self.entries['block_bytes'].append(len(block))
+                self.entries['line_offset'].append(line_offset)
+                self.entries['line_bytes'].append(len(line))
+            line_offset += len(line)
+
+        self.block_offset += len(block)
+        self.block_len = 0
+        self.block_lines.clear()
+        self.block_line_ids.clear()
+
+    def close(self) -> int:
+        """
+        Writes the rest of the index, replaces any earlier index with it and
+            returns the number of posts indexed
+        """
+
+        try:
+            if self.block_lines:
+                self.write_block()
+            self.blocks_file.close()
+
+            pl.DataFrame(self.entries, schema={
+                'ID': pl.Int64, 'block_offset': pl.Int64,
+                'block_bytes': pl.Int64, 'line_offset': pl.Int64,
+                'line_bytes': pl.Int64}).write_parquet(
+                    self.temp_index_path / 'index.parquet', statistics=True)
+
+            info_filepath = self.temp_index_path / 'info.json'
+            with open(info_filepath, 'w', encoding='utf-8') as f:
+                json.dump(self.info, f)
+
+            replace_path(self.temp_index_path, self.index_path)
+        except BaseException:
+            self.discard()
+            raise
+
+        post_n = len(self.entries['ID'])
+        record_metrics(
+            indexed_posts=post_n,
+            bytes_written=sum(
+                e.stat().st_size for e in self.index_path.iterdir()))
+
+        return post_n
+
+    def discard(self):
+        """
+        Deletes the partly written index, leaving any earlier index in place
+        """
+
+        self.blocks_file.close()
+        shutil.rmtree(self.temp_index_path, ignore_errors=True)
+
+
+@instrumented('dump_index.build_dump_index')
+def build_dump_index(
+    dump_filepath: Path, output_path: Path, table_prefix: str='_5A5_',
+    gzip_command: str | None='auto') -> Path:
+    """
+    Builds the index of the posts table of the SQL dump file (see
+        'DumpIndexWriter') by reading the dump by itself and returns the
+        directory in which it is saved
+
+    Step 01 builds the index while it reads the dump, without reading it
+        again (see 's01.main'); this is for an index of a dump whose tables
+        are already extracted
+    """
+
+    with DumpIndexWriter(dump_filepath, output_path, table_prefix) as writer:
+        txt = read_sql_dump_byte_lines(dump_filepath, gzip_command)
+        for line in filter_sql_to_correct_table(txt, 'posts', table_prefix):
+            writer.add_line(line)
+
+    return writer.index_path
+
+
+def load_dump_index_info(output_path: Path) -> dict:
+    """
+    Returns what the index in 'output_path' was built from:  the name, size
+        and modification time of the SQL dump file and the table prefix
+
+    An error is raised if there is no index or if it was built by a different
+        version of the code
+    """
+
+    info_filepath = output_path / dump_index_dirname / 'info.json'
+    if not info_filepath.exists():
+        raise FileNotFoundError(
+            f'No index of the SQL dump file in {str(output_path)!r}; build it '
+            'with step 01')
+
+    with open(info_filepath, encoding='utf-8') as f:
+        info = json.load(f)
+
+    if info.get('version') != dump_index_version:
+        raise ValueError(
+            f'The index of the SQL dump file in {str(output_path)!r} was built '
+            'by a different version; build it again with step 01')
+
+    return info
+
+
+def is_dump_index_stale(output_path: Path, dump_filepath: Path) -> bool:
+    """
+    Returns whether the SQL dump file has changed since the index in
+        'output_path' was built from it
+    """
+
+    info = load_dump_index_info(output_path)
+    dump_stat = dump_filepath.stat()
+
+    is_stale = (
+        dump_stat.st_size != info['dump_bytes'] or
+        dump_stat.st_mtime_ns != info['dump_mtime_ns'])
+
+    return is_stale
+
+
+def lookup_post(output_path: Path, post_id: int) -> pl.DataFrame | None:
+    """
+    Reads the post with the ID 'post_id' from the index of the SQL dump file in
+        'output_path' (see 'build_dump_index') as a DataFrame of a single row
+        with all the columns of the posts table, or returns 'None' if the dump
+        has no such post
+
+    Only the index's entry for the post and the block that holds the post are
+        read and decompressed
+    """
+
+    load_dump_index_info(output_path)
+    index_path = output_path / dump_index_dirname
+
+    entry_df = (
+        pl.scan_parquet(index_path / 'index.parquet')
+        .filter(pl.col('ID') == post_id)
+        .head(1)
+        .collect())
+    if entry_df.is_empty():
+        return None
+    entry = entry_df.row(0, named=True)
+
+    with open(index_path / 'blocks.bin', 'rb') as f:
+        f.seek(entry['block_offset'])
+        block = zlib.decompress(f.read(entry['block_bytes']))
+    line_start = entry['line_offset']
+    line = block[line_start:line_start+entry['line_bytes']].decode('utf-8')
+
+    # a line of a dump made with '--extended-insert' holds many rows
+    columns = create_posts_columns()
+    append_sql_rows_to_columns(
+        line, columns, 'posts', row_filter=lambda row: row[0] == post_id)
+    df = convert_posts_columns_to_dataframe(columns)
+
+    return df
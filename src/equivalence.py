@@ -0,0 +1,636 @@
+#! /usr/bin/env python3
+
+import json
+import time
+import random
+import datetime
+import platform
+import warnings
+from ast import literal_eval
+from pathlib import Path
+from typing import Any, Callable
+from dataclasses import dataclass
+
+import polars as pl
+
+import s01
+import s02
+import s03
+import s04
+from generate_corpus import CorpusSettings, generate_corpus, format_sql_value
+
+
+# The fast paths of the pipeline, i.e., the MySQL value parser of step 01, the
+#   string expressions that extract URLs in step 02 and the column expressions
+#   that render markdown in step 04, are each checked against the reference
+#   implementation that they replaced:  'literal_eval', the HTML parser and
+#   'convert_post_to_markdown' with 'validators.url'.  A faster implementation
+#   is adopted only if these checks find no difference.
+
+
+@dataclass
+class Corpus:
+    """
+    The input files on which the implementations are compared
+    """
+    dump_filepath: Path
+    textfile_filepath: Path
+    table_prefix: str='_5A5_'
+
+
+@dataclass
+class EquivalenceCheck:
+    """
+    A fast implementation and the reference implementation whose outputs it
+        must reproduce
+
+    setup:  prepares the inputs of both implementations from the corpus; it is
+        not timed
+    reference, candidate:  compute the outputs from the inputs
+    compare:  returns a description of each difference between the outputs of
+        the reference and of the candidate
+    """
+    setup: Callable[[Corpus], Any]
+    reference: Callable[[Any], Any]
+    candidate: Callable[[Any], Any]
+    compare: Callable[[Any, Any], list[str]]
+
+
+def shorten(value: Any, max_len: int=80) -> str:
+
+    value_repr = repr(value)
+    if len(value_repr) > max_len:
+        value_repr = value_repr[:max_len] + '...'
+
+    return value_repr
+
+
+def compare_dataframes(
+    reference_df: pl.DataFrame, candidate_df: pl.DataFrame) -> list[str]:
+    """
+    Returns a description of each value that differs between two DataFrames,
+        by row and column, after any difference in their columns or lengths
+    """
+
+    if reference_df.schema != candidate_df.schema:
+        return [
+            f'columns:  reference {dict(reference_df.schema)} != candidate '
+            f'{dict(candidate_df.schema)}']
+
+    mismatches = []
+    if len(reference_df) != len(candidate_df):
+        mismatches.append(
+            f'rows:  reference {len(reference_df)} != candidate '
+            f'{len(candidate_df)}')
+
+    rows = zip(
+        reference_df.iter_rows(named=True), candidate_df.iter_rows(named=True))
+    for i, (reference_row, candidate_row) in enumerate(rows):
+        for colname, reference_value in reference_row.items():
+            candidate_value = candidate_row[colname]
+            if reference_value != candidate_value:
+                mismatches.append(
+                    f'row {i}, column {colname!r}:  reference '
+                    f'{shorten(reference_value)} != candidate '
+                    f'{shorten(candidate_value)}')
+
+    return mismatches
+
+
+def compare_lists(reference: list, candidate: list) -> list[str]:
+    """
+    Returns a description of each item that differs between two lists
+    """
+
+    mismatches = []
+    if len(reference) != len(candidate):
+        mismatches.append(
+            f'rows:  reference {len(reference)} != candidate {len(candidate)}')
+
+    for i, (e1, e2) in enumerate(zip(reference, candidate)):
+        if e1 != e2:
+            mismatches.append(
+                f'row {i}:  reference {shorten(e1)} != candidate '
+                f'{shorten(e2)}')
+
+    return mismatches
+
+
+##################################################
+# REFERENCE IMPLEMENTATIONS
+##################################################
+
+def parse_sql_rows_reference(line: str) -> list[tuple]:
+    """
+    Parses the rows in a line of a MySQL dump with Python's 'literal_eval', as
+        step 01 originally did
+
+    Python reads what a MySQL dump writes as MySQL does, except for '\\Z' and
+        for '\\0' before a digit, which Python reads as an octal escape
+    """
+
+    insert_match = s01.sql_insert_pattern.match(line)
+    values = line[insert_match.end():] if insert_match else line
+    if values[:1] != '(':
+        return []
+
+    # Python warns about the backslashes that it does not read as escapes,
+    #   like those before '%' and '_', which MySQL also keeps
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        rows = literal_eval('[' + values.rstrip().rstrip(';,') + ']')
+
+    return rows
+
+
+def create_posts_dataframe_reference(lines: list[str]) -> pl.DataFrame:
+    """
+    Recreates the posts table from the lines of the SQL dump file with
+        'parse_sql_rows_reference'
+    """
+
+    rows = [row for e in lines for row in parse_sql_rows_reference(e)]
+    df = pl.DataFrame(rows, schema=s01.posts_schema, orient='row')
+
+    return s01.convert_posts_date_columns(df)
+
+
+def select_website_read_post_rows(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Selects the rows and columns of the posts table that 'create_posts_dataframe'
+        keeps with 'website_read_post_columns' and 'is_website_read_post'
+    """
+
+    post_status = pl.col('post_status')
+    is_website_read_post = (
+        pl.col('post_type').eq('post') &
+        post_status.is_not_null() & pl.col('post_title').is_not_null() &
+        post_status.ne('inherit') & ~post_status.str.contains('draft') &
+        pl.col('post_title').str.to_lowercase().str.starts_with('what i'))
+
+    df2 = (
+        df.filter(is_website_read_post.fill_null(False))
+        .select(s01.website_read_post_columns))
+
+    return df2
+
+
+def extract_urls_reference(post_content: pl.Series) -> list[list[str]]:
+    return [s02.extract_url_from_post_html(e) for e in post_content]
+
+
+def render_posts_markdown_reference(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Converts each post to the filename and text of its markdown file row by
+        row, with 'convert_post_to_markdown' and 'render_post_text'
+    """
+
+    rows = []
+    for row in df.iter_rows(named=True):
+        post = s04.convert_post_to_markdown(row)
+        rows.append((post.filename, s04.render_post_text(post)))
+
+    md_df = pl.DataFrame(
+        rows, orient='row', schema={'filename': pl.Utf8, 'text': pl.Utf8})
+
+    return md_df
+
+
+##################################################
+# CORPUS CHECKS
+##################################################
+
+def read_posts_lines(corpus: Corpus) -> list[str]:
+
+    txt = s01.read_sql_dump_lines(corpus.dump_filepath)
+    lines = list(s01.filter_sql_to_correct_table(
+        txt, 'posts', corpus.table_prefix))
+
+    return lines
+
+
+def read_website_read_posts(corpus: Corpus) -> pl.DataFrame:
+
+    df = s01.read_tables_from_sql_dump(
+        corpus.dump_filepath, table_prefix=corpus.table_prefix)['posts']
+
+    return df
+
+
+def read_merged_posts(corpus: Corpus) -> pl.DataFrame:
+
+    df = s02.select_website_read_posts(read_website_read_posts(corpus))
+    posts_df = s03.read_posts_text_file(corpus.textfile_filepath)
+    df2, _ = s03.merge_website_and_textfile_posts(df, posts_df)
+
+    return df2.select(s04.markdown_input_colnames)
+
+
+equivalence_checks = {
+    'create_posts_dataframe': EquivalenceCheck(
+        setup=read_posts_lines,
+        reference=create_posts_dataframe_reference,
+        candidate=s01.create_posts_dataframe,
+        compare=compare_dataframes),
+    'create_posts_dataframe_projected': EquivalenceCheck(
+        setup=read_posts_lines,
+        reference=lambda lines: select_website_read_post_rows(
+            create_posts_dataframe_reference(lines)),
+        candidate=lambda lines: s01.create_posts_dataframe(
+            lines, s01.website_read_post_columns, s01.is_website_read_post),
+        compare=compare_dataframes),
+    'extract_urls_from_post_content': EquivalenceCheck(
+        setup=lambda corpus: read_website_read_posts(corpus)['post_content'],
+        reference=extract_urls_reference,
+        candidate=s02.extract_urls_from_post_content,
+        compare=compare_lists),
+    'render_posts_markdown': EquivalenceCheck(
+        setup=read_merged_posts,
+        reference=render_posts_markdown_reference,
+        candidate=s04.render_posts_markdown,
+        compare=compare_dataframes),
+    }
+
+
+def run_equivalence_check(
+    check_name: str, corpus: Corpus, max_mismatch_n: int=20
+    ) -> dict[str, Any]:
+    """
+    Runs the reference and the candidate of a check on the corpus and reports
+        their differences, up to 'max_mismatch_n' of them, and their times
+    """
+
+    check = equivalence_checks[check_name]
+    inputs = check.setup(corpus)
+
+    start_time = time.perf_counter()
+    reference_output = check.reference(inputs)
+    reference_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    candidate_output = check.candidate(inputs)
+    candidate_seconds = time.perf_counter() - start_time
+
+    mismatches = check.compare(reference_output, candidate_output)
+
+    result = {
+        'row_n': len(reference_output),
+        'mismatch_n': len(mismatches),
+        'mismatches': mismatches[:max_mismatch_n],
+        'reference_seconds': reference_seconds,
+        'candidate_seconds': candidate_seconds,
+        'speedup': (
+            reference_seconds / candidate_seconds if candidate_seconds
+            else None)}
+
+    return result
+
+
+##################################################
+# FUZZING
+##################################################
+
+# pieces of strings that are escaped in a MySQL dump or that resemble the
+#   syntax around its values
+sql_string_pieces = [
+    "'", "''", '\\', '\\\\', '"', '\\"', '\n', '\r', '\r\n', '\t', '\0',
+    '\0' + '1', '\x1a', '\b', '),(', "',", "','", ',', '(', ')', ';', ' ',
+    'NULL', '\\n', '\\Z', '%', '_', '\\%', 'é', '日本', '😀', 'a', 'What I',
+    'What I Read:  ', 'draft', 'publish', '<p>', '</a>', '0', '-1', '1e5']
+
+
+def generate_sql_string(rng: random.Random) -> str:
+
+    pieces = rng.choices(sql_string_pieces, k=rng.randint(0, 12))
+
+    # a string longer than the short strings that are matched whole
+    if rng.random() < 0.1:
+        pieces.append('x' * rng.randint(250, 300))
+
+    return ''.join(pieces)
+
+
+def generate_posts_row(rng: random.Random, post_id: int) -> tuple:
+    """
+    Generates a row of the posts table whose values include every kind of
+        string that a MySQL dump escapes
+    """
+
+    row = []
+    for colname, dtype in s01.posts_schema.items():
+        if colname == 'ID':
+            row.append(post_id)
+        elif rng.random() < 0.1:
+            row.append(None)
+        elif dtype == pl.Int64:
+            row.append(rng.choice([0, 1, -1, rng.randrange(-10**12, 10**12)]))
+        elif colname in s01.posts_date_columns and rng.random() < 0.8:
+            date = datetime.datetime(2000, 1, 1) + datetime.timedelta(
+                seconds=rng.randrange(10**9))
+            row.append(date.strftime('%Y-%m-%d %H:%M:%S'))
+        elif colname == 'post_type' and rng.random() < 0.5:
+            row.append('post')
+        elif colname == 'post_status' and rng.random() < 0.5:
+            row.append(rng.choice(['publish', 'inherit', 'draft', 'future']))
+        elif colname == 'post_title' and rng.random() < 0.5:
+            row.append(rng.choice(['What I Read:  ', 'what i ']) +
+                generate_sql_string(rng))
+        else:
+            row.append(generate_sql_string(rng))
+
+    return tuple(row)
+
+
+def format_posts_lines(
+    rng: random.Random, rows: list[tuple], table_prefix: str) -> list[str]:
+    """
+    Writes rows as the lines of a MySQL dump, in one of the formats of
+        'generate_corpus.write_sql_dump', with a space after some commas
+    """
+
+    insert_str = f'INSERT INTO `{table_prefix}posts` VALUES'
+
+    def format_row(row: tuple) -> str:
+        separator = rng.choice([',', ', '])
+        return '(' + separator.join(format_sql_value(e) for e in row) + ')'
+
+    insert_format = rng.choice(['line', 'extended', 'single'])
+    if insert_format == 'single':
+        lines = [f'{insert_str} {format_row(e)};\n' for e in rows]
+    elif insert_format == 'extended':
+        lines = [f'{insert_str} {",".join(format_row(e) for e in rows)};\n']
+    else:
+        lines = [insert_str + '\n'] + [
+            format_row(e) + (';' if i == len(rows) - 1 else ',') + '\n'
+            for i, e in enumerate(rows)]
+
+    return lines
+
+
+def fuzz_create_posts_dataframe(
+    rng: random.Random, case_n: int) -> list[str]:
+    """
+    Checks that the MySQL value parser recovers the values of generated rows
+        exactly, both for the whole table and with the columns and rows that
+        step 01 keeps; the generated values, rather than 'literal_eval', are
+        the reference, because 'literal_eval' misreads some escapes (see
+        'parse_sql_rows_reference')
+    """
+
+    mismatches = []
+    for case_i in range(case_n):
+
+        rows = [generate_posts_row(rng, i) for i in range(rng.randint(1, 5))]
+        lines = format_posts_lines(rng, rows, '_5A5_')
+
+        expected_df = s01.convert_posts_date_columns(pl.DataFrame(
+            rows, schema=s01.posts_schema, orient='row'))
+        expected_projected_df = select_website_read_post_rows(expected_df)
+
+        try:
+            case_mismatches = compare_dataframes(
+                expected_df, s01.create_posts_dataframe(lines))
+            case_mismatches.extend(compare_dataframes(
+                expected_projected_df,
+                s01.create_posts_dataframe(
+                    lines, s01.website_read_post_columns,
+                    s01.is_website_read_post)))
+        except Exception as e:
+            case_mismatches = [f'error {e!r}']
+
+        if case_mismatches:
+            mismatches.append(
+                f'case {case_i}, lines {shorten(lines, 400)}:  ' +
+                '; '.join(case_mismatches))
+
+    return mismatches
+
+
+def generate_url(rng: random.Random) -> str:
+
+    url = rng.choice([
+        'https://example.com/a/', 'http://www.example.org/?q=1&x=2',
+        'https://youtu.be/abc?si=x', 'example.com', 'https://例え.jp/パス',
+        'https://example.com/a b', ''])
+
+    return url
+
+
+def generate_html_piece(rng: random.Random) -> str:
+    """
+    Generates a piece of a post's HTML in one of the forms from which step 02
+        extracts URLs, or in a form that the HTML parser reads differently
+        than it might appear to
+    """
+
+    url = generate_url(rng)
+    quote = rng.choice(['"', "'", ''])
+    pieces = [
+        f'<a href="{url}">link</a>',
+        f'<A HREF={quote}{url}{quote} class="x">link</A>',
+        f'<a class="x" href = "{url}" >link</a>',
+        f'<a href="{url.replace("&", "&amp;")}">link</a>',
+        '<a name="anchor">no link</a>',
+        f'<a href="{url}" href="https://second.example.com/">link</a>',
+        f'<p>{url}</p>', f'<p class="x">see {url} here</p>', '<p>no url</p>',
+        f'<!-- wp:embed {{"url":"{url}","type":"rich","responsive":true}} -->',
+        f'{{"url":"{url}"}}', f'{{"url":"{url}","n":-1}}',
+        f'{{"url":"{url}","url":"https://second.example.com/"}}',
+        f'<a x= href="{url}">link</a>', f'<a x=href="{url}">link</a>',
+        f'<div x=<a href="{url}">link</a></div>', '<p x=>', '<p x= >',
+        f'<!-- <a href="{url}">commented out</a> -->', '<!-->', '--!>',
+        f'<script>var a = \'<a href="{url}">\';</script>',
+        f'<style>a {{}}</style>', f'<![CDATA[<a href="{url}">]]>',
+        '<!DOCTYPE html>', '<!foo ', '<!-x ', '<![if x]>', '<?php ', '?>',
+        '</ ', '</3 ', '</',
+        f'<div title="a > b"><a href="{url}">link</a></div>',
+        '<figure class="wp-block-embed"><div>', '</div></figure>',
+        'text & more < text > text', 'é 日本 😀', '\n', ' ']
+
+    return rng.choice(pieces)
+
+
+def fuzz_extract_urls(rng: random.Random, case_n: int) -> list[str]:
+    """
+    Checks that the string expressions of step 02 extract the same URLs as the
+        HTML parser from generated HTML; a post for which the HTML parser fails
+        must also fail with the expressions
+    """
+
+    contents = [
+        ''.join(generate_html_piece(rng) for _ in range(rng.randint(0, 6)))
+        for _ in range(case_n)]
+
+    mismatches = []
+    parsed_contents = []
+    reference_urls = []
+    for content in contents:
+        try:
+            reference_urls.append(s02.extract_url_from_post_html(content))
+            parsed_contents.append(content)
+        except Exception:
+            try:
+                s02.extract_urls_from_post_content(pl.Series([content]))
+            except Exception:
+                continue
+            mismatches.append(
+                f'content {shorten(content, 400)}:  the reference fails, but '
+                'the candidate does not')
+
+    candidate_urls = s02.extract_urls_from_post_content(
+        pl.Series(parsed_contents, dtype=pl.Utf8))
+    for content, e1, e2 in zip(
+        parsed_contents, reference_urls, candidate_urls):
+        if e1 != e2:
+            mismatches.append(
+                f'content {shorten(content, 400)}:  reference {shorten(e1)} '
+                f'!= candidate {shorten(e2)}')
+
+    return mismatches
+
+
+# lines of a post in the text file:  valid and invalid URLs, characters that
+#   'repr' quotes or escapes in tags, and the front matter delimiter
+markdown_line_pieces = [
+    'https://example.com/a/', 'http://localhost', 'www.example.com',
+    'https://example.com/a b', 'ftp://example.com/f', 'not a url', '+++', '',
+    "it's", 'back\\slash', 'é 日本 😀', '  ', '[link](x)']
+
+markdown_tag_pieces = [
+    'tag', 'machine learning', "o'reilly", 'back\\slash', 'café', '', ' ',
+    '"quoted"', '\t', '😀']
+
+
+def fuzz_render_posts_markdown(rng: random.Random, case_n: int) -> list[str]:
+    """
+    Checks that the column expressions of step 04 render the same filename and
+        text as 'convert_post_to_markdown' for generated posts, whose titles,
+        like those that step 02 selects, have a colon after "What I Read", and
+        for an empty DataFrame of posts
+    """
+
+    rows = []
+    for _ in range(case_n):
+        title_words = rng.choices(
+            ['word', 'Two', "it's", 'a-b', 'é', '日本', '', ' ', ':', '%',
+             'x_y', '😀'],
+            k=rng.randint(0, 6))
+        title = rng.choice(['What I Read: ', 'What I Watch:  ']) + ' '.join(
+            title_words)
+        date = datetime.datetime(2000, 1, 1) + datetime.timedelta(
+            seconds=rng.randrange(10**9))
+        unit = rng.choices(markdown_line_pieces, k=rng.randint(0, 5))
+        unit.append(', '.join(
+            rng.choices(markdown_tag_pieces, k=rng.randint(0, 4))))
+        # a unit of only one line has no body lines, or no line of tags
+        if rng.random() < 0.2:
+            unit = rng.choice([unit[-1:], unit[:1]])
+        rows.append((title, date, unit))
+
+    df = pl.DataFrame(
+        rows, orient='row',
+        schema={
+            'post_title': pl.Utf8, 'post_date': pl.Datetime('us'),
+            'unit': pl.List(pl.Utf8)})
+
+    mismatches = []
+    for posts_df in [df, df.clear()]:
+        mismatches.extend(compare_dataframes(
+            render_posts_markdown_reference(posts_df),
+            s04.render_posts_markdown(posts_df)))
+
+    return mismatches
+
+
+fuzzers = {
+    'create_posts_dataframe': fuzz_create_posts_dataframe,
+    'extract_urls_from_post_content': fuzz_extract_urls,
+    'render_posts_markdown': fuzz_render_posts_markdown,
+    }
+
+
+def run_fuzzer(
+    fuzzer_name: str, case_n: int, seed: int, max_mismatch_n: int=20
+    ) -> dict[str, Any]:
+    """
+    Runs a fuzzer on 'case_n' generated cases; the same seed generates the same
+        cases, so that a mismatch can be reproduced
+    """
+
+    rng = random.Random(seed)
+    mismatches = fuzzers[fuzzer_name](rng, case_n)
+
+    result = {
+        'case_n': case_n,
+        'seed': seed,
+        'mismatch_n': len(mismatches),
+        'mismatches': mismatches[:max_mismatch_n]}
+
+    return result
+
+
+def format_equivalence_results(results: dict[str, Any]) -> str:
+    """
+    Formats the results of 'main' as a line for each check and fuzzer,
+        followed by their first mismatches
+    """
+
+    lines = []
+    for check_name, e in results['checks'].items():
+        speedup = f'{e["speedup"]:.1f}x' if e['speedup'] else 'n/a'
+        lines.append(
+            f'check {check_name}:  {e["mismatch_n"]} mismatches in '
+            f'{e["row_n"]} rows, speedup {speedup}')
+    for fuzzer_name, e in results['fuzzers'].items():
+        lines.append(
+            f'fuzz {fuzzer_name}:  {e["mismatch_n"]} mismatches in '
+            f'{e["case_n"]} cases')
+
+    for kind in ['checks', 'fuzzers']:
+        for name, e in results[kind].items():
+            if e['mismatches']:
+                lines.append(f'\n{name}:')
+                lines.extend('  ' + m for m in e['mismatches'][:5])
+
+    return '\n'.join(lines)
+
+
+def main(
+    corpus: Corpus | None=None, settings: CorpusSettings | None=None,
+    fuzz_case_n: int=500, seed: int=0) -> dict[str, Any]:
+    """
+    Compares each fast implementation with its reference on a corpus and on
+        fuzzed inputs, saves the results to a JSON file in the 'benchmark'
+        directory, named with the time of the run, and returns them
+
+    If 'corpus' is 'None', a synthetic corpus is generated with 'settings'
+    """
+
+    benchmark_path = Path.cwd() / 'benchmark'
+    benchmark_path.mkdir(exist_ok=True)
+
+    if corpus is None:
+        corpus_path = benchmark_path / 'input'
+        generate_corpus(corpus_path, settings)
+        corpus = Corpus(
+            corpus_path / 'localhost.sql.gz', corpus_path / '01posts.txt')
+
+    results = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'polars': pl.__version__,
+        'corpus': {k: str(v) for k, v in vars(corpus).items()},
+        'checks': {
+            e: run_equivalence_check(e, corpus) for e in equivalence_checks},
+        'fuzzers': {e: run_fuzzer(e, fuzz_case_n, seed) for e in fuzzers}}
+
+    output_filename = (
+        'equivalence_' + time.strftime('%Y%m%d_%H%M%S') + '.json')
+    with open(benchmark_path / output_filename, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=4)
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+#! /usr/bin/env python3
+
+import gzip
+import random
+import datetime
+from pathlib import Path
+from dataclasses import dataclass, asdict
+
+import s01
+
+
+@dataclass
+class CorpusSettings:
+    """
+    Settings for a synthetic WordPress SQL dump file and its matching text file
+        of re-posts
+
+    post_n:  number of published "What I Read/Watch" posts
+    other_post_n:  number of published posts with other titles
+    html_size:  approximate number of characters of HTML in each post
+    revision_n:  number of revisions ('inherit' rows) of each post
+    draft_ratio:  ratio of drafts to published posts
+    embed_ratio:  share of posts whose URL is in embedded JSON instead of a link
+    paragraph_ratio:  share of posts whose URL is in the text of a paragraph
+        instead of a link
+    youtube_ratio:  share of posts that link to YouTube with a '?si' parameter
+    insert_format:  'line' for one row per line after a single 'INSERT' line,
+        'extended' for many rows per 'INSERT' statement on a single line, as
+        from 'mysqldump --extended-insert', or 'single' for one 'INSERT'
+        statement per row
+    rows_per_insert:  number of rows in each statement for 'extended'
+    table_prefix:  prefix of the names of the WordPress tables
+    seed:  seed of the random number generator
+    """
+    post_n: int=1000
+    other_post_n: int=100
+    html_size: int=2000
+    revision_n: int=3
+    draft_ratio: float=0.05
+    embed_ratio: float=0.1
+    paragraph_ratio: float=0.05
+    youtube_ratio: float=0.05
+    insert_format: str='line'
+    rows_per_insert: int=100
+    table_prefix: str='_5A5_'
+    seed: int=0
+
+
+words = (
+    'data model learning neural causal bayesian inference language vision '
+    'graph sampling optimization gradient kernel transformer diffusion '
+    'evaluation benchmark survey theory practice scaling reasoning planning '
+    'statistics regression forecasting time series "quoted" o\'reilly café '
+    'naïve back\\slash').split()
+
+tags = (
+    'machine learning, statistics, deep learning, causal inference, '
+    'language models, computer vision, forecasting, optimization').split(', ')
+
+
+def escape_sql_string(a_string: str) -> str:
+    """
+    Quotes and escapes a string as a MySQL dump does
+    """
+
+    escaped = (
+        a_string
+        .replace('\\', '\\\\').replace("'", "\\'").replace('"', '\\"')
+        .replace('\n', '\\n').replace('\r', '\\r').replace('\0', '\\0')
+        .replace('\x1a', '\\Z'))
+
+    return "'" + escaped + "'"
+
+
+def format_sql_value(value: str | int | None) -> str:
+
+    if value is None:
+        return 'NULL'
+    elif isinstance(value, int):
+        return str(value)
+    else:
+        return escape_sql_string(value)
+
+
+def generate_text(rng: random.Random, char_n: int) -> str:
+
+    text = []
+    text_len = 0
+    while text_len < char_n:
+        word = rng.choice(words)
+        text.append(word)
+        text_len += len(word) + 1
+
+    return ' '.join(text)
+
+
+def generate_post_content(
+    rng: random.Random, url: str, html_size: int, url_format: str) -> str:
+    """
+    Generates the HTML of a post that refers to 'url' in one of the ways that
+        step 02 extracts URLs:  'link', 'paragraph' or 'embed'
+    """
+
+    filler = generate_text(rng, html_size)
+
+    if url_format == 'embed':
+        embed_json = (
+            '{"url":"' + url + '","type":"rich","providerNameSlug":"example",'
+            '"responsive":true}')
+        return (
+            f'<!-- wp:embed {embed_json} -->\n'
+            f'<figure class="wp-block-embed"><div>\n{url}\n</div></figure>\n'
+            f'<!-- /wp:embed -->\n{filler}')
+    elif url_format == 'paragraph':
+        return f'<!-- wp:paragraph -->\n<p>{url}</p>\n<!-- /wp:paragraph -->'
+    else:
+        return (
+            f'<!-- wp:paragraph -->\n<p>{filler[:len(filler)//2]} '
+            f'<a href="{url}">{rng.choice(words)}</a> '
+            f'{filler[len(filler)//2:]}</p>\n<!-- /wp:paragraph -->')
+
+
+def generate_posts(
+    settings: CorpusSettings) -> tuple[list[tuple], list[list[str]]]:
+    """
+    Generates the rows of the posts table and the units of the text file of
+        re-posts, i.e., each re-post's URL, text and tags
+    """
+
+    rng = random.Random(settings.seed)
+    start_date = datetime.datetime(2019, 1, 1)
+
+    rows = []
+    units = []
+    post_id = 1
+
+    def add_row(
+        title: str, content: str, date: datetime.datetime, status: str,
+        post_type: str, parent: int=0):
+
+        nonlocal post_id
+        date_str = date.strftime('%Y-%m-%d %H:%M:%S')
+        name = '-'.join(title.lower().split()[:6])
+        rows.append((
+            post_id, 1, date_str, date_str, content, title, '', status,
+            'open', 'open', '', name, '', '', date_str, date_str, '',
+            parent, f'http://localhost/?p={post_id}', 0, post_type, '', 0))
+        post_id += 1
+
+    post_n = settings.post_n + settings.other_post_n
+    for i in range(post_n):
+
+        date = start_date + datetime.timedelta(
+            days=i // 3, seconds=rng.randrange(86400))
+        topic = ' '.join(rng.choice(words) for _ in range(rng.randint(2, 6)))
+
+        if i >= settings.post_n:
+            title = topic.capitalize()
+            content = generate_text(rng, settings.html_size)
+            add_row(title, content, date, 'publish', 'post')
+            continue
+
+        if rng.random() < settings.youtube_ratio:
+            url = f'https://youtu.be/v{i:07d}?si=x{rng.randrange(10**6)}'
+            title = f'What I Watch:  {topic}'
+        else:
+            slug = ''.join(e for e in topic.split()[0] if e.isalnum())
+            url = f'https://example{i % 97}.com/{i}/{slug}/'
+            title = f'What I Read:  {topic}'
+
+        url_format = rng.choices(
+            ['embed', 'paragraph', 'link'],
+            [settings.embed_ratio, settings.paragraph_ratio,
+             1 - settings.embed_ratio - settings.paragraph_ratio])[0]
+        content = generate_post_content(
+            rng, url, settings.html_size, url_format)
+
+        parent_id = post_id
+        add_row(title, content, date, 'publish', 'post')
+        for _ in range(settings.revision_n):
+            add_row(title, content, date, 'inherit', 'revision', parent_id)
+        if rng.random() < settings.draft_ratio:
+            add_row(title, content, date, 'draft', 'post')
+
+        post_tags = ', '.join(rng.sample(tags, rng.randint(1, 3)))
+        unit_lines = [generate_text(rng, 80) for _ in range(rng.randint(1, 4))]
+        units.append([url, title.split(':', 1)[1].strip()] + unit_lines + [
+            post_tags])
+
+    rng.shuffle(rows)
+
+    return rows, units
+
+
+def write_sql_dump(
+    rows: list[tuple], output_filepath: Path, settings: CorpusSettings):
+    """
+    Writes the rows of the posts table to a gzipped SQL dump file, with the
+        structure of an empty table before and after it
+    """
+
+    table_name = settings.table_prefix + 'posts'
+    colnames = ', '.join(f'`{e}`' for e in s01.posts_schema)
+    insert_str = f'INSERT INTO `{table_name}` ({colnames}) VALUES'
+
+    def format_row(row: tuple) -> str:
+        return '(' + ','.join(format_sql_value(e) for e in row) + ')'
+
+    with gzip.open(output_filepath, 'wt', encoding='utf-8') as f:
+
+        f.write('-- MySQL dump\n\n')
+        f.write(
+            f'{s01.table_structure_marker} `{settings.table_prefix}options`'
+            '\n--\n\n')
+
+        f.write(f'{s01.table_structure_marker} `{table_name}`\n--\n\n')
+        f.write(f'CREATE TABLE `{table_name}` (\n')
+        for e in s01.posts_schema:
+            f.write(f'  `{e}` longtext,\n')
+        f.write('  PRIMARY KEY (`ID`)\n) ENGINE=InnoDB;\n\n')
+
+        if settings.insert_format == 'single':
+            for row in rows:
+                f.write(f'{insert_str} {format_row(row)};\n')
+        elif settings.insert_format == 'extended':
+            step = settings.rows_per_insert
+            for i in range(0, len(rows), step):
+                row_strs = ','.join(format_row(e) for e in rows[i:i+step])
+                f.write(f'{insert_str} {row_strs};\n')
+        else:
+            f.write(insert_str + '\n')
+            for i, row in enumerate(rows):
+                end = ';' if i == len(rows) - 1 else ','
+                f.write(format_row(row) + end + '\n')
+
+        f.write(
+            f'\n{s01.table_structure_marker} `{settings.table_prefix}termmeta`'
+            '\n--\n')
+
+
+def write_posts_text_file(units: list[list[str]], output_filepath: Path):
+    """
+    Writes the units of the text file of re-posts, separated by blank lines
+    """
+
+    with open(output_filepath, 'w', encoding='utf-8') as f:
+        for unit in units:
+            f.write('\n'.join(unit))
+            f.write('\n\n')
+
+
+def generate_corpus(
+    output_path: Path, settings: CorpusSettings | None=None) -> dict:
+    """
+    Writes a synthetic 'localhost.sql.gz' and a matching '01posts.txt' to
+        'output_path' and returns their settings and sizes
+    """
+
+    if settings is None:
+        settings = CorpusSettings()
+
+    output_path.mkdir(exist_ok=True, parents=True)
+    dump_filepath = output_path / 'localhost.sql.gz'
+    text_filepath = output_path / '01posts.txt'
+
+    rows, units = generate_posts(settings)
+    write_sql_dump(rows, dump_filepath, settings)
+    write_posts_text_file(units, text_filepath)
+
+    corpus_info = {
+        'settings': asdict(settings),
+        'row_n': len(rows),
+        'unit_n': len(units),
+        'dump_bytes': dump_filepath.stat().st_size,
+        'text_file_bytes': text_filepath.stat().st_size}
+
+    return corpus_info
+
+
+def main(settings: CorpusSettings | None=None):
+    """
+    Writes a synthetic corpus to the 'benchmark/input' directory, so that it is
+        not mistaken for the real input files
+    """
+
+    input_path = Path.cwd() / 'benchmark' / 'input'
+    generate_corpus(input_path, settings)
+
+
+if __name__ == '__main__':
+    main()
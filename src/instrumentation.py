@@ -0,0 +1,310 @@
+#! /usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import resource
+import functools
+import tracemalloc
+from pathlib import Path
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator
+
+
+# the environment variable that names the stages to profile, separated by
+#   commas, each optionally followed by '=cprofile' (the default) or
+#   '=tracemalloc', e.g., 's02,s04.render_posts_markdown=tracemalloc'
+profile_env_var = 'CONVERT_REPOSTS_PROFILE'
+
+metrics_filename = 'metrics.jsonl'
+
+
+@dataclass
+class StageMetrics:
+    """
+    The metrics of a stage that is being run; a stage may be nested in
+        another, as a helper function is in a step's 'main'
+    """
+    name: str
+    output_path: Path
+    parent: str | None=None
+    metrics: dict[str, Any]=field(default_factory=dict)
+
+
+# the stages that are being run, from the outermost to the innermost
+active_stages: list[StageMetrics] = []
+
+# the number of times that each profiled stage has run in this process and, 
+#   for 'cprofile', the profile that accumulates its calls, by the stage's name
+#   and output path, so that a stage that runs repeatedly, e.g., once for each
+#   batch, is reported for all of its calls rather than only the last one
+profile_call_counts: dict[tuple[str, Path], int] = {}
+stage_profiles: dict[tuple[str, Path], cProfile.Profile] = {}
+
+# the name of the stage whose 'cprofile' profiler is enabled, if any; only one
+#   profiler can be enabled at a time in a process
+active_profile_stage: str | None = None
+
+
+def get_peak_rss() -> int:
+    """
+    Returns the peak resident memory of this process in bytes
+    """
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, while macOS reports bytes
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+
+    return peak_rss
+
+
+def get_profiled_stages() -> dict[str, str]:
+    """
+    Returns the profiler for each stage named in the profiling environment
+        variable
+    """
+
+    profiled_stages = {}
+    for e in os.environ.get(profile_env_var, '').split(','):
+        name, _, profiler = e.strip().partition('=')
+        if not name:
+            continue
+        profiler = profiler.strip() or 'cprofile'
+        if profiler not in ('cprofile', 'tracemalloc'):
+            raise ValueError(
+                f'Unknown profiler {profiler!r} for stage {name!r} in '
+                f'{profile_env_var}; use "cprofile" or "tracemalloc"')
+        profiled_stages[name] = profiler
+
+    return profiled_stages
+
+
+@contextmanager
+def profile_stage(name: str, output_path: Path) -> Iterator[None]:
+    """
+    Profiles the code run in the context with the profiler named for the stage
+        in the profiling environment variable, if any, and saves the report to
+        'output_path'
+
+    If the stage runs more than once in a process, the 'cprofile' report 
+        covers all of its calls, and the 'tracemalloc' report has a section for
+        each call
+
+    Only one 'cprofile' profiler can be enabled at a time, so a stage that is
+        nested in a stage that is already profiled, or that runs while another
+        profiling tool is active, is not profiled by itself; its calls are in
+        the outer stage's report, and the stage's metrics record why
+
+    >>> import tempfile
+    >>> os.environ[profile_env_var] = 'outer,inner'
+    >>> with tempfile.TemporaryDirectory() as d:
+    ...     with instrument_stage('outer', Path(d)):
+    ...         with instrument_stage('inner'):
+    ...             pass
+    ...     print(sorted(os.listdir(d)))
+    ['metrics.jsonl', 'profile_outer.prof', 'profile_outer.txt']
+    >>> del os.environ[profile_env_var]
+    """
+
+    global active_profile_stage
+
+    profiler = get_profiled_stages().get(name)
+    if profiler is None:
+        yield
+        return
+
+    key = (name, output_path)
+    call_n = profile_call_counts.get(key, 0) + 1
+    profile_call_counts[key] = call_n
+
+    if profiler == 'cprofile' and active_profile_stage is not None:
+        record_metrics(profiled_in=active_profile_stage)
+        yield
+
+    elif profiler == 'cprofile':
+        profile = stage_profiles.setdefault(key, cProfile.Profile())
+        try:
+            profile.enable()
+        except ValueError:
+            # since Python 3.12, another profiler, e.g., from 'python -m
+            #   cProfile', cannot be replaced
+            record_metrics(profiled_in='another profiling tool')
+            yield
+            return
+        active_profile_stage = name
+        try:
+            yield
+        finally:
+            profile.disable()
+            active_profile_stage = None
+            # the report is saved after each call, since there is no telling
+            #   which call is the last
+            profile.dump_stats(output_path / f'profile_{name}.prof')
+            with open(
+                output_path / f'profile_{name}.txt', 'w',
+                encoding='utf-8') as f:
+                f.write(f'calls:  {call_n}\n\n')
+                stats = pstats.Stats(profile, stream=f)
+                stats.sort_stats('cumulative').print_stats(50)
+
+    elif profiler == 'tracemalloc':
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start(10)
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if not was_tracing:
+                tracemalloc.stop()
+            with open(
+                output_path / f'tracemalloc_{name}.txt', 
+                'w' if call_n == 1 else 'a', encoding='utf-8') as f:
+                if call_n > 1:
+                    f.write('\n')
+                f.write(f'call {call_n}\n\n')
+                f.write(f'current bytes:  {current}\npeak bytes:  {peak}\n\n')
+                for e in snapshot.statistics('lineno')[:50]:
+                    f.write(f'{e}\n')
+
+
+@contextmanager
+def instrument_stage(
+    name: str, output_path: Path | None=None) -> Iterator[StageMetrics | None]:
+    """
+    Measures the duration and peak memory of the code run in the context and
+        appends them, along with any metrics recorded with 'record_metrics',
+        as a line of JSON to the metrics file in 'output_path'
+
+    If 'output_path' is not given, the stage is nested in the innermost stage
+        that is being run and uses its output path; if no stage is being run,
+        nothing is measured
+
+    The stage is also profiled if it is named in the profiling environment
+        variable (see 'profile_stage')
+    """
+
+    if output_path is None:
+        if not active_stages:
+            yield None
+            return
+        output_path = active_stages[-1].output_path
+
+    output_path.mkdir(exist_ok=True, parents=True)
+    parent = active_stages[-1].name if active_stages else None
+    stage = StageMetrics(name=name, output_path=output_path, parent=parent)
+
+    start_time = time.time()
+    start_counter = time.perf_counter()
+    active_stages.append(stage)
+    try:
+        with profile_stage(name, output_path):
+            yield stage
+    finally:
+        active_stages.pop()
+
+        stage_record = {
+            'stage': name,
+            'parent': parent,
+            'pid': os.getpid(),
+            'start_time': time.strftime(
+                '%Y-%m-%dT%H:%M:%S', time.localtime(start_time)),
+            'seconds': time.perf_counter() - start_counter,
+            'peak_rss_bytes': get_peak_rss()}
+        stage_record.update(stage.metrics)
+
+        with open(
+            output_path / metrics_filename, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(stage_record, default=str) + '\n')
+
+
+def is_instrumented() -> bool:
+    """
+    Returns whether a stage is being run, so that metrics that are costly to
+        compute are computed only when they are recorded
+    """
+
+    return bool(active_stages)
+
+
+def record_metrics(**metrics: Any):
+    """
+    Records metrics, e.g., row counts, for the innermost stage that is being
+        run; counts are added to any that were already recorded under the same
+        name
+    """
+
+    if not active_stages:
+        return
+
+    stage_metrics = active_stages[-1].metrics
+    for key, value in metrics.items():
+        if isinstance(value, int) and isinstance(stage_metrics.get(key), int):
+            stage_metrics[key] += value
+        else:
+            stage_metrics[key] = value
+
+
+def record_file_bytes(metric_name: str, *filepaths: Path):
+    """
+    Records the total size of files, e.g., as 'bytes_read' or 'bytes_written'
+    """
+
+    if not active_stages:
+        return
+
+    byte_n = sum(e.stat().st_size for e in filepaths if e.is_file())
+    record_metrics(**{metric_name: byte_n})
+
+
+def count_rows(value: Any) -> int | None:
+
+    if isinstance(value, list):
+        return len(value)
+
+    # if Polars has not been imported, 'value' cannot be a DataFrame, and 
+    #   importing it here would slow down commands that do not need it
+    pl = sys.modules.get('polars')
+    if pl is not None and isinstance(value, (pl.DataFrame, pl.Series)):
+        return len(value)
+
+    return None
+
+
+def instrumented(name: str) -> Callable:
+    """
+    Decorates a function so that each call to it is a stage nested in the
+        stage that is being run (see 'instrument_stage'), with the number of
+        rows of its first argument and of its result, if they are DataFrames,
+        Series or lists
+    """
+
+    def decorator(function: Callable) -> Callable:
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+
+            if not active_stages:
+                return function(*args, **kwargs)
+
+            with instrument_stage(name):
+                input_row_n = count_rows(args[0]) if args else None
+                if input_row_n is not None:
+                    record_metrics(input_rows=input_row_n)
+                result = function(*args, **kwargs)
+                output_row_n = count_rows(result)
+                if output_row_n is not None:
+                    record_metrics(output_rows=output_row_n)
+
+            return result
+
+        return wrapper
+
+    return decorator
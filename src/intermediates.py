@@ -0,0 +1,276 @@
+#! /usr/bin/env python3
+
+import os
+import shutil
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+
+@dataclass
+class IntermediateFormat:
+    """
+    How the DataFrames that the steps pass to each other are saved
+
+    file_format:  'parquet' or 'ipc'; an Arrow IPC file is saved uncompressed,
+        so that the next step can memory-map it instead of reading it
+    compression, compression_level, row_group_size, statistics:  the settings
+        of a Parquet file; statistics let a scan skip the row groups that a
+        filter excludes
+    partition_by_year:  if 'True', a Parquet file of posts is saved as a 
+        directory of files, one for the posts of each year of 'post_date'
+    """
+    file_format: str='parquet'
+    compression: str='zstd'
+    compression_level: int | None=3
+    row_group_size: int | None=10_000
+    statistics: bool=True
+    partition_by_year: bool=False
+
+
+# the suffixes of the files or directory in which an intermediate may be saved
+intermediate_suffixes = {'parquet': '.parquet', 'ipc': '.arrow', 'year': ''}
+
+
+def get_intermediate_filepaths(
+    output_path: Path, name: str) -> dict[str, Path]:
+
+    filepaths = {
+        k: output_path / (name + v) for k, v in intermediate_suffixes.items()}
+
+    return filepaths
+
+
+def find_intermediate(output_path: Path, name: str) -> Path | None:
+    """
+    Returns the file or directory in which the intermediate 'name', e.g.,
+        's02_website_read_posts', is saved in 'output_path', in whichever
+        format it was saved, or 'None' if it is not saved
+    """
+
+    for filepath in get_intermediate_filepaths(output_path, name).values():
+        if filepath.exists():
+            return filepath
+
+    return None
+
+
+def replace_path(temp_path: Path, path: Path):
+    """
+    Replaces a file or directory with a temporary one that has been completely
+        written, so that a partly written intermediate is never visible
+
+    A memory-mapped file that is replaced stays valid for as long as it is
+        mapped, because the name, not the file, is replaced
+    """
+
+    if path.is_dir():
+        old_path = path.with_name('.' + path.name + '.old')
+        shutil.rmtree(old_path, ignore_errors=True)
+        os.replace(path, old_path)
+        os.replace(temp_path, path)
+        shutil.rmtree(old_path)
+    else:
+        os.replace(temp_path, path)
+
+
+@contextmanager
+def write_atomically(path: Path) -> Iterator[Path]:
+    """
+    Yields a temporary path next to 'path', to which a file or directory is
+        written in the context; it then replaces 'path' (see 'replace_path'),
+        or, if an error is raised, it is deleted
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as d:
+    ...     path = Path(d) / 'a.txt'
+    ...     with write_atomically(path) as temp_path:
+    ...         _ = temp_path.write_text('a')
+    ...     try:
+    ...         with write_atomically(path) as temp_path:
+    ...             _ = temp_path.write_text('b')
+    ...             raise KeyboardInterrupt
+    ...     except KeyboardInterrupt:
+    ...         pass
+    ...     print(path.read_text(), sorted(os.listdir(d)))
+    a ['a.txt']
+    """
+
+    temp_path = path.with_name('.' + path.name + '.tmp')
+    try:
+        yield temp_path
+        replace_path(temp_path, path)
+    except BaseException:
+        if temp_path.is_dir():
+            shutil.rmtree(temp_path)
+        else:
+            temp_path.unlink(missing_ok=True)
+        raise
+
+
+def write_intermediate(
+    df: pl.DataFrame, output_path: Path, name: str,
+    intermediate_format: IntermediateFormat | None=None) -> Path:
+    """
+    Saves a DataFrame as the intermediate 'name' in 'output_path', deletes any
+        copy of it in another format and returns the file or directory in which
+        it is saved
+    """
+
+    if intermediate_format is None:
+        intermediate_format = IntermediateFormat()
+    f = intermediate_format
+
+    if f.file_format not in ('parquet', 'ipc'):
+        raise ValueError(
+            f'Unknown intermediate format {f.file_format!r}; '
+            'use "parquet" or "ipc"')
+
+    # only tables of posts have a 'post_date' by which to partition them, and
+    #   an empty table is saved as a single file, so that a scan of it finds
+    #   at least one file
+    is_partitioned = (
+        f.file_format == 'parquet' and f.partition_by_year and 
+        'post_date' in df.columns and len(df) > 0)
+
+    filepaths = get_intermediate_filepaths(output_path, name)
+    if f.file_format == 'ipc':
+        filepath = filepaths['ipc']
+    elif is_partitioned:
+        filepath = filepaths['year']
+    else:
+        filepath = filepaths['parquet']
+
+    def write_parquet(df: pl.DataFrame, filepath: Path):
+        df.write_parquet(
+            filepath, compression=f.compression,
+            compression_level=f.compression_level,
+            statistics=f.statistics, row_group_size=f.row_group_size)
+
+    with write_atomically(filepath) as temp_filepath:
+        if f.file_format == 'ipc':
+            df.write_ipc(temp_filepath, compression='uncompressed')
+        elif is_partitioned:
+            temp_filepath.mkdir()
+            years = df['post_date'].dt.year()
+            for year in years.unique().sort().to_list():
+                if year is None:
+                    year_df = df.filter(years.is_null())
+                    year = 'none'
+                else:
+                    year_df = df.filter(years == year)
+                write_parquet(year_df, temp_filepath / f'{year}.parquet')
+        else:
+            write_parquet(df, temp_filepath)
+
+    for e in filepaths.values():
+        if e != filepath:
+            if e.is_dir():
+                shutil.rmtree(e)
+            else:
+                e.unlink(missing_ok=True)
+
+    return filepath
+
+
+def scan_intermediate(output_path: Path, name: str) -> pl.LazyFrame:
+    """
+    Lazily reads the intermediate 'name' from 'output_path' in whichever format
+        it was saved, so that filters and selections of columns are applied as
+        it is read; an Arrow IPC file is memory-mapped
+    """
+
+    filepath = find_intermediate(output_path, name)
+
+    if filepath is None:
+        raise FileNotFoundError(
+            f'No intermediate {name!r} in {str(output_path)!r}')
+    elif filepath.suffix == intermediate_suffixes['ipc']:
+        return pl.scan_ipc(filepath, memory_map=True)
+    elif filepath.is_dir():
+        # the files are named by year, not in the 'key=value' directories of
+        #   Hive partitioning, so that no column is added to the DataFrame
+        return pl.scan_parquet(filepath / '*.parquet', hive_partitioning=False)
+    else:
+        return pl.scan_parquet(filepath)
+
+
+def iter_intermediate_batches(
+    output_path: Path, name: str, batch_size: int=10_000,
+    columns: list[str] | None=None) -> Iterator[pl.DataFrame]:
+    """
+    Reads the intermediate 'name' from 'output_path' in batches of up to
+        'batch_size' rows, so that only one batch at a time is held in memory
+
+    At least one batch is yielded, even if it is empty, so that the columns of
+        the intermediate are known
+    """
+
+    filepath = find_intermediate(output_path, name)
+
+    if filepath is None:
+        raise FileNotFoundError(
+            f'No intermediate {name!r} in {str(output_path)!r}')
+    elif filepath.suffix == intermediate_suffixes['ipc']:
+        filepaths = [filepath]
+    elif filepath.is_dir():
+        filepaths = sorted(filepath.glob('*.parquet'))
+    else:
+        filepaths = [filepath]
+
+    def iter_file_batches(filepath: Path) -> Iterator[pa.RecordBatch]:
+
+        if filepath.suffix == intermediate_suffixes['ipc']:
+            # the batches of a memory-mapped file are read from the file's 
+            #   pages only as they are used
+            with pa.memory_map(str(filepath)) as f:
+                reader = pa.ipc.open_file(f)
+                for i in range(reader.num_record_batches):
+                    batch = reader.get_batch(i)
+                    if columns is not None:
+                        batch = batch.select(columns)
+                    for j in range(0, batch.num_rows, batch_size):
+                        yield batch.slice(j, batch_size)
+
+        else:
+            # a Parquet file is read one row group at a time; a dataset scan
+            #   would read ahead many batches, so that its memory would grow 
+            #   with the size of the file
+            parquet_file = pq.ParquetFile(filepath, pre_buffer=False)
+            yield from parquet_file.iter_batches(
+                batch_size=batch_size, columns=columns, use_threads=False)
+
+    schema = None
+    for filepath in filepaths:
+        for batch in iter_file_batches(filepath):
+            schema = batch.schema
+            yield pl.from_arrow(batch)
+
+    if schema is None:
+        if filepaths[0].suffix == intermediate_suffixes['ipc']:
+            with pa.memory_map(str(filepaths[0])) as f:
+                schema = pa.ipc.open_file(f).schema
+        else:
+            schema = pq.read_schema(filepaths[0])
+        if columns is not None:
+            schema = pa.schema([schema.field(e) for e in columns])
+        yield pl.from_arrow(schema.empty_table())
+
+
+def get_intermediate_bytes(output_path: Path, name: str) -> int:
+    """
+    Returns the size of the file or files in which an intermediate is saved
+    """
+
+    filepath = find_intermediate(output_path, name)
+
+    if filepath is None:
+        return 0
+    elif filepath.is_dir():
+        return sum(e.stat().st_size for e in filepath.iterdir())
+    else:
+        return filepath.stat().st_size
@@ -0,0 +1,93 @@
+#! /usr/bin/env python3
+
+import json
+from pathlib import Path
+from dataclasses import dataclass, field, asdict
+
+from intermediates import write_atomically
+
+
+# increment when a change to the pipeline changes its outputs, so that the
+#   next incremental run rebuilds all of them instead of only the posts that
+#   changed
+manifest_version = 1
+
+# the name of the file in the output directory in which the manifest is saved
+manifest_filename = 'manifest.json'
+
+
+@dataclass
+class PostRecord:
+    """
+    What an incremental run emitted for a post from the Wordpress website
+
+    post_modified_gmt:  the time at which the post was last modified, as a
+        string
+    url:  the normalized URL on which the post was joined to the text file
+    filename:  the name of the post's markdown file, or 'None' if the post was
+        not joined to any post in the text file
+    """
+    post_modified_gmt: str
+    url: str | None=None
+    filename: str | None=None
+
+
+@dataclass
+class Manifest:
+    """
+    The posts that an incremental run of the pipeline emitted, so that the
+        next run processes only the posts that are new or changed since then
+
+    posts:  the record of each post from the Wordpress website, by its ID
+    units:  the normalized URL of each post in the text file, by the hash of
+        its unit of text
+    url_rules_hash:  the hash of the URL rules with which the URLs were
+        extracted and normalized (see 'url_normalization.hash_url_rules')
+    """
+    posts: dict[int, PostRecord]=field(default_factory=dict)
+    units: dict[str, str | None]=field(default_factory=dict)
+    url_rules_hash: str | None=None
+
+
+def load_manifest(filepath: Path) -> Manifest | None:
+    """
+    Loads the manifest saved by 'save_manifest', or returns 'None' if there is
+        none or if it was saved by a different version of the pipeline
+    """
+
+    if not filepath.exists():
+        return None
+
+    with open(filepath, encoding='utf-8') as f:
+        manifest_dict = json.load(f)
+
+    if manifest_dict.get('version') != manifest_version:
+        return None
+
+    # JSON object keys are strings, but post IDs are integers
+    manifest = Manifest(
+        posts={
+            int(k): PostRecord(**v)
+            for k, v in manifest_dict['posts'].items()},
+        units=manifest_dict['units'],
+        url_rules_hash=manifest_dict.get('url_rules_hash'))
+
+    return manifest
+
+
+def save_manifest(manifest: Manifest, filepath: Path):
+    """
+    Saves the manifest to a JSON file, replacing any earlier manifest only
+        after it is completely written, so that an interrupted run does not
+        leave a partial manifest
+    """
+
+    manifest_dict = {
+        'version': manifest_version,
+        'posts': {str(k): asdict(v) for k, v in manifest.posts.items()},
+        'units': manifest.units,
+        'url_rules_hash': manifest.url_rules_hash}
+
+    with write_atomically(filepath) as temp_filepath:
+        with open(temp_filepath, 'w', encoding='utf-8') as f:
+            json.dump(manifest_dict, f)
@@ -0,0 +1,322 @@
+#! /usr/bin/env python3
+
+from pathlib import Path
+from contextlib import ExitStack
+from collections import Counter
+
+import polars as pl
+
+import s01
+import s02
+import s03
+import s04
+from post_cache import PostCache, hash_cache_key
+from instrumentation import instrument_stage, record_metrics, record_file_bytes
+from intermediates import (
+    IntermediateFormat, write_intermediate, scan_intermediate, 
+    find_intermediate, get_intermediate_bytes)
+from manifest import (
+    Manifest, PostRecord, manifest_filename, load_manifest, save_manifest)
+from url_normalization import get_url_rules, hash_url_rules
+
+
+def update_posts_incrementally(
+    website_df: pl.DataFrame, textfile_filepath: Path, output_path: Path, 
+    manifest: Manifest | None, worker_n: int=1, 
+    url_cache: PostCache | None=None, 
+    markdown_cache: PostCache | None=None, 
+    intermediate_format: IntermediateFormat | None=None) -> Manifest:
+    """
+    Runs steps 02 through 04 on only the posts that are new or changed since
+        the run recorded in 'manifest', merges them into the files that steps 
+        02 and 03 saved to 'output_path' and writes only the markdown files 
+        that they affect; returns the manifest of this run
+
+    'website_df' is the posts table from step 01 and 'textfile_filepath' is 
+        the text file of posts
+
+    A post from the website is processed again if its modification time 
+        changed or if a post in the text file with its URL was added, changed 
+        or removed
+
+    If 'manifest' is 'None', the files of steps 02 and 03 are missing or the
+        URL rules have changed, all posts are processed, as for a first run
+    """
+
+    s02_name = 's02_website_read_posts'
+    s03_name = 's03_website_textfile_merged'
+    report_filepath = output_path / 's03_unmatched_url_candidates.csv'
+    output_md_path = output_path / 'md_posts'
+
+    url_rules_hash = hash_url_rules(get_url_rules())
+    is_rebuilt = (
+        manifest is None or 
+        manifest.url_rules_hash != url_rules_hash or
+        find_intermediate(output_path, s02_name) is None or 
+        find_intermediate(output_path, s03_name) is None)
+    if is_rebuilt:
+        manifest = Manifest()
+
+
+    # step 02
+    ##################################################
+
+    with instrument_stage('s02'):
+
+        df = s02.filter_website_read_posts(website_df)
+        post_versions = dict(zip(
+            df['ID'], df['post_modified_gmt'].cast(pl.Utf8)))
+
+        changed_ids = {
+            k for k, v in post_versions.items() 
+            if k not in manifest.posts or 
+            manifest.posts[k].post_modified_gmt != v}
+        removed_ids = set(manifest.posts) - set(post_versions)
+        record_metrics(
+            posts_changed=len(changed_ids), posts_removed=len(removed_ids))
+
+        changed_df = s02.extract_website_read_post_urls(
+            df.filter(pl.col('ID').is_in(list(changed_ids))), worker_n, 
+            url_cache)
+
+        if is_rebuilt:
+            df2 = changed_df
+        else:
+            replaced_ids = list(changed_ids | removed_ids)
+            df2 = pl.concat([
+                scan_intermediate(output_path, s02_name)
+                .filter(~pl.col('ID').is_in(replaced_ids)).collect(), 
+                changed_df]).sort('post_date', 'ID')
+        write_intermediate(df2, output_path, s02_name, intermediate_format)
+        record_metrics(
+            bytes_written=get_intermediate_bytes(output_path, s02_name))
+
+
+    # step 03
+    ##################################################
+
+    with instrument_stage('s03'):
+
+        textfile_df = s03.prepare_textfile_posts(
+            s03.read_posts_text_file(textfile_filepath))
+        record_file_bytes('bytes_read', textfile_filepath)
+
+        # identical posts in the text file are numbered, so that adding or 
+        #   removing a duplicate changes the hashes
+        unit_counts = Counter()
+        unit_hashes = []
+        for unit, in textfile_df.select('unit').iter_rows():
+            unit_key = tuple(unit)
+            unit_hashes.append(hash_cache_key(unit, unit_counts[unit_key]))
+            unit_counts[unit_key] += 1
+        units = dict(zip(unit_hashes, textfile_df['url']))
+        changed_unit_urls = (
+            {v for k, v in units.items() if k not in manifest.units} |
+            {v for k, v in manifest.units.items() if k not in units})
+        record_metrics(units_changed=len(changed_unit_urls))
+
+        # unchanged posts whose URL is shared by a new, changed or removed post
+        #   in the text file are joined again
+        affected_ids = changed_ids | {
+            k for k, v in manifest.posts.items() 
+            if v.url in changed_unit_urls and k not in removed_ids}
+
+        affected_df = s03.prepare_website_posts(
+            df2.filter(pl.col('ID').is_in(list(affected_ids))))
+        joined_df = affected_df.join(textfile_df, on='url', how='inner')
+
+        replaced_ids = affected_ids | removed_ids
+        if is_rebuilt:
+            df3 = joined_df
+        else:
+            df3 = pl.concat([
+                scan_intermediate(output_path, s03_name)
+                .filter(~pl.col('ID').is_in(list(replaced_ids))).collect(), 
+                joined_df]).sort('post_date', 'ID', maintain_order=True)
+        write_intermediate(df3, output_path, s03_name, intermediate_format)
+        record_metrics(
+            bytes_written=get_intermediate_bytes(output_path, s03_name))
+
+        # the report covers all posts, so it is created again from all of them,
+        #   but only if any of them changed
+        if replaced_ids or changed_unit_urls or not report_filepath.exists():
+            report_df = s03.reconcile_urls(
+                s03.prepare_website_posts(df2), textfile_df)
+            report_df.write_csv(report_filepath)
+
+
+    # step 04
+    ##################################################
+
+    with instrument_stage('s04'):
+
+        output_md_path.mkdir(exist_ok=True, parents=True)
+
+        def render_posts_markdown(df: pl.DataFrame) -> pl.DataFrame:
+            if markdown_cache is not None:
+                return s04.render_posts_markdown_cached(df, markdown_cache)
+            else:
+                return s04.render_posts_markdown(df)
+
+        joined_md_df = render_posts_markdown(joined_df)
+
+        post_filenames = {
+            k: v.filename for k, v in manifest.posts.items() 
+            if k not in replaced_ids}
+        post_filenames.update(zip(joined_df['ID'], joined_md_df['filename']))
+
+        affected_filenames = set(joined_md_df['filename']) | {
+            manifest.posts[k].filename 
+            for k in replaced_ids if k in manifest.posts}
+        affected_filenames.discard(None)
+
+        # posts with the same filename overwrite each other, so each affected
+        #   file is written for the last of its posts, as in a full run
+        filename_df = pl.DataFrame(
+            {'ID': list(post_filenames), 
+             'filename': list(post_filenames.values())}, 
+            schema={'ID': df3['ID'].dtype, 'filename': pl.Utf8})
+        written_df = (
+            df3.join(filename_df, on='ID', how='left')
+            .filter(pl.col('filename').is_in(list(affected_filenames)))
+            .unique('filename', keep='last', maintain_order=True)
+            .drop('filename'))
+        md_df = render_posts_markdown(written_df)
+
+        # files of posts that were removed or that no longer match the text 
+        #   file are deleted before the files are written, so that they are 
+        #   left out of the record of the written files
+        if not is_rebuilt:
+            for e in affected_filenames - set(md_df['filename']):
+                (output_md_path / e).unlink(missing_ok=True)
+
+        s04.write_markdown_files(md_df, output_md_path, prune=is_rebuilt)
+
+
+    post_urls = dict(zip(affected_df['ID'], affected_df['url']))
+    manifest = Manifest(
+        posts={
+            k: PostRecord(
+                post_modified_gmt=v, 
+                url=post_urls[k] if k in post_urls else manifest.posts[k].url, 
+                filename=post_filenames.get(k))
+            for k, v in post_versions.items()},
+        units=units,
+        url_rules_hash=url_rules_hash)
+
+    return manifest
+
+
+def main(
+    worker_n: int=1, use_cache: bool=True, write_checkpoints: bool=False,
+    input_path: Path | None=None, output_path: Path | None=None,
+    incremental: bool=False,
+    intermediate_format: IntermediateFormat | None=None,
+    dump_filename: str='localhost.sql.gz', gzip_command: str | None='auto',
+    table_prefix: str='_5A5_', textfile_filepath: Path | None=None):
+    """
+    Run steps 01 through 04 in a single process, passing each step's DataFrame
+        directly to the next step instead of through a file
+
+    If 'write_checkpoints' is 'True', each step's DataFrame is also saved to
+        the same file that the step saves it to when it is run by itself, so
+        that a later step can be run by itself from it
+
+    Posts are parsed in a pool of 'worker_n' processes, if 'worker_n' is
+        greater than 1
+
+    If 'incremental' is 'True', steps 02 through 04 process only the posts 
+        that are new or changed since the last incremental run, as recorded in
+        a manifest in the output directory, and the files of steps 02 and 03 
+        are always saved (see 'update_posts_incrementally')
+
+    The files of the steps are saved in 'intermediate_format' (see 
+        'write_intermediate')
+
+    The SQL dump file 'dump_filename' may be compressed (see 
+        's01.read_sql_dump_byte_lines'); its tables are named with 
+        'table_prefix'
+
+    'input_path' and 'output_path' default to the 'input' and 'output'
+        directories in the current working directory; 'textfile_filepath', the
+        text file of posts, defaults to '01posts.txt' in 'input_path'
+    """
+
+    if input_path is None:
+        input_path = Path.cwd() / 'input'
+    if textfile_filepath is None:
+        textfile_filepath = input_path / '01posts.txt'
+    if output_path is None:
+        output_path = Path.cwd() / 'output'
+    output_path.mkdir(exist_ok=True, parents=True)
+
+    with ExitStack() as stack:
+
+        stack.enter_context(instrument_stage('pipeline', output_path))
+
+        if use_cache:
+            url_cache = stack.enter_context(PostCache(
+                output_path / 'cache' / s02.url_cache_filename,
+                version=s02.url_extraction_cache_version))
+            markdown_cache = stack.enter_context(PostCache(
+                output_path / 'cache' / s04.markdown_cache_filename,
+                version=s04.markdown_cache_version))
+        else:
+            url_cache = None
+            markdown_cache = None
+
+        # step 01
+        with instrument_stage('s01'):
+            input_filepath = input_path / dump_filename
+            dfs = s01.read_tables_from_sql_dump(
+                input_filepath, table_prefix=table_prefix, worker_n=worker_n, 
+                gzip_command=gzip_command)
+            if write_checkpoints:
+                s01.write_tables(
+                    dfs, output_path, intermediate_format=intermediate_format)
+
+        if incremental:
+            manifest_filepath = output_path / manifest_filename
+            manifest = update_posts_incrementally(
+                dfs['posts'], textfile_filepath, output_path, 
+                load_manifest(manifest_filepath), worker_n, url_cache, 
+                markdown_cache, intermediate_format)
+            save_manifest(manifest, manifest_filepath)
+            return
+
+        # step 02
+        with instrument_stage('s02'):
+            df2 = s02.select_website_read_posts(
+                dfs['posts'], worker_n, url_cache)
+            del dfs
+            if write_checkpoints:
+                output_name = 's02_website_read_posts'
+                write_intermediate(
+                    df2, output_path, output_name, intermediate_format)
+                record_metrics(bytes_written=get_intermediate_bytes(
+                    output_path, output_name))
+
+        # step 03
+        with instrument_stage('s03'):
+            posts_df = s03.read_posts_text_file(textfile_filepath)
+            record_file_bytes('bytes_read', textfile_filepath)
+            df3, report_df = s03.merge_website_and_textfile_posts(
+                df2, posts_df)
+            del df2, posts_df
+            report_df.write_csv(
+                output_path / 's03_unmatched_url_candidates.csv')
+            if write_checkpoints:
+                output_name = 's03_website_textfile_merged'
+                write_intermediate(
+                    df3, output_path, output_name, intermediate_format)
+                record_metrics(bytes_written=get_intermediate_bytes(
+                    output_path, output_name))
+
+        # step 04
+        with instrument_stage('s04'):
+            s04.convert_posts_to_markdown_files(
+                df3, output_path / 'md_posts', cache=markdown_cache)
+
+
+if __name__ == '__main__':
+    main()
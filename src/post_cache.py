@@ -0,0 +1,143 @@
+#! /usr/bin/env python3
+
+import json
+import time
+import sqlite3
+import hashlib
+from pathlib import Path
+from typing import Any, Iterable
+
+
+def hash_cache_key(*values: Any) -> str:
+    """
+    Hashes the inputs of a computation into a key for 'PostCache', so that a
+        change to any of the inputs produces a different key
+    """
+
+    hasher = hashlib.blake2b(digest_size=20)
+    for e in values:
+        hasher.update(repr(e).encode('utf-8', 'surrogatepass'))
+        # separate the values, so that e.g. ('ab', 'c') and ('a', 'bc') differ
+        hasher.update(b'\x1f')
+
+    return hasher.hexdigest()
+
+
+class PostCache:
+    """
+    An on-disk cache of JSON-serializable results for each post, stored in a
+        SQLite file and keyed by the hash of the post's inputs (see
+        'hash_cache_key')
+
+    When the stored results exceed 'max_size' bytes, the least recently used
+        ones are evicted
+
+    'version' is stored with the results; if it differs from the version in the
+        file, the file's results are discarded, so that results computed by
+        older code are not reused
+    """
+
+    def __init__(
+        self, filepath: Path | str, max_size: int=2**28, version: int=1):
+
+        self.filepath = Path(filepath)
+        self.filepath.parent.mkdir(exist_ok=True, parents=True)
+        self.max_size = max_size
+
+        self.connection = sqlite3.connect(self.filepath)
+        self.connection.executescript(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            '  key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+            '  size INTEGER NOT NULL, last_used INTEGER NOT NULL);'
+            'CREATE INDEX IF NOT EXISTS cache_last_used ON cache (last_used);'
+            'CREATE TABLE IF NOT EXISTS metadata ('
+            '  name TEXT PRIMARY KEY, value TEXT NOT NULL);')
+
+        stored_version = self.connection.execute(
+            "SELECT value FROM metadata WHERE name = 'version'").fetchone()
+        if stored_version is None or stored_version[0] != str(version):
+            with self.connection:
+                self.connection.execute('DELETE FROM cache')
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO metadata VALUES ('version', ?)",
+                    (str(version), ))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, Any]:
+        """
+        Returns the cached results for those of 'keys' that are in the cache
+            and marks them as recently used
+        """
+
+        keys = list(dict.fromkeys(keys))
+        results = {}
+
+        # stay under SQLite's limit on the number of query parameters
+        batch_size = 500
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i+batch_size]
+            placeholders = ', '.join('?' * len(batch))
+            rows = self.connection.execute(
+                f'SELECT key, value FROM cache WHERE key IN ({placeholders})',
+                batch)
+            for key, value in rows:
+                results[key] = json.loads(value)
+
+        now = time.time_ns()
+        with self.connection:
+            self.connection.executemany(
+                'UPDATE cache SET last_used = ? WHERE key = ?',
+                ((now, e) for e in results))
+
+        return results
+
+    def set_many(self, results: dict[str, Any]):
+        """
+        Stores the results for each key, then evicts the least recently used
+            results if the cache is larger than its maximum size
+        """
+
+        now = time.time_ns()
+        rows = []
+        for key, value in results.items():
+            value = json.dumps(value)
+            rows.append((key, value, len(value), now))
+
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)', rows)
+
+        self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used results until the cache is no larger
+            than its maximum size
+        """
+
+        total_size = self.connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+        if total_size <= self.max_size:
+            return
+
+        excess_size = total_size - self.max_size
+        evicted_keys = []
+        rows = self.connection.execute(
+            'SELECT key, size FROM cache ORDER BY last_used')
+        for key, size in rows:
+            evicted_keys.append((key, ))
+            excess_size -= size
+            if excess_size <= 0:
+                break
+
+        with self.connection:
+            self.connection.executemany(
+                'DELETE FROM cache WHERE key = ?', evicted_keys)
@@ -1,111 +1,807 @@
 #! /usr/bin/env python3
 
-import gzip
+import os
+import re
+import pyarrow as pa
 import polars as pl
+import multiprocessing
 from pathlib import Path
-from ast import literal_eval
+from contextlib import ExitStack
+from collections import deque
+from itertools import chain
+from typing import Callable, Generator, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
 
+from decompression import open_compressed_file
+from intermediates import (
+    IntermediateFormat, write_intermediate, get_intermediate_bytes)
+from instrumentation import (
+    instrument_stage, instrumented, record_metrics, record_file_bytes)
 
-def filter_sql_to_correct_table(txt01: list[str]) -> list[str]:
+
+def read_sql_dump_byte_lines(
+    input_filepath: Path | str, gzip_command: str | None='auto'
+    ) -> Iterator[bytes]:
     """
-    Extracts the SQL code for the table '_5A5_posts' from the SQL dump file
+    Lazily reads the lines of the SQL dump file as bytes, so that only one line
+        at a time is held in memory while it is being decompressed and so that
+        lines can be skipped without being decoded
+
+    The file may be compressed with gzip, zstd, xz or bzip2, or not at all, as
+        detected from its content; a gzip file is decompressed by a faster 
+        external command, if one is installed (see 'find_gzip_command')
     """
 
-    start_str = 'INSERT INTO `_5A5_posts` '
-    end_str = '-- Table structure for table `_5A5_termmeta`'
+    with open_compressed_file(input_filepath, gzip_command) as f:
+        for line in f:
+            # as when the file is read in text mode
+            if line.endswith(b'\r\n'):
+                line = line[:-2] + b'\n'
+            yield line
 
-    start_idx = None
-    end_idx = None
-    for i, line in enumerate(txt01):
-        if not start_idx and start_str in line:
-            start_idx = i
-        if start_idx and not end_idx and end_str in line:
-            end_idx = i
 
-    txt02 = txt01[start_idx:end_idx]
+def read_sql_dump_lines(
+    input_filepath: Path | str, gzip_command: str | None='auto'
+    ) -> Iterator[str]:
+    """
+    Lazily reads the lines of the SQL dump file, so that only one line at a 
+        time is held in memory while it is being decompressed (see 
+        'read_sql_dump_byte_lines')
+    """
 
-    j = len(txt02)
-    for j in range(len(txt02)-1, 0, -1):
-        if ';' in txt02[j]:
-            break
+    for line in read_sql_dump_byte_lines(input_filepath, gzip_command):
+        yield line.decode('utf-8')
 
-    end_idx_2 = j + 1
-    txt03 = txt02[:end_idx_2]
 
-    return txt03
+table_structure_marker = '-- Table structure for table'
 
 
-def create_posts_dataframe(txt: list[str]) -> pl.DataFrame:
+def filter_sql_to_correct_table(
+    txt01: Iterable[str] | Iterable[bytes], table_name: str='posts', 
+    table_prefix: str='_5A5_') -> Iterator[str]:
     """
-    Recreate the '_5A5_posts' table from the SQL dump file as a DataFrame
+    Extracts the SQL code for the table '_5A5_posts' (or for whichever table is
+        named by 'table_prefix' and 'table_name') from the SQL dump file
+
+    Lines are consumed lazily:  everything before the table's 'INSERT' 
+        statement is skipped, and reading stops at the 'INSERT' statement or 
+        the table structure marker for the next table, so that the rest of the
+        dump is never read
+
+    The lines may be bytes (see 'read_sql_dump_byte_lines'), in which case 
+        they are compared as bytes and only the table's lines are decoded
+
+    If the lines come from a generator, it is closed when reading stops, so 
+        that the file it reads, or the command that decompresses it, is closed
+        right away rather than when the generator is garbage-collected
     """
 
-    # colnames_txt = txt[0].split('(')[1].split(')')[0].replace('`', '')
-    # colnames = colnames_txt.split(',')
+    start_str = f'INSERT INTO `{table_prefix}{table_name}`'
+    insert_str = 'INSERT'
+    structure_marker = table_structure_marker
 
-    rows01 = [e for e in txt if e[0] == '(' and 'insert into' not in e.lower()]
-    rows02 = [e[:e.rfind(')')+1] for e in rows01]
-    rows03 = [literal_eval(e) for e in rows02]
+    source_lines = iter(txt01)
+    try:
+        first_line = next(source_lines, None)
+        if first_line is None:
+            return
+        lines = chain([first_line], source_lines)
 
-    for e in rows03:
-        assert isinstance(e, tuple)
+        is_bytes = isinstance(first_line, bytes)
+        if is_bytes:
+            start_str = start_str.encode('utf-8')
+            insert_str = insert_str.encode('utf-8')
+            structure_marker = structure_marker.encode('utf-8')
 
-    schema = {
-        'ID': pl.Int64, 'post_author': pl.Int64, 'post_date': pl.Utf8, 
-        'post_date_gmt': pl.Utf8, 'post_content': pl.Utf8, 
-        'post_title': pl.Utf8, 'post_excerpt': pl.Utf8, 'post_status': pl.Utf8, 
-        'comment_status': pl.Utf8, 'ping_status': pl.Utf8, 
-        'post_password': pl.Utf8, 'post_name': pl.Utf8, 'to_ping': pl.Utf8, 
-        'pinged': pl.Utf8, 'post_modified': pl.Utf8, 
-        'post_modified_gmt': pl.Utf8, 'post_content_filtered': pl.Utf8, 
-        'post_parent': pl.Int64, 'guid': pl.Utf8, 'menu_order': pl.Int64, 
-        'post_type': pl.Utf8, 'post_mime_type': pl.Utf8, 
-        'comment_count': pl.Int64}
-    df = pl.DataFrame(rows03, schema=schema, orient='row')
+        def decode(line):
+            return line.decode('utf-8') if is_bytes else line
+
+        for line in lines:
+            if line.startswith(start_str):
+                yield decode(line)
+                break
+
+        for line in lines:
+            if line.startswith(structure_marker):
+                break
+            if line.startswith(insert_str) and not line.startswith(start_str):
+                break
+            yield decode(line)
+
+    finally:
+        if isinstance(source_lines, Generator):
+            source_lines.close()
+
+
+def tee_lines(
+    lines: Iterable[str], callback: Callable[[str], None]) -> Iterator[str]:
+    """
+    Yields each line after passing it to 'callback', so that another consumer,
+        like the index of the dump (see 'dump_index.DumpIndexWriter'), sees
+        the lines in the same pass
+    """
+
+    for line in lines:
+        callback(line)
+        yield line
+
+
+sql_insert_pattern = re.compile(
+    r'\s*INSERT\s+INTO\s+`([^`]+)`\s*(?:\(([^)]*)\))?\s*VALUES\s*', 
+    re.IGNORECASE)
+
+# a value in a row of a MySQL dump, optionally preceded by the parenthesis that
+#   opens the row:  a short quoted string with no escape sequences, which is
+#   the most common value, is matched whole; a longer or escaped string is 
+#   matched only by its opening quote, so that its end can be found without 
+#   matching it character by character; NULL or a number is followed by the 
+#   comma that continues the row or by the parenthesis that ends it
+sql_value_pattern = re.compile(
+    r"\s*(\()?\s*"
+    r"(?:'([^'\\]{0,256})'(?!')|(')|(NULL|[-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?))"
+    r"\s*(?:(,)|(\))\s*[,;]?)?\s*")
+
+sql_separator_pattern = re.compile(r"\s*(?:(,)|(\))\s*[,;]?)\s*")
+
+
+# backslash escape sequences in MySQL dumps and the characters that they 
+#   represent
+sql_escapes = {
+    '0': '\0', "'": "'", '"': '"', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 
+    'Z': '\x1a'}
+
+
+def unescape_sql_string(a_string: str) -> str:
+    """
+    Converts the contents of a quoted string in a MySQL dump to the string that 
+        it represents, e.g., the escape sequence '\\n' to a newline
+    """
+
+    # a doubled quote represents a single quote
+    if "'" in a_string:
+        a_string = a_string.replace("''", "'")
+
+    if '\\' not in a_string:
+        return a_string
+
+    # HTML content is full of escaped double quotes, so without any escaped 
+    #   backslashes, in which case every backslash starts an escape sequence, 
+    #   the common escape sequences can be replaced directly
+    if '\\\\' not in a_string:
+        a_string = a_string.replace('\\"', '"').replace("\\'", "'")
+        if '\\' not in a_string:
+            return a_string
+
+    # after splitting on backslashes, each part but the first begins with the
+    #   character that its backslash escapes; an empty part is the first half 
+    #   of an escaped backslash, so the part after it is not escaped
+    parts = a_string.split('\\')
+    unescaped = [parts[0]]
+    i = 1
+    part_n = len(parts)
+    while i < part_n:
+        part = parts[i]
+        if part:
+            escaped = part[0]
+            unescaped.append(sql_escapes.get(escaped, '\\' + escaped))
+            unescaped.append(part[1:])
+            i += 1
+        else:
+            unescaped.append('\\')
+            if i + 1 < part_n:
+                unescaped.append(parts[i+1])
+            i += 2
+
+    return ''.join(unescaped)
+
+
+def find_sql_string_end(line: str, start: int) -> int:
+    """
+    Returns the index of the quote that closes the quoted string in 'line' 
+        that opens at index 'start'
+    """
+
+    i = start + 1
+    while True:
+        end = line.find("'", i)
+        if end == -1:
+            raise ValueError(
+                f'Unterminated SQL string at position {start}:  '
+                f'{line[start:start+80]!r}')
+
+        # a quote preceded by an odd number of backslashes is escaped
+        j = end - 1
+        while line[j] == '\\':
+            j -= 1
+        if (end - 1 - j) % 2:
+            i = end + 1
+        # a doubled quote is also escaped
+        elif line[end+1:end+2] == "'":
+            i = end + 2
+        else:
+            return end
+
+
+def parse_sql_values(line: str, unescape: bool=True) -> Iterator[tuple]:
+    """
+    Parses the row tuples in a line of a MySQL dump file
+    
+    The line may hold a single row, as in a dump with one row per line, or an 
+        entire 'INSERT INTO ... VALUES (...), (...);' statement, as in a dump 
+        made with '--extended-insert'; lines that hold no rows yield nothing
+
+    If 'unescape' is 'False', the escape sequences in quoted strings are left
+        for 'unescape_sql_string' to convert later
+
+    >>> list(parse_sql_values("(1,' escaped\\\\'s',', comma')"))
+    [(1, " escaped's", ', comma')]
+    """
+
+    insert_match = sql_insert_pattern.match(line)
+    if insert_match:
+        pos = insert_match.end()
+    elif line[:1] == '(':
+        pos = 0
+    else:
+        return
+
+    end = len(line)
+    row = None
+
+    while pos < end:
+
+        match = sql_value_pattern.match(line, pos)
+        if not match:
+            raise ValueError(
+                f'Could not parse SQL value at position {pos}:  '
+                f'{line[pos:pos+80]!r}')
+
+        row_start, short_string, quote, value, row_continues, row_end = (
+            match.groups())
+
+        if row_start:
+            if row is not None:
+                raise ValueError(
+                    f'Unterminated SQL row before position {pos}:  '
+                    f'{line[pos:pos+80]!r}')
+            row = []
+        elif row is None:
+            raise ValueError(
+                f'SQL value outside of a row at position {pos}:  '
+                f'{line[pos:pos+80]!r}')
+
+        if short_string is not None:
+            row.append(short_string)
+        elif quote:
+            # the pattern may have gone on to match the string's first
+            #   characters as whitespace or a separator, so the string starts
+            #   at the quote, not at the end of the match
+            string_start = match.start(3)
+            string_end = find_sql_string_end(line, string_start)
+            string = line[string_start+1:string_end]
+            if unescape:
+                string = unescape_sql_string(string)
+            row.append(string)
+            match = sql_separator_pattern.match(line, string_end + 1)
+            if not match:
+                raise ValueError(
+                    f'Expected "," or ")" after SQL string at position '
+                    f'{string_end+1}:  {line[string_end+1:string_end+80]!r}')
+            row_continues, row_end = match.groups()
+        elif value == 'NULL':
+            row.append(None)
+        elif value.lstrip('+-').isdigit():
+            row.append(int(value))
+        else:
+            row.append(float(value))
+
+        if row_end:
+            yield tuple(row)
+            row = None
+        elif not row_continues:
+            raise ValueError(
+                f'Expected "," or ")" after SQL value at position {pos}:  '
+                f'{line[pos:pos+80]!r}')
+
+        pos = match.end()
+
+    if row is not None:
+        raise ValueError(f'Unterminated SQL row at end of line:  {line!r}')
+
+
+posts_schema = {
+    'ID': pl.Int64, 'post_author': pl.Int64, 'post_date': pl.Utf8, 
+    'post_date_gmt': pl.Utf8, 'post_content': pl.Utf8, 
+    'post_title': pl.Utf8, 'post_excerpt': pl.Utf8, 'post_status': pl.Utf8, 
+    'comment_status': pl.Utf8, 'ping_status': pl.Utf8, 
+    'post_password': pl.Utf8, 'post_name': pl.Utf8, 'to_ping': pl.Utf8, 
+    'pinged': pl.Utf8, 'post_modified': pl.Utf8, 
+    'post_modified_gmt': pl.Utf8, 'post_content_filtered': pl.Utf8, 
+    'post_parent': pl.Int64, 'guid': pl.Utf8, 'menu_order': pl.Int64, 
+    'post_type': pl.Utf8, 'post_mime_type': pl.Utf8, 
+    'comment_count': pl.Int64}
+
+
+posts_column_idxs = {e: i for i, e in enumerate(posts_schema)}
+
+posts_date_columns = [
+    'post_date', 'post_date_gmt', 'post_modified', 'post_modified_gmt']
+
+# the columns of the '_5A5_posts' table that the later steps use
+website_read_post_columns = [
+    'ID', 'post_date', 'post_date_gmt', 'post_content', 'post_title', 
+    'post_status', 'post_name', 'post_modified', 'post_modified_gmt', 
+    'post_type']
+
+
+def is_website_read_post(row: tuple) -> bool:
+    """
+    Returns whether a row of the '_5A5_posts' table is one of the posts that
+        step 02 keeps:  a post, not a revision or a draft, whose title begins 
+        with "What I" (as for "What I Read" and "What I Watch")
+
+    The row's quoted strings may still have their escape sequences
+    """
+
+    post_type = row[posts_column_idxs['post_type']]
+    post_status = row[posts_column_idxs['post_status']]
+    post_title = row[posts_column_idxs['post_title']]
+
+    if post_type != 'post' or post_status is None or post_title is None:
+        return False
+    if post_status == 'inherit' or 'draft' in post_status:
+        return False
+
+    return unescape_sql_string(post_title).lower().startswith('what i')
+
+
+def create_posts_columns(
+    colnames: Iterable[str] | None=None) -> list[list | None]:
+    """
+    Creates the lists to which the values of the columns of the '_5A5_posts' 
+        table are appended; if 'colnames' is given, the lists of the other 
+        columns are 'None', so that their values are skipped
+    """
+
+    if colnames is None:
+        return [[] for _ in posts_schema]
+
+    colnames = set(colnames)
+    unknown_colnames = colnames.difference(posts_schema)
+    if unknown_colnames:
+        raise ValueError(
+            f'Unknown columns for table _5A5_posts:  {sorted(unknown_colnames)}')
+
+    columns = [[] if e in colnames else None for e in posts_schema]
+
+    return columns
+
+
+def append_sql_rows_to_columns(
+    line: str, columns: list[list | None], table_name: str, 
+    row_filter: Callable[[tuple], bool] | None=None):
+    """
+    Parses the rows in a line of a MySQL dump file and appends each of their
+        values to the list for its column
+
+    Columns whose list is 'None' are skipped, and rows for which 'row_filter'
+        returns 'False' are skipped; 'row_filter' receives quoted strings with
+        their escape sequences not yet converted, so that only the strings that
+        are kept are converted
+    """
+
+    column_n = len(columns)
+    skip_values = row_filter is not None or any(e is None for e in columns)
+
+    for row in parse_sql_values(line, unescape=not skip_values):
+
+        if len(row) != column_n:
+            raise ValueError(
+                f'Expected {column_n} values in row of table {table_name!r}, '
+                f'found {len(row)}:  {row[:2]!r}')
+
+        if not skip_values:
+            for column, value in zip(columns, row):
+                column.append(value)
+            continue
+
+        if row_filter and not row_filter(row):
+            continue
+
+        for column, value in zip(columns, row):
+            if column is not None:
+                if value.__class__ is str:
+                    value = unescape_sql_string(value)
+                column.append(value)
+
+
+def convert_posts_date_columns(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Converts the date columns of the '_5A5_posts' table from strings to 
+        datetimes
+    """
 
     df2 = df.with_columns(
-        pl.col('post_date').str.to_datetime(
-            format='%Y-%m-%d %H:%M:%S', strict=False),
-        pl.col('post_date_gmt').str.to_datetime(
-            format='%Y-%m-%d %H:%M:%S', strict=False),
-        pl.col('post_modified').str.to_datetime(
-            format='%Y-%m-%d %H:%M:%S', strict=False),
-        pl.col('post_modified_gmt').str.to_datetime(
-            format='%Y-%m-%d %H:%M:%S', strict=False))
-    # df = pd.DataFrame(rows03, columns=colnames)
-    # df.columns = colnames
+        pl.col(e).str.to_datetime(format='%Y-%m-%d %H:%M:%S', strict=False)
+        for e in posts_date_columns if e in df.columns)
 
     return df2
 
 
-def main():
+def convert_posts_columns_to_dataframe(
+    columns: list[list | None], convert_dates: bool=True) -> pl.DataFrame:
     """
-    Extract information about posts from Wordpress website SQL dump file and
-        save it to a dataframe
+    Combines the lists of values for the columns of the '_5A5_posts' table 
+        into a DataFrame, leaving out the columns whose list is 'None'
     """
 
-    input_path = Path.cwd() / 'input'
-    input_filename = 'localhost.sql.gz'
-    input_filepath = input_path / input_filename
+    schema = {
+        e: dtype for (e, dtype), column in zip(posts_schema.items(), columns) 
+        if column is not None}
+    columns = [e for e in columns if e is not None]
+    df = pl.DataFrame(dict(zip(schema, columns)), schema=schema)
 
-    txt = []
-    with gzip.open(input_filepath, 'rt') as f:
-        for line in f:
-            txt.append(line)
+    if convert_dates:
+        df = convert_posts_date_columns(df)
+
+    return df
+
+
+@instrumented('s01.create_posts_dataframe')
+def create_posts_dataframe(
+    txt: Iterable[str], colnames: Iterable[str] | None=None, 
+    row_filter: Callable[[tuple], bool] | None=None) -> pl.DataFrame:
+    """
+    Recreate the '_5A5_posts' table from the SQL dump file as a DataFrame
+
+    Each row is parsed from the dump's value syntax and its values are appended
+        directly to one list per column, so that rows are never materialized 
+        as a list of tuples
+
+    If 'colnames' is given, only those columns are kept, and if 'row_filter' is
+        given, only rows for which it returns 'True' are kept (see 
+        'append_sql_rows_to_columns'); the values of skipped rows and columns
+        are never unescaped or converted to dates
+    """
+
+    columns = create_posts_columns(colnames)
+
+    for line in txt:
+        append_sql_rows_to_columns(line, columns, 'posts', row_filter)
+
+    df = convert_posts_columns_to_dataframe(columns)
+
+    return df
+
+
+def chunk_sql_lines(
+    txt: Iterable[str], chunk_size: int=2**23) -> Iterator[list[str]]:
+    """
+    Groups lines of a MySQL dump file into chunks of about 'chunk_size' 
+        characters
+
+    Line breaks inside quoted strings are escaped in the dump, so each line 
+        holds only whole rows and line boundaries are safe row boundaries
+    """
+
+    chunk = []
+    chunk_len = 0
+    for line in txt:
+        chunk.append(line)
+        chunk_len += len(line)
+        if chunk_len >= chunk_size:
+            yield chunk
+            chunk = []
+            chunk_len = 0
+
+    if chunk:
+        yield chunk
+
+
+def create_posts_table_chunk(
+    txt: list[str], colnames: Iterable[str] | None=None, 
+    row_filter: Callable[[tuple], bool] | None=None) -> pa.Table:
+    """
+    Parses the rows of the '_5A5_posts' table in a chunk of lines from the SQL
+        dump file into an Arrow table, with dates not yet converted from 
+        strings
+    """
+
+    columns = create_posts_columns(colnames)
+
+    for line in txt:
+        append_sql_rows_to_columns(line, columns, 'posts', row_filter)
+
+    df = convert_posts_columns_to_dataframe(columns, convert_dates=False)
+    table = df.to_arrow()
+
+    return table
+
+
+@instrumented('s01.create_posts_dataframe_parallel')
+def create_posts_dataframe_parallel(
+    txt: Iterable[str], worker_n: int | None=None, chunk_size: int=2**23, 
+    colnames: Iterable[str] | None=None, 
+    row_filter: Callable[[tuple], bool] | None=None) -> pl.DataFrame:
+    """
+    Recreate the '_5A5_posts' table from the SQL dump file as a DataFrame, as
+        'create_posts_dataframe' does, but parse chunks of the table's rows in
+        a pool of 'worker_n' processes
+
+    Chunks are submitted as they are read and only a few per worker are in 
+        flight at a time, so that the dump is still streamed; the parsed 
+        chunks are concatenated in their original order
+    """
+
+    if not worker_n:
+        worker_n = os.cpu_count() or 1
+
+    if colnames is not None:
+        colnames = list(colnames)
+
+    tables = []
+    futures = deque()
+    mp_context = multiprocessing.get_context('spawn')
+
+    with ProcessPoolExecutor(worker_n, mp_context=mp_context) as executor:
+        for chunk in chunk_sql_lines(txt, chunk_size):
+            futures.append(executor.submit(
+                create_posts_table_chunk, chunk, colnames, row_filter))
+            if len(futures) >= 2 * worker_n:
+                tables.append(futures.popleft().result())
+        while futures:
+            tables.append(futures.popleft().result())
+
+    if not tables:
+        return create_posts_dataframe([], colnames)
+
+    df = pl.from_arrow(pa.concat_tables(tables))
+    assert isinstance(df, pl.DataFrame)
+    df2 = convert_posts_date_columns(df)
+
+    return df2
+
+
+@instrumented('s01.extract_tables_from_sql')
+def extract_tables_from_sql(
+    txt: Iterable[str], table_names: Iterable[str], table_prefix: str='_5A5_', 
+    posts_colnames: Iterable[str] | None=None, 
+    posts_row_filter: Callable[[tuple], bool] | None=None, 
+    posts_line_callback: Callable[[str], None] | None=None
+    ) -> dict[str, pl.DataFrame]:
+    """
+    Recreate several tables from the SQL dump file as DataFrames in a single 
+        pass through the dump
 
-    txt01 = filter_sql_to_correct_table(txt)
-    df = create_posts_dataframe(txt01)
+    Tables are named without 'table_prefix', e.g., 'posts' or 'term_taxonomy';
+        the column names of each table are taken from the column list in its 
+        'INSERT INTO' statements or, if the statements have no column list, 
+        from its 'CREATE TABLE' statement; reading stops once the rows of all 
+        the requested tables have been read
+
+    The '_5A5_posts' table is typed, and its columns and rows selected by 
+        'posts_colnames' and 'posts_row_filter', as in 
+        'create_posts_dataframe'; the column types of other tables are inferred
+        from their values; each line of the table's rows is also passed to 
+        'posts_line_callback', if it is given
+    """
+
+    table_names = {table_prefix + e: e for e in table_names}
+    posts_table_name = table_prefix + 'posts'
+    colnames = {e: [] for e in table_names}
+    columns = {}
+    row_filters = {}
+    finished_tables = set()
+
+    # the table whose rows or column definitions are being read, if any
+    insert_table = None
+    create_table = None
+
+    for line in txt:
+
+        if insert_table and line[:1] == '(':
+            if posts_line_callback and insert_table == posts_table_name:
+                posts_line_callback(line)
+            append_sql_rows_to_columns(
+                line, columns[insert_table], insert_table, 
+                row_filters.get(insert_table))
+            continue
+        insert_table = None
+
+        if create_table:
+            if line.lstrip().startswith('`'):
+                colnames[create_table].append(line.split('`')[1])
+                continue
+            create_table = None
+
+        if line.startswith('INSERT'):
+            match = sql_insert_pattern.match(line)
+            if match and match.group(1) in table_names:
+                insert_table = match.group(1)
+                if posts_line_callback and insert_table == posts_table_name:
+                    posts_line_callback(line)
+                if match.group(2):
+                    colnames[insert_table] = [
+                        e.strip().strip('`') for e in match.group(2).split(',')]
+                if insert_table not in columns:
+                    if (table_names[insert_table] == 'posts' and 
+                        colnames[insert_table] == list(posts_schema)):
+                        columns[insert_table] = create_posts_columns(
+                            posts_colnames)
+                        row_filters[insert_table] = posts_row_filter
+                    else:
+                        columns[insert_table] = [
+                            [] for _ in colnames[insert_table]]
+                append_sql_rows_to_columns(
+                    line, columns[insert_table], insert_table, 
+                    row_filters.get(insert_table))
+
+        elif line.startswith('CREATE TABLE'):
+            table_name = line.split('`')[1]
+            if table_name in table_names:
+                create_table = table_name
+                colnames[create_table] = []
+
+        # a table's rows all precede the structure of the next table
+        elif line.startswith(table_structure_marker):
+            finished_tables.update(columns)
+            if len(finished_tables) == len(table_names):
+                break
+
+    dfs = {}
+    for table_name, short_name in table_names.items():
+
+        table_colnames = colnames[table_name]
+        table_columns = columns.get(table_name, [[] for _ in table_colnames])
+
+        if short_name == 'posts' and table_colnames == list(posts_schema):
+            if table_name not in columns:
+                table_columns = create_posts_columns(posts_colnames)
+            df = convert_posts_columns_to_dataframe(table_columns)
+        else:
+            df = pl.DataFrame([
+                pl.Series(e, column, strict=False) 
+                for e, column in zip(table_colnames, table_columns)])
+
+        dfs[short_name] = df
+
+    return dfs
+
+
+def read_tables_from_sql_dump(
+    input_filepath: Path | str, table_names: Iterable[str]=('posts',), 
+    table_prefix: str='_5A5_', worker_n: int=1, 
+    posts_colnames: Iterable[str] | None=website_read_post_columns, 
+    posts_row_filter: Callable[[tuple], bool] | None=is_website_read_post, 
+    gzip_command: str | None='auto', 
+    posts_line_callback: Callable[[str], None] | None=None
+    ) -> dict[str, pl.DataFrame]:
+    """
+    Extract tables from Wordpress website SQL dump file as DataFrames, named 
+        without 'table_prefix'
+
+    The dump file may be compressed (see 'read_sql_dump_byte_lines')
+
+    By default, only the posts and columns that the later steps use are kept;
+        to keep the entire table, set 'posts_colnames' and 'posts_row_filter'
+        to 'None'
+
+    If tables other than 'posts' are requested, all of them are extracted in a
+        single pass through the dump; otherwise, if 'worker_n' is greater than 
+        1, the posts are parsed in a pool of that many processes
+
+    If 'posts_line_callback' is given, each line of the posts table is passed
+        to it as it is read, e.g., to index the table in the same pass
+    """
+
+    table_names = list(table_names)
+    if posts_line_callback and 'posts' not in table_names:
+        raise ValueError(
+            "The lines of the posts table can only be passed on if the table "
+            "is extracted")
+
+    if table_names == ['posts']:
+        # the lines of other tables are skipped without being decoded
+        txt = read_sql_dump_byte_lines(input_filepath, gzip_command)
+        txt01 = filter_sql_to_correct_table(txt, 'posts', table_prefix)
+        if posts_line_callback:
+            txt01 = tee_lines(txt01, posts_line_callback)
+        if worker_n > 1:
+            df = create_posts_dataframe_parallel(
+                txt01, worker_n, colnames=posts_colnames, 
+                row_filter=posts_row_filter)
+        else:
+            df = create_posts_dataframe(
+                txt01, posts_colnames, posts_row_filter)
+        dfs = {'posts': df}
+    else:
+        txt = read_sql_dump_lines(input_filepath, gzip_command)
+        dfs = extract_tables_from_sql(
+            txt, table_names, table_prefix, posts_colnames, posts_row_filter, 
+            posts_line_callback)
+
+    record_file_bytes('bytes_read', Path(input_filepath))
+    for table_name, df in dfs.items():
+        record_metrics(**{f'output_rows_{table_name}': len(df)})
+
+    return dfs
+
+
+def write_tables(
+    dfs: dict[str, pl.DataFrame], output_path: Path, write_csv: bool=False, 
+    intermediate_format: IntermediateFormat | None=None):
+    """
+    Save each table extracted from the SQL dump file to its own file, in the
+        intermediate format that the later steps read (see 
+        'write_intermediate'), and the posts table also to a CSV file, if
+        'write_csv' is 'True'
+    """
 
-    output_path = Path.cwd() / 'output'
     output_path.mkdir(exist_ok=True, parents=True)
 
-    output_filename = 's01_posts.parquet'
-    output_filepath = output_path / output_filename
-    df.write_parquet(output_filepath)
+    for table_name, df in dfs.items():
+        output_name = f's01_{table_name}'
+        write_intermediate(df, output_path, output_name, intermediate_format)
+        record_metrics(
+            bytes_written=get_intermediate_bytes(output_path, output_name))
+
+    if write_csv and 'posts' in dfs:
+        output_filename = 's01_posts.csv'
+        output_filepath = output_path / output_filename
+        dfs['posts'].write_csv(output_filepath)
+        record_file_bytes('bytes_written', output_filepath)
+
+
+def main(
+    table_names: Iterable[str]=('posts',), table_prefix: str='_5A5_', 
+    worker_n: int=1, 
+    posts_colnames: Iterable[str] | None=website_read_post_columns, 
+    posts_row_filter: Callable[[tuple], bool] | None=is_website_read_post, 
+    write_csv: bool=False, input_path: Path | None=None, 
+    output_path: Path | None=None, 
+    intermediate_format: IntermediateFormat | None=None, 
+    dump_filename: str='localhost.sql.gz', gzip_command: str | None='auto',
+    build_index: bool=False):
+    """
+    Extract information about posts from Wordpress website SQL dump file and
+        save it to a dataframe (see 'read_tables_from_sql_dump' and 
+        'write_tables')
+
+    If 'build_index' is 'True', an index with which single posts can be read
+        without reading the dump is also saved, from the lines of the posts 
+        table as they are read (see 'dump_index.DumpIndexWriter')
+
+    'input_path' and 'output_path' default to the 'input' and 'output' 
+        directories in the current working directory
+
+    The dump file 'dump_filename' may be compressed in any of the formats that
+        'read_sql_dump_byte_lines' detects, whatever its name
+    """
+
+    if input_path is None:
+        input_path = Path.cwd() / 'input'
+    input_filepath = input_path / dump_filename
+
+    if output_path is None:
+        output_path = Path.cwd() / 'output'
+
+    with ExitStack() as stack:
+
+        stack.enter_context(instrument_stage('s01', output_path))
+
+        posts_line_callback = None
+        if build_index:
+            # imported here because 'dump_index' imports this module
+            from dump_index import DumpIndexWriter
+            index_writer = stack.enter_context(
+                DumpIndexWriter(input_filepath, output_path, table_prefix))
+            posts_line_callback = index_writer.add_line
 
-    output_filename = 's01_posts.csv'
-    output_filepath = output_path / output_filename
-    df.write_csv(output_filepath)
+        dfs = read_tables_from_sql_dump(
+            input_filepath, table_names, table_prefix, worker_n, 
+            posts_colnames, posts_row_filter, gzip_command, 
+            posts_line_callback)
+        write_tables(dfs, output_path, write_csv, intermediate_format)
 
 
 if __name__ == '__main__':
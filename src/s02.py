@@ -2,9 +2,20 @@
 
 import re
 import polars as pl
+import multiprocessing
 from pathlib import Path
 from ast import literal_eval
-from bs4 import BeautifulSoup as bs
+from typing import Iterable
+from concurrent.futures import ProcessPoolExecutor
+
+from post_cache import PostCache, hash_cache_key
+from url_normalization import (
+    remove_extraneous_text, get_url_rules, hash_url_rules)
+from intermediates import (
+    IntermediateFormat, write_intermediate, iter_intermediate_batches,
+    get_intermediate_bytes)
+from instrumentation import (
+    instrument_stage, instrumented, is_instrumented, record_metrics)
 
 
 def find_urls_in_string(a_string: str):
@@ -38,39 +49,6 @@ def find_urls_in_string(a_string: str):
     return urls
 
 
-def remove_ad_hoc_extraneous_text_from_url(a_string: str) -> str:
-    
-    extra_text = [
-        'Penrose: From Mathematical Notation to Beautiful Diagrams',
-        'Learning Neural Causal Models from Unknown InterventionsNan Rosemary Ke, Olexa Bilaniuk, Anirudh Goyal, Stefan Bauer, Hugo Larochelle, Chris Pal, Yoshua Bengio',
-        'Structural Time SeriesFF16 · October 2020',
-        'NeRF Explosion 2020Published: December 16, 2020',
-        'The Modern Stack for ML Infrastructure | OuterboundsMay 2, 2022Data Council',
-        'How to Freaking Find Great Developers By Having Them Read CodeApril 15, 2022 by freakingrectangle',
-        'AI And The Limits Of LanguageBy Jacob Browning and Yann LeCunAugust 23, 2022',
-        'Avenging Polanyi\'s Revenge (Exploiting the Approximate Omniscience of LLMs in Planning..)Subbarao KambhampatiAug 1, 2023"…we have to stop confusing the impressive form of the generated knowledge for correct content, and resist the temptation to ascribe emergent reasoning powers to approximate retrieval by these n-gram models…"',
-        'Computational Power and AIBy Jai Vipra & Sarah Myers WestSeptember 27, 2023',
-        'Thinking about High-Quality Human DataLilian WengFebruary 5, 2024',
-        'Defining optimal reliance on model predictions in AI-assisted decisionsJessica Hullman3/6/24 12:31 PM']
-
-    for e in extra_text:
-        a_string = a_string.replace(e, '')
-
-    return a_string
-
-
-def remove_extraneous_text_from_youtube_url(a_string: str) -> str:
-    """
-    Some YouTube URLs have extraneous text after the video ID; this function
-        removes that extraneous text
-    """
-
-    if 'youtu' in a_string:
-        a_string = a_string.split('?si')[0]
-
-    return a_string
-
-
 def extract_url_from_string_dict_given_start_idx(
     a_string: str, start_idx: int, dict_key: str='url') -> str:
 
@@ -118,101 +96,465 @@ def extract_url_from_string_dict(a_string) -> list[str]:
         return ['']
 
 
-def extract_urls_from_post_content(
-    post_content: pl.Series) -> list[list[str]]:
+def extract_url_from_post_html(content_txt: str) -> list[str]:
     """
-    Extracts URLs from a Series of post content, i.e., HTML from a webpage
+    Extracts URLs from the content of a post, i.e., HTML from a webpage, by 
+        parsing it
     """
 
+    # imported here so that runs that parse no HTML, e.g., because every 
+    #   post's URLs are cached, do not pay for importing it
+    from bs4 import BeautifulSoup as bs
+
+    soup = bs(content_txt, 'html.parser')
+
+    url = None
+
+    # 3 ways to extract URLs  
+    #   if earlier one(s) don't work, try next one
+    ##################################################
+
+    # Extraction #1
+    soup_as = soup.find_all('a')
+    urls = [a['href'] for a in soup_as]
+    if len(urls) >= 1:
+        url = [urls[0]]
+
+    # Extraction #2
+    if not url:
+        soup_ps = soup.find_all('p')
+        soup_ps_urls = [e.text for e in soup_ps if 'http' in e.text]
+        if len(soup_ps_urls) >= 1:
+            txt = soup_ps_urls[0]
+            txt = remove_extraneous_text(txt)
+            url = [txt]
+
+    # Extraction #3
+    if not url:
+        url_list = extract_url_from_string_dict(content_txt)
+        if len(url_list) > 1:
+            url = url_list
+        elif len(url_list) == 1 and url_list[0]:
+            url = [url_list[0]]
+        else:
+            url = ['']
+
+    return url
+
+
+# HTML comments, which the HTML parser skips
+html_comment_pattern = r'(?s)<!--.*?-->'
+
+# content that the HTML parser might not parse as the patterns below do:  
+#   unclosed or unusually closed comments, declarations, CDATA and other
+#   marked sections, processing instructions and bogus end tags, which the
+#   parser skips up to the next '>', elements whose content is not parsed as
+#   HTML, tag delimiters inside attribute values, and unquoted values that
+#   follow whitespace after the '=', which the parser reads as the value 
+#   rather than as the next attribute, or that run into a '<'
+unusual_html_pattern = (
+    r'(?i)<!|--[\s!]+>|<\?|</[^a-z]|'
+    r'<(?:script|style|textarea|title|xmp|plaintext|iframe|noembed|noframes|'
+    r'noscript)[\t\n\r\f />]|'
+    r'="[^"]*[<>]|=\'[^\']*[<>]|'
+    r'=\s+[^"\'\s>]|=[^"\'\s>]*<')
+
+# a repeated "url" key in an embedded dictionary, whose last value is the one
+#   that 'extract_url_from_string_dict' parses
+repeated_url_key_pattern = r',"url":'
+
+a_tag_pattern = r'(?i)(<a(?:[\t\n\r\f /][^>]*)?>)'
+a_href_tag_pattern = r'(?i)<a(?:[\t\n\r\f /][^>]*)?[\t\n\r\f /]href\s*=[^>]*>'
+p_tag_pattern = r'(?i)<p(?:[\t\n\r\f /][^>]*)?>'
+
+# a double-quoted 'href' value with no character references, which the HTML 
+#   parser would convert
+href_pattern = r'(?i)[\t\n\r\f /]href\s*=\s*"([^"&\r]*)"'
+href_attribute_pattern = r'(?i)href\s*='
+
+# an embedded dictionary that 'extract_url_from_string_dict' would parse to 
+#   the same URL
+url_dict_pattern = (
+    r'\{"url":"[^"\\]*"(?:,"\w+":(?:"[^"\\]*"|true|-?\d+))*\}')
+url_dict_url_pattern = r'^\{"url":"([^"\\]*)"'
+
+
+@instrumented('s02.extract_urls_from_post_content_vectorized')
+def extract_urls_from_post_content_vectorized(
+    post_content: pl.Series) -> list[list[str] | None]:
+    """
+    Extracts URLs from a Series of post content, i.e., HTML from a webpage, 
+        with string expressions over the whole Series instead of by parsing 
+        each post
+
+    Only posts whose URLs would be extracted by Extraction #1 (the first link)
+        or by Extraction #3 (the embedded dictionary) in 
+        'extract_url_from_post_html', and whose HTML is simple enough that the
+        expressions match what the HTML parser would find, are resolved; the 
+        URLs for all other posts are 'None'
+    """
+
+    df = pl.DataFrame({'content': post_content})
+
+    content = pl.col('content')
+    stripped = content.str.replace_all(html_comment_pattern, '')
+    first_a_tag = stripped.str.extract(a_tag_pattern, 1)
+    url_dicts = content.str.extract_all(url_dict_pattern)
+
+    df2 = df.select(
+        content.is_null().alias('is_null'),
+        (
+            content.str.contains(r'--[\s!]+>|<!---?>') | 
+            content.str.contains(repeated_url_key_pattern, literal=True) |
+            stripped.str.contains(unusual_html_pattern))
+            .alias('is_unusual'),
+        stripped.str.count_matches(a_tag_pattern).alias('a_n'),
+        stripped.str.count_matches(a_href_tag_pattern).alias('a_href_n'),
+        first_a_tag.str.extract(href_pattern, 1).alias('href'),
+        first_a_tag.str.count_matches(href_attribute_pattern)
+            .alias('first_a_href_n'),
+        stripped.str.count_matches(p_tag_pattern).alias('p_n'),
+        content.str.count_matches('{"url":', literal=True).alias('dict_n'),
+        url_dicts.list.eval(
+            pl.element().str.extract(url_dict_url_pattern, 1))
+            .alias('dict_urls'))
+
     extracted_urls = []
 
-    for content_txt in post_content:
+    for row in df2.iter_rows():
 
-        soup = bs(content_txt, 'html.parser')
+        (is_null, is_unusual, a_n, a_href_n, href, first_a_href_n, p_n, 
+            dict_n, dict_urls) = row
 
         url = None
 
-        # 3 ways to extract URLs  
-        #   if earlier one(s) don't work, try next one
-        ##################################################
+        if is_null or is_unusual:
+            pass
 
         # Extraction #1
-        soup_as = soup.find_all('a')
-        urls = [a['href'] for a in soup_as]
-        if len(urls) >= 1:
-            url = [urls[0]]
-
-        # Extraction #2
-        if not url:
-            soup_ps = soup.find_all('p')
-            soup_ps_urls = [e.text for e in soup_ps if 'http' in e.text]
-            if len(soup_ps_urls) >= 1:
-                txt = soup_ps_urls[0]
-                txt = remove_ad_hoc_extraneous_text_from_url(txt)
-                url = [txt]
+        elif a_n:
+            if (a_n == a_href_n and first_a_href_n == 1 and 
+                href is not None):
+                url = [href]
+
+        # Extraction #2 needs the text of the paragraphs, so leave those posts
+        #   to the HTML parser
+        elif p_n:
+            pass
 
         # Extraction #3
-        if not url:
-            url_list = extract_url_from_string_dict(content_txt)
-            if len(url_list) > 1:
-                url = url_list
-            elif len(url_list) == 1 and url_list[0]:
-                url = [url_list[0]]
+        elif not dict_n:
+            url = ['']
+        elif len(dict_urls) == dict_n and not any(
+            'true' in e for e in dict_urls):
+            if dict_n == 1:
+                url = [dict_urls[0]]
             else:
-                url = ['']
-
-        if isinstance(url, str):
-            url = remove_extraneous_text_from_youtube_url(url)
+                url = [dict_urls[0], dict_urls[-1]]
 
         extracted_urls.append(url)
 
     return extracted_urls
 
 
-def main():
+@instrumented('s02.extract_urls_from_post_content')
+def extract_urls_from_post_content(
+    post_content: pl.Series, worker_n: int=1, chunksize: int=32,
+    executor: ProcessPoolExecutor | None=None) -> list[list[str]]:
     """
-    Filter posts from the WordPress website whose titles begin with "What I"
-        (as for "What I Read" and "What I Watch") and extract URLs to which 
-        those posts refer
+    Extracts URLs from a Series of post content, i.e., HTML from a webpage
+
+    Nearly every post is resolved by the string expressions in 
+        'extract_urls_from_post_content_vectorized'; only the remaining posts 
+        are parsed as HTML, in a pool of 'worker_n' processes that each receive
+        batches of 'chunksize' posts, if 'worker_n' is greater than 1; if
+        'executor' is given, its processes are used instead of a new pool, so
+        that a caller that extracts URLs from many batches of posts starts the
+        processes only once
+
+    The URLs are returned in the same order as the posts
+    """
+
+    vectorized_urls = extract_urls_from_post_content_vectorized(post_content)
+
+    unresolved_content = [
+        content_txt 
+        for url, content_txt in zip(vectorized_urls, post_content) 
+        if url is None]
+
+    if worker_n > 1 and len(unresolved_content) > chunksize:
+        if executor is None:
+            mp_context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(
+                worker_n, mp_context=mp_context) as new_executor:
+                parsed_urls = list(new_executor.map(
+                    extract_url_from_post_html, unresolved_content, 
+                    chunksize=chunksize))
+        else:
+            parsed_urls = list(executor.map(
+                extract_url_from_post_html, unresolved_content, 
+                chunksize=chunksize))
+    else:
+        parsed_urls = [
+            extract_url_from_post_html(e) for e in unresolved_content]
+
+    parsed_urls = iter(parsed_urls)
+    extracted_urls = [
+        url if url is not None else next(parsed_urls) 
+        for url in vectorized_urls]
+
+    return extracted_urls
+
+
+# increment when a change to the extraction changes its results, so that 
+#   results cached by the earlier code are discarded
+url_extraction_cache_version = 3
+
+# the columns that identify a post's version, if they are present
+post_version_colnames = ['ID', 'post_modified']
+
+
+@instrumented('s02.extract_urls_from_post_content_cached')
+def extract_urls_from_post_content_cached(
+    df: pl.DataFrame, cache: PostCache, worker_n: int=1,
+    executor: ProcessPoolExecutor | None=None) -> list[list[str]]:
+    """
+    Extracts URLs from the 'post_content' column of a DataFrame of posts, as 
+        'extract_urls_from_post_content' does, but reuses the URLs cached for
+        posts whose ID, modification date and content are unchanged; only the
+        posts that are not in the cache are parsed, and their URLs are added to
+        the cache
+
+    The URLs are cached with a hash of the URL rules that they were extracted
+        with, so that a change to the rules file is not hidden by the cache
+    """
+
+    url_rules_hash = hash_url_rules(get_url_rules())
+    key_colnames = [
+        e for e in post_version_colnames if e in df.columns] + ['post_content']
+    keys = [
+        hash_cache_key(*row, url_rules_hash)
+        for row in df.select(key_colnames).iter_rows()]
+
+    cached_urls = cache.get_many(keys)
+
+    missing_idxs = [i for i, e in enumerate(keys) if e not in cached_urls]
+    record_metrics(
+        cache_hits=len(keys) - len(missing_idxs), 
+        cache_misses=len(missing_idxs))
+    if missing_idxs:
+        missing_content = df['post_content'].gather(missing_idxs)
+        missing_urls = extract_urls_from_post_content(
+            missing_content, worker_n, executor=executor)
+        new_urls = {keys[i]: url for i, url in zip(missing_idxs, missing_urls)}
+        cache.set_many(new_urls)
+        cached_urls.update(new_urls)
+
+    extracted_urls = [cached_urls[e] for e in keys]
+
+    return extracted_urls
+
+
+# the name of the file in the output directory's 'cache' directory in which 
+#   extracted URLs are cached
+url_cache_filename = 's02_post_urls.sqlite'
+
+
+@instrumented('s02.filter_website_read_posts')
+def filter_website_read_posts(
+    df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame:
     """
+    Filter posts from the WordPress website whose titles begin with "What I"
+        (as for "What I Read" and "What I Watch") and that are published
 
-    input_path = Path.cwd() / 'output'
-    output_path = input_path
-    input_filename = 's01_posts.parquet'
-    input_filepath = input_path / input_filename
-    df = pl.read_parquet(input_filepath)
+    If 'df' is a LazyFrame, e.g., from 'scan_intermediate', the filters are 
+        applied as the posts are read, so that the other posts are not loaded
+    """
 
-    assert (df[:, 2] == df[:, 3]).all()
-    assert (df['post_date'] == df['post_date_gmt']).all()
+    lf = df.lazy()
 
-    # col_idxs = [2, 4, 5, 7, 11, 18, 20]
+    assert lf.select(
+        pl.col('post_date').eq(pl.col('post_date_gmt')).all()).collect().item()
 
     # filter by "What I Read/Watch"
-    df2 = df.filter(
+    is_website_read_post = (
         pl.col('post_type').eq('post') &
         pl.col('post_title').str.to_lowercase().str.starts_with('what i'))
 
-    # 'post_type' column at index 20 no longer needed
-    col_idxs = [2, 4, 5, 7, 11]
-
     # for the purpose of needing a single copy of each post, 'inherit' is 
     #   redundant
     # 'draft' and 'auto-draft' are also unneeded
-    df3 = df2.filter(
+    is_published = (
         ~pl.col('post_status').eq('inherit') &
         ~pl.col('post_status').str.contains('draft') )
 
-    post_urls = extract_urls_from_post_content(df3['post_content'])
+    if is_instrumented():
+        drop_counts = lf.select(
+            is_website_read_post.not_().sum().alias('dropped_not_what_i'),
+            (is_website_read_post & is_published.not_()).sum()
+            .alias('dropped_unpublished')).collect()
+        record_metrics(**drop_counts.row(0, named=True))
+
+    df3 = (
+        lf
+        .filter(is_website_read_post)
+        .filter(is_published)
+        .collect())
+
+    return df3
+
+
+@instrumented('s02.extract_website_read_post_urls')
+def extract_website_read_post_urls(
+    df3: pl.DataFrame, worker_n: int=1, cache: PostCache | None=None,
+    executor: ProcessPoolExecutor | None=None) -> pl.DataFrame:
+    """
+    Extract URLs to which filtered posts (see 'filter_website_read_posts') 
+        refer and sort the posts by date and ID
+
+    Posts that need their HTML parsed are parsed in a pool of 'worker_n' 
+        processes, if 'worker_n' is greater than 1, or in 'executor', if it is
+        given
+
+    If 'cache' is given, the URLs of posts that are unchanged since an earlier
+        run are read from it instead of being extracted again
+    """
+
+    # 'post_type' column no longer needed
+    # 'ID' is kept so that the posts of an incremental run can replace the
+    #   earlier versions of the same posts (see 'pipeline.py')
+    colnames = [
+        'ID', 'post_date', 'post_content', 'post_title', 'post_status', 
+        'post_name']
+
+    if cache is not None:
+        post_urls = extract_urls_from_post_content_cached(
+            df3, cache, worker_n, executor)
+    else:
+        post_urls = extract_urls_from_post_content(
+            df3['post_content'], worker_n, executor=executor)
     assert len(post_urls) == len(df3)
 
-    post_srs = pl.Series(post_urls).alias('post_urls')
-    df4 = df3[:, col_idxs].with_columns(post_srs)
+    post_srs = pl.Series(post_urls, dtype=pl.List(pl.Utf8)).alias('post_urls')
+    df4 = df3.select(colnames).with_columns(post_srs)
+
+    # posts with the same date are ordered by ID, so that the order, and 
+    #   therefore which of the posts with the same markdown filename is 
+    #   written last in step 04, does not depend on the order of the SQL dump
+    df5 = df4.sort('post_date', 'ID')
+
+    return df5
+
+
+@instrumented('s02.select_website_read_posts')
+def select_website_read_posts(
+    df: pl.DataFrame | pl.LazyFrame, worker_n: int=1, 
+    cache: PostCache | None=None) -> pl.DataFrame:
+    """
+    Filter posts from the WordPress website whose titles begin with "What I"
+        (as for "What I Read" and "What I Watch") and extract URLs to which 
+        those posts refer (see 'filter_website_read_posts' and 
+        'extract_website_read_post_urls')
+
+    Posts that need their HTML parsed are parsed in a pool of 'worker_n' 
+        processes, if 'worker_n' is greater than 1
+
+    If 'cache' is given, the URLs of posts that are unchanged since an earlier
+        run are read from it instead of being extracted again
+    """
+
+    df3 = filter_website_read_posts(df)
+    df5 = extract_website_read_post_urls(df3, worker_n, cache)
 
-    df5 = df4.sort('post_date')
+    return df5
+
+
+# the number of posts that step 02 reads into memory at a time
+post_batch_size = 10_000
+
+
+@instrumented('s02.select_website_read_posts_batched')
+def select_website_read_posts_batched(
+    batches: Iterable[pl.DataFrame], worker_n: int=1, 
+    cache: PostCache | None=None) -> pl.DataFrame:
+    """
+    Selects posts and extracts their URLs as 'select_website_read_posts' does,
+        but from batches of posts, e.g., from 'iter_intermediate_batches', so
+        that only one batch of the posts' HTML is held in memory at a time
+
+    The posts selected from each batch are assembled into a single DataFrame,
+        so the memory needed depends on the size of a batch and on the size of
+        the selected posts, which step 03 reads whole, not on the size of the
+        archive
+    """
+
+    mp_context = multiprocessing.get_context('spawn')
+    executor = (
+        ProcessPoolExecutor(worker_n, mp_context=mp_context)
+        if worker_n > 1 else None)
+
+    selected_dfs = []
+    try:
+        for df in batches:
+            df3 = filter_website_read_posts(df)
+            selected_dfs.append(
+                extract_website_read_post_urls(df3, worker_n, cache, executor))
+            del df, df3
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    # each batch is sorted, but the batches are not in order
+    df5 = pl.concat(selected_dfs).sort('post_date', 'ID')
+
+    return df5
+
+
+def main(
+    worker_n: int=1, use_cache: bool=True, output_path: Path | None=None, 
+    intermediate_format: IntermediateFormat | None=None,
+    batch_size: int=post_batch_size):
+    """
+    Filter posts from the WordPress website whose titles begin with "What I"
+        (as for "What I Read" and "What I Watch") and extract URLs to which 
+        those posts refer (see 'select_website_read_posts')
+
+    The posts are read in batches of 'batch_size' posts (see 
+        'select_website_read_posts_batched'), so that the archive is never
+        held in memory all at once
+
+    If 'use_cache' is 'True', the URLs of posts that are unchanged since an 
+        earlier run are read from a cache in the output directory instead of
+        being extracted again
+
+    The input and output files are in 'output_path', which defaults to the
+        'output' directory in the current working directory
+    """
+
+    if output_path is None:
+        output_path = Path.cwd() / 'output'
+    input_path = output_path
+    input_name = 's01_posts'
+
+    with instrument_stage('s02', output_path):
+
+        batches = iter_intermediate_batches(input_path, input_name, batch_size)
+        record_metrics(
+            bytes_read=get_intermediate_bytes(input_path, input_name))
+
+        if use_cache:
+            cache_filepath = output_path / 'cache' / url_cache_filename
+            with PostCache(
+                cache_filepath, version=url_extraction_cache_version) as cache:
+                df5 = select_website_read_posts_batched(
+                    batches, worker_n, cache)
+        else:
+            df5 = select_website_read_posts_batched(batches, worker_n)
 
-    output_filename = 's02_website_read_posts.parquet'
-    output_filepath = output_path / output_filename
-    df5.write_parquet(output_filepath)
+        output_name = 's02_website_read_posts'
+        write_intermediate(df5, output_path, output_name, intermediate_format)
+        record_metrics(
+            bytes_written=get_intermediate_bytes(output_path, output_name))
 
     # df2[:, col_idxs]
     # df3[:, col_idxs]
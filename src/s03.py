@@ -1,79 +1,99 @@
 #! /usr/bin/env python3
 
+import struct
+import pyarrow as pa
 import polars as pl
+import pyarrow.compute as pc
 from pathlib import Path
+from typing import Iterable
+from urllib.parse import urlsplit
+from collections import defaultdict
 
+from url_normalization import normalize_url_column
+from intermediates import (
+    IntermediateFormat, write_intermediate, scan_intermediate, 
+    get_intermediate_bytes)
+from instrumentation import (
+    instrument_stage, instrumented, is_instrumented, record_metrics, 
+    record_file_bytes)
 
-def read_text_file(
-    text_filename: str | Path, return_string: bool=False, 
-    keep_newlines: bool=False):
-    """
-    Reads text file
-    If 'return_string' is 'True', returns text in file as a single string
-    If 'return_string' is 'False', returns list so that each line of text in
-        file is a separate list item
-    If 'keep_newlines' is 'True', newline markers '\n' are retained; otherwise,
-        they are deleted
 
-    :param text_filename: string specifying filepath or filename of text file
-    :param return_string: Boolean indicating whether contents of text file
-        should be returned as a single string or as a list of strings
-    :return:
+def read_text_file_lines(text_filename: str | Path) -> pa.Array:
     """
+    Reads the lines of a UTF-8 text file into an Arrow array of strings, 
+        without their line breaks
+
+    The file is memory-mapped and split into lines by Arrow, so that no Python
+        string is created for any line; line breaks may be '\n', '\r\n' or
+        '\r', as when a file is read in Python's text mode
 
-    text_list = []
+    Raises an error if the file cannot be read or is not valid UTF-8
+    """
 
-    try:
-        with open(text_filename) as text:
-            if return_string:
-                # read entire text file as single string
-                if keep_newlines:
-                    text_list = text.read()
-                else:
-                    text_list = text.read().replace('\n', '')
-            else:
-                # read each line of text file as separate item in a list
-                for line in text:
-                    if keep_newlines:
-                        text_list.append(line)
-                    else:
-                        text_list.append(line.rstrip('\n'))
-            text.close()
+    with pa.memory_map(str(text_filename)) as f:
+        data = f.read_buffer()
 
-        return text_list
+    # view the entire file as a single string without copying it
+    if data.size:
+        offsets = pa.py_buffer(struct.pack('<qq', 0, data.size))
+        text = pa.Array.from_buffers(
+            pa.large_string(), 1, [None, offsets, data])
+        text.validate(full=True)
+    else:
+        text = pa.array([''], pa.large_string())
 
-    except:
+    lines = pc.split_pattern_regex(text, r'\r\n|\r|\n').flatten()
 
-        return ['There was an error when trying to read text file']
+    return lines
 
 
-def convert_posts_text_file_to_dataframe(posts_txt: list[str]) -> pl.DataFrame:
+def convert_posts_text_file_to_dataframe(
+    posts_txt: Iterable[str] | pa.Array) -> pl.DataFrame:
     """
     Convert text file of posts into a DataFrame with a column of URLs and a
         column of the text of each post represented as a list of strings
+
+    Posts are separated by blank lines, and the first line of each post is its
+        URL; the list column is built from the offsets at which each post 
+        starts, so that the lines are never grouped in Python
     """
 
-    post_units = []
-    unit = []
-    for e in posts_txt:
-        if e.strip():
-            unit.append(e)
-        else:
-            if unit:
-                post_units.append(unit)
-            unit = []
+    lines = pl.Series('line', posts_txt, dtype=pl.Utf8)
 
-    post_urls = [e[0] for e in post_units]
+    is_blank = lines.str.strip_chars().eq('')
+    unit_lines = lines.filter(~is_blank)
+    unit_idxs = is_blank.cum_sum().filter(~is_blank)
 
-    assert len(post_units) == len(post_urls)
+    # a post starts at each line whose preceding line was blank
+    unit_starts = (unit_idxs != unit_idxs.shift(1)).fill_null(True)
+    unit_offsets = pl.concat([
+        unit_starts.arg_true().cast(pl.Int32), 
+        pl.Series([len(unit_lines)], dtype=pl.Int32)])
 
-    unit_srs = pl.Series(post_units).alias('unit')
-    url_srs = pl.Series(post_urls).alias('url')
+    # Polars does not correctly import a list of Arrow 'large_string' values,
+    #   so the values are converted to 'string'
+    units = pa.ListArray.from_arrays(
+        unit_offsets.to_arrow(), unit_lines.to_arrow().cast(pa.string()))
+    unit_srs = pl.Series('unit', pl.from_arrow(units))
+    url_srs = unit_srs.list.first().alias('url')
     posts_df = pl.DataFrame([url_srs, unit_srs])
 
     return posts_df
 
 
+@instrumented('s03.read_posts_text_file')
+def read_posts_text_file(text_filename: str | Path) -> pl.DataFrame:
+    """
+    Read text file of posts into a DataFrame with a column of URLs and a column
+        of the text of each post represented as a list of strings
+    """
+
+    lines = read_text_file_lines(text_filename)
+    posts_df = convert_posts_text_file_to_dataframe(lines)
+
+    return posts_df
+
+
 def insert_missing_urls(df: pl.DataFrame) -> pl.DataFrame:
     """
     Some URLs were mistakenly never included in the website post, so insert 
@@ -106,88 +126,327 @@ def insert_missing_urls(df: pl.DataFrame) -> pl.DataFrame:
     return df3
 
 
-def adjust_urls(df: pl.DataFrame) -> pl.DataFrame:
+def convert_url_to_match_key(url: str) -> str:
+    """
+    Reduces a URL to the lowercase host, path and query by which it is compared
+        to other URLs, so that differences in scheme or in a 'www.' prefix are
+        ignored
+    """
 
-    # some URLs end in a slash or question mark and some don't, so remove them
-    # slash_mask = df['url'].str.ends_with('/') | df['url'].str.ends_with('?')
-    punct_mask = df['url'].str.contains('[/?]$', literal=False)
-    df2 = df.with_columns(
-        pl.when(punct_mask)
-        .then(
-            pl.col('url')
-            .str.slice(0, length=pl.col('url').str.len_chars()-1))
-        .otherwise(pl.col('url')))
+    parts = urlsplit(url.strip().lower())
+    if not parts.netloc:
+        # a URL without a scheme is parsed as a path
+        parts = urlsplit('//' + url.strip().lower())
 
-    # one URL ends in '#nice', so remove it
-    hash_mask = df2['url'].str.ends_with('#nice')
-    df3 = df2.with_columns(
-        pl.when(hash_mask)
-        .then(
-            pl.col('url')
-            .str.slice(0, length=pl.col('url').str.len_chars()-5))
-        .otherwise(pl.col('url')))
-
-    # one URL was improperly rendered due to its underscores, so correct it
-    url_0 = (
-        'https://thegradient.pub/bootstrapping-labels-via-_-supervision-human-in-the-loop')
-    url_1 = (
-        'https://thegradient.pub/bootstrapping-labels-via-___-supervision-human-in-the-loop')
-    df4 = df3.with_columns(
-        pl.when(pl.col('url').eq(url_0))
-        .then(pl.lit(url_1).alias('url'))
-        .otherwise(pl.col('url')))
+    host = parts.netloc.removeprefix('www.')
+    match_key = host + parts.path
+    if parts.query:
+        match_key += '?' + parts.query
 
-    return df4
+    return match_key
 
 
-def remove_url_end_slash(
-    df: pl.DataFrame, url_colname: str='url') -> pl.DataFrame:
+def get_ngrams(a_string: str, ngram_n: int=3) -> set[str]:
     """
-    Remove the trailing slash from the URLs in DataFrame column named 'url'
+    Returns the set of character n-grams of a string
     """
 
-    # some URLs end in a slash and some don't, so remove them
-    slash_mask = df[url_colname].str.ends_with('/')
-    df2 = df.with_columns(
-        pl.when(slash_mask)
-        .then(
-            pl.col(url_colname)
-            .str.slice(0, length=pl.col(url_colname).str.len_chars()-1))
-        .otherwise(pl.col(url_colname)))
+    if len(a_string) <= ngram_n:
+        return {a_string}
 
-    return df2
+    ngrams = {
+        a_string[i:i+ngram_n] for i in range(len(a_string) - ngram_n + 1)}
 
+    return ngrams
 
-def main():
+
+def find_url_match_candidates(
+    urls: list[str], candidate_urls: list[str], ngram_n: int=3, 
+    max_block_size: int=50, min_score: float=0.5, 
+    candidate_n: int=3) -> pl.DataFrame:
     """
-    Combine information about posts from Wordpress website with information
-        about those same posts from the original text file
+    Finds the URLs in 'candidate_urls' that are most similar to each URL in
+        'urls', ranked by the Jaccard similarity of the character n-grams of 
+        their match keys (see 'convert_url_to_match_key')
+
+    Instead of comparing every pair of URLs, candidate URLs are indexed by 
+        their host and by their n-grams, and each URL is compared only to the 
+        candidates that share its host or one of its n-grams; hosts and n-grams
+        that are shared by more than 'max_block_size' candidates, like 'com/', 
+        are too common to narrow down the candidates and are not used
+
+    Returns a DataFrame with up to 'candidate_n' candidates with a similarity 
+        of at least 'min_score' for each URL
     """
 
-    input_path = Path.cwd() / 'input'
-    output_path = Path.cwd() / 'output'
+    candidate_keys = [convert_url_to_match_key(e) for e in candidate_urls]
+    candidate_ngrams = [get_ngrams(e, ngram_n) for e in candidate_keys]
+
+    host_index = defaultdict(list)
+    ngram_index = defaultdict(list)
+    for i, (key, ngrams) in enumerate(zip(candidate_keys, candidate_ngrams)):
+        host_index[key.split('/', 1)[0]].append(i)
+        for e in ngrams:
+            ngram_index[e].append(i)
+
+    matches = []
 
-    input_filename = '01posts.txt'
-    input_filepath = input_path / input_filename
-    posts_txt = read_text_file(input_filepath)
+    for url in urls:
 
-    input_filename = 's02_website_read_posts.parquet'
-    input_filepath = output_path / input_filename
-    df = pl.read_parquet(input_filepath)
+        key = convert_url_to_match_key(url)
+        ngrams = get_ngrams(key, ngram_n)
 
-    assert isinstance(posts_txt, list)
-    posts_df = convert_posts_text_file_to_dataframe(posts_txt)
-    posts_df = remove_url_end_slash(posts_df)
+        blocks = [host_index.get(key.split('/', 1)[0], [])]
+        blocks.extend(ngram_index.get(e, []) for e in ngrams)
+        candidate_idxs = set()
+        for block in blocks:
+            if len(block) <= max_block_size:
+                candidate_idxs.update(block)
+
+        scores = []
+        for i in candidate_idxs:
+            shared_n = len(ngrams & candidate_ngrams[i])
+            union_n = len(ngrams) + len(candidate_ngrams[i]) - shared_n
+            score = shared_n / union_n
+            if score >= min_score:
+                scores.append((score, candidate_urls[i]))
+
+        scores.sort(key=lambda e: (-e[0], e[1]))
+        for rank, (score, candidate_url) in enumerate(scores[:candidate_n], 1):
+            matches.append((url, candidate_url, score, rank))
+
+    matches_df = pl.DataFrame(
+        matches, orient='row', 
+        schema={
+            'url': pl.Utf8, 'candidate_url': pl.Utf8, 'score': pl.Float64, 
+            'rank': pl.Int64})
+
+    return matches_df
+
+
+@instrumented('s03.reconcile_urls')
+def reconcile_urls(
+    df: pl.DataFrame, posts_df: pl.DataFrame, **kwargs) -> pl.DataFrame:
+    """
+    Reports the posts from the website and the posts from the text file whose
+        URLs do not match any URL from the other source, along with ranked 
+        candidate matches for each of the website posts from among the text 
+        file posts (see 'find_url_match_candidates')
+    """
+
+    unmatched_df = df.join(posts_df, on='url', how='anti')
+    unmatched_posts_df = posts_df.join(df, on='url', how='anti')
+
+    website_urls = unmatched_df['url'].drop_nulls().unique().to_list()
+    textfile_urls = unmatched_posts_df['url'].drop_nulls().unique().to_list()
+    matches_df = find_url_match_candidates(
+        website_urls, textfile_urls, **kwargs)
+
+    website_report_df = (
+        unmatched_df
+        .select('post_date', 'post_title', 'url')
+        .join(matches_df, on='url', how='left')
+        .with_columns(pl.lit('website').alias('source')))
+
+    textfile_report_df = (
+        unmatched_posts_df
+        .select('url')
+        .with_columns(pl.lit('text_file').alias('source')))
+
+    report_df = (
+        pl.concat([website_report_df, textfile_report_df], how='diagonal')
+        .select(
+            'source', 'post_date', 'post_title', 'url', 'candidate_url', 
+            'score', 'rank'))
+
+    return report_df
+
+
+def prepare_website_posts(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Adds the normalized URL on which each post from the Wordpress website is 
+        joined to the posts from the text file
+    """
 
     df2 = df.with_columns(pl.col('post_urls').list.get(0).alias('url'))
     df3 = insert_missing_urls(df2)
-    df4 = adjust_urls(df3)
+
+    # the URLs from the website and from the text file are joined on, so they
+    #   are normalized by the same rules
+    df4 = normalize_url_column(df3)
+
+    return df4
+
+
+def prepare_textfile_posts(posts_df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Normalizes the URLs of the posts from the text file, by the same rules as 
+        for the posts from the Wordpress website (see 'prepare_website_posts')
+    """
+
+    return normalize_url_column(posts_df)
+
+
+@instrumented('s03.merge_website_and_textfile_posts')
+def merge_website_and_textfile_posts(
+    df: pl.DataFrame, posts_df: pl.DataFrame
+    ) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    Combine information about posts from Wordpress website with information
+        about those same posts from the original text file
+
+    Returns the combined posts and a report of the posts that could not be 
+        combined (see 'reconcile_urls')
+    """
+
+    posts_df = prepare_textfile_posts(posts_df)
+    df4 = prepare_website_posts(df)
+
+    df5, report_df = merge_prepared_posts(df4, posts_df)
+
+    return df5, report_df
+
+
+def merge_prepared_posts(
+    df4: pl.DataFrame, posts_df: pl.DataFrame
+    ) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    Combines posts from the Wordpress website and from the text file whose URLs
+        have been normalized (see 'prepare_website_posts' and 
+        'prepare_textfile_posts'), as 'merge_website_and_textfile_posts' does
+    """
 
     df5 = df4.join(posts_df, on='url', how='inner')
 
-    output_filename = 's03_website_textfile_merged.parquet'
-    output_filepath = output_path / output_filename 
-    df5.write_parquet(output_filepath)
+    if is_instrumented():
+        is_matched = df4['url'].is_in(posts_df['url']).fill_null(False)
+        is_unit_matched = posts_df['url'].is_in(df4['url']).fill_null(False)
+        record_metrics(
+            output_rows=len(df5), textfile_rows=len(posts_df), 
+            dropped_by_join_website=int(is_matched.not_().sum()), 
+            dropped_by_join_textfile=int(is_unit_matched.not_().sum()))
+
+    # posts without an exact match are dropped by the join, so report them 
+    #   along with their closest matches, so that their URLs can be corrected
+    report_df = reconcile_urls(df4, posts_df)
+
+    return df5, report_df
+
+
+# the name of the file of the posts from the text file that 'main_textfile' 
+#   saves for 'main_merge'
+textfile_posts_name = 's03_textfile_posts'
+
+
+def write_merged_posts(
+    df5: pl.DataFrame, report_df: pl.DataFrame, output_path: Path, 
+    intermediate_format: IntermediateFormat | None=None):
+    """
+    Saves the combined posts and the report of the posts that could not be
+        combined (see 'merge_website_and_textfile_posts')
+    """
+
+    report_filename = 's03_unmatched_url_candidates.csv'
+    report_filepath = output_path / report_filename
+    report_df.write_csv(report_filepath)
+
+    output_name = 's03_website_textfile_merged'
+    write_intermediate(df5, output_path, output_name, intermediate_format)
+    record_file_bytes('bytes_written', report_filepath)
+    record_metrics(
+        bytes_written=get_intermediate_bytes(output_path, output_name))
+
+
+def main_textfile(
+    input_path: Path | None=None, output_path: Path | None=None, 
+    intermediate_format: IntermediateFormat | None=None, 
+    textfile_filename: str='01posts.txt'):
+    """
+    Runs the half of step 03 that reads only the text file:  reads its posts,
+        normalizes their URLs (see 'prepare_textfile_posts') and saves them for
+        'main_merge', so that it can run at the same time as steps 01 and 02
+
+    'input_path' and 'output_path' default to the 'input' and 'output' 
+        directories in the current working directory
+    """
+
+    if input_path is None:
+        input_path = Path.cwd() / 'input'
+    if output_path is None:
+        output_path = Path.cwd() / 'output'
+
+    with instrument_stage('s03_textfile', output_path):
+
+        textfile_filepath = input_path / textfile_filename
+        posts_df = prepare_textfile_posts(
+            read_posts_text_file(textfile_filepath))
+        record_file_bytes('bytes_read', textfile_filepath)
+
+        write_intermediate(
+            posts_df, output_path, textfile_posts_name, intermediate_format)
+        record_metrics(bytes_written=get_intermediate_bytes(
+            output_path, textfile_posts_name))
+
+
+def main_merge(
+    output_path: Path | None=None, 
+    intermediate_format: IntermediateFormat | None=None):
+    """
+    Runs the half of step 03 that combines the posts from the Wordpress website
+        with the posts from the text file that 'main_textfile' saved
+
+    'output_path' defaults to the 'output' directory in the current working 
+        directory
+    """
+
+    if output_path is None:
+        output_path = Path.cwd() / 'output'
+
+    with instrument_stage('s03_merge', output_path):
+
+        input_names = ['s02_website_read_posts', textfile_posts_name]
+        df, posts_df = [
+            scan_intermediate(output_path, e).collect() for e in input_names]
+        record_metrics(bytes_read=sum(
+            get_intermediate_bytes(output_path, e) for e in input_names))
+
+        df4 = prepare_website_posts(df)
+        df5, report_df = merge_prepared_posts(df4, posts_df)
+
+        write_merged_posts(df5, report_df, output_path, intermediate_format)
+
+
+def main(
+    input_path: Path | None=None, output_path: Path | None=None, 
+    intermediate_format: IntermediateFormat | None=None):
+    """
+    Combine information about posts from Wordpress website with information
+        about those same posts from the original text file
+
+    'input_path' and 'output_path' default to the 'input' and 'output' 
+        directories in the current working directory
+    """
+
+    if input_path is None:
+        input_path = Path.cwd() / 'input'
+    if output_path is None:
+        output_path = Path.cwd() / 'output'
+
+    with instrument_stage('s03', output_path):
+
+        input_filename = '01posts.txt'
+        textfile_filepath = input_path / input_filename
+        posts_df = read_posts_text_file(textfile_filepath)
+
+        input_name = 's02_website_read_posts'
+        df = scan_intermediate(output_path, input_name).collect()
+        record_file_bytes('bytes_read', textfile_filepath)
+        record_metrics(
+            bytes_read=get_intermediate_bytes(output_path, input_name))
+
+        df5, report_df = merge_website_and_textfile_posts(df, posts_df)
+
+        write_merged_posts(df5, report_df, output_path, intermediate_format)
 
 
 if __name__ == '__main__':
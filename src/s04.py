@@ -1,11 +1,19 @@
 #! /usr/bin/env python3
 
+import os
 import re
+import json
+import hashlib
 import polars as pl
 from typing import Any
 from pathlib import Path
 from dataclasses import dataclass
-from validators import url as valid_url
+from concurrent.futures import ThreadPoolExecutor
+
+from post_cache import PostCache, hash_cache_key
+from intermediates import (
+    scan_intermediate, get_intermediate_bytes, write_atomically)
+from instrumentation import instrument_stage, instrumented, record_metrics
 
 
 @dataclass
@@ -38,6 +46,8 @@ def convert_post_to_markdown(post_info: dict[str, Any]) -> Post:
         saved as a markdown file
     """
 
+    from validators import url as valid_url
+
     title = post_info['post_title']
     date_sep = '-'
     date = post_info['post_date'].strftime(f'%Y{date_sep}%m{date_sep}%d')
@@ -97,63 +107,413 @@ def convert_post_to_markdown(post_info: dict[str, Any]) -> Post:
     return post
 
 
-def write_list_to_text_file(
-    a_list: list[str], text_filename: Path | str, overwrite: bool=False):
+def add_markdown_line_end(line: pl.Expr) -> pl.Expr:
+    """
+    Ends each line of markdown with a newline
+    
+    Some markdown formats/readers display new lines when 2 spaces are at the 
+        end of a line, so those spaces are added, except to the lines that 
+        delimit the front matter, because there those spaces disrupt Zola 
+        static site generator
+    """
+
+    line_end = (
+        pl.when(line.str.contains('+++', literal=True))
+        .then(pl.lit('\n'))
+        .otherwise(pl.lit('  \n')))
+
+    return line + line_end
+
+
+# the characters in a string that 'repr' writes as they are; a list of 
+#   strings that contain only these can be written without 'repr'
+repr_safe_pattern = r"^[ -&(-\[\]-~]*$"
+
+
+def format_tags(tags: pl.Series) -> pl.Series:
     """
-    Writes a list of strings to a text file
-    If 'overwrite' is 'True', any existing file by the name of 'text_filename'
-        will be overwritten
-    If 'overwrite' is 'False', list of strings will be appended to any existing
-        file by the name of 'text_filename'
+    Formats each list of tags as 'str' formats a Python list of strings, e.g., 
+        "['tag1', 'tag2']"
 
-    :param a_list: a list of strings to be written to a text file
-    :param text_filename: a string denoting the filepath or filename of text
-        file
-    :param overwrite: Boolean indicating whether to overwrite any existing text
-        file or to append 'a_list' to that file's contents
+    Most lists are formatted by joining their tags; only lists with tags that 
+        'repr' would quote or escape differently are formatted in Python
     """
 
-    if overwrite:
-        append_or_overwrite = 'w'
+    tags_str = pl.concat_str(
+        pl.lit('['), 
+        pl.when(tags.list.len() > 0)
+        .then(pl.lit("'") + tags.list.join("', '") + pl.lit("'"))
+        .otherwise(pl.lit('')),
+        pl.lit(']'))
+    is_repr_safe = tags.list.eval(
+        pl.element().str.contains(repr_safe_pattern)).list.all()
+
+    df = pl.DataFrame({'tags': tags}).select(
+        tags_str.alias('tags_str'), is_repr_safe.alias('is_repr_safe'))
+    tags_strs = df['tags_str']
+
+    unsafe_idxs = df['is_repr_safe'].not_().arg_true()
+    if len(unsafe_idxs):
+        unsafe_tags_strs = [
+            str(e) for e in tags.gather(unsafe_idxs).to_list()]
+        tags_strs = tags_strs.scatter(unsafe_idxs, unsafe_tags_strs)
+
+    return tags_strs
+
+
+@instrumented('s04.render_posts_markdown')
+def render_posts_markdown(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Converts each post in a DataFrame to the filename and the text of its 
+        markdown file, as 'convert_post_to_markdown' and 'render_post_text' do,
+        but with expressions over whole columns instead of row by row
+
+    Whether a line of a post is a URL is checked once for each distinct line
+
+    >>> from datetime import datetime
+    >>> schema = {
+    ...     'post_title': pl.Utf8, 'post_date': pl.Datetime, 
+    ...     'unit': pl.List(pl.Utf8)}
+    >>> render_posts_markdown(pl.DataFrame(schema=schema)).shape
+    (0, 2)
+    >>> render_posts_markdown(pl.DataFrame(
+    ...     {'post_title': ['What I Read:  A b'], 
+    ...      'post_date': [datetime(2024, 1, 2)], 'unit': [['tag']]}, 
+    ...     schema=schema)).row(0)[0]
+    '2024-01-02_a_b.md'
+    """
+
+    # imported here so that runs whose markdown is all cached do not pay for
+    #   importing it
+    from validators import url as valid_url
+
+    title = pl.col('post_title')
+    date = pl.col('post_date').dt.strftime('%Y-%m-%d')
+    unit = pl.col('unit')
+
+
+    # construct the markdown filename
+    ##################################################
+
+    # remove the title prefix "What I Read:" or "What I Watch:", then put first
+    #   2 words of the title into the filename
+    title_words = (
+        title.str.split(':').list.get(1)
+        .str.strip_chars().str.to_lowercase()
+        .str.replace_all(r'[^a-zA-Z0-9_ ]', '')
+        .str.split(' ').list.head(2).list.join('_'))
+    filename = pl.concat_str(date, pl.lit('_'), title_words, pl.lit('.md'))
+
+
+    # save the tags for the post
+    ##################################################
+
+    tags = (
+        unit.list.last().str.split(',')
+        .list.eval(pl.element().str.strip_chars())
+        .list.eval(pl.element().filter(pl.element() != '')))
+
+    df2 = df.select(
+        pl.int_range(pl.len()).alias('idx'), 
+        filename.alias('filename'), 
+        title.str.replace_all("'", '', literal=True).alias('title'),
+        date.alias('date'), 
+        tags.alias('tags'), 
+        unit.list.head(unit.list.len() - 1).alias('body'))
+    df2 = df2.with_columns(format_tags(df2['tags']).alias('tags_str'))
+
+
+    # assemble the markdown content
+    ##################################################
+
+    front_matter_lines = [
+        pl.lit('+++'), 
+        pl.concat_str(pl.lit("title = '"), pl.col('title'), pl.lit("'")),
+        pl.concat_str(pl.lit("date = '"), pl.col('date'), pl.lit("'")),
+        pl.lit('\n'), 
+        pl.lit('[taxonomies]'), 
+        pl.concat_str(pl.lit('tags = '), pl.col('tags_str')),
+        pl.lit("categories = ['repost']"), 
+        pl.lit('+++'), 
+        pl.lit('\n')]
+    front_matter = pl.concat_str([
+        add_markdown_line_end(e) for e in front_matter_lines])
+
+    body_lines_df = (
+        df2.select('idx', pl.col('body').alias('line'))
+        .explode('line')
+        .drop_nulls('line'))
+
+    # the mask is typed, so that a post without body lines, or no post at 
+    #   all, gives an empty mask rather than an untyped empty list
+    distinct_lines = body_lines_df['line'].unique()
+    url_lines = distinct_lines.filter(pl.Series(
+        [bool(valid_url(e)) for e in distinct_lines], dtype=pl.Boolean))
+
+    line = pl.col('line')
+    body_df = (
+        body_lines_df
+        .with_columns(
+            pl.when(line.is_in(url_lines))
+            .then(pl.concat_str(
+                pl.lit('['), line, pl.lit(']('), line, pl.lit(')')))
+            .otherwise(line)
+            .pipe(add_markdown_line_end)
+            .alias('line'))
+        .group_by('idx', maintain_order=True)
+        .agg(line.str.concat(''))
+        .rename({'line': 'body_text'}))
+
+    md_df = (
+        df2.join(body_df, on='idx', how='left')
+        .sort('idx')
+        .select(
+            'filename', 
+            pl.concat_str(
+                front_matter, pl.col('body_text').fill_null(''))
+            .alias('text')))
+
+    return md_df
+
+
+# increment when a change to the conversion changes its results, so that 
+#   results cached by the earlier code are discarded
+markdown_cache_version = 2
+
+# the columns that 'render_posts_markdown' reads
+markdown_input_colnames = ['post_title', 'post_date', 'unit']
+
+
+@instrumented('s04.render_posts_markdown_cached')
+def render_posts_markdown_cached(
+    df: pl.DataFrame, cache: PostCache) -> pl.DataFrame:
+    """
+    Converts each post in a DataFrame to the filename and the text of its 
+        markdown file, as 'render_posts_markdown' does, but reuses the markdown
+        cached for posts whose title, date and text file unit are unchanged; 
+        only the posts that are not in the cache are converted, and their 
+        markdown is added to the cache
+    """
+
+    keys = [
+        hash_cache_key(*row) 
+        for row in df.select(markdown_input_colnames).iter_rows()]
+
+    cached_md = cache.get_many(keys)
+
+    missing_idxs = [i for i, e in enumerate(keys) if e not in cached_md]
+    record_metrics(
+        cache_hits=len(keys) - len(missing_idxs), 
+        cache_misses=len(missing_idxs))
+    if missing_idxs:
+        missing_md_df = render_posts_markdown(df[missing_idxs])
+        new_md = {
+            keys[i]: list(md) 
+            for i, md in zip(missing_idxs, missing_md_df.iter_rows())}
+        cache.set_many(new_md)
+        cached_md.update(new_md)
+
+    md_df = pl.DataFrame(
+        [cached_md[e] for e in keys], orient='row', 
+        schema={'filename': pl.Utf8, 'text': pl.Utf8})
+
+    return md_df
+
+
+def render_post_text(post: Post) -> str:
+    """
+    Assembles the markdown content of a post into the text of its file
+    """
+
+    # some markdown formats/readers display new lines when 2 spaces are at the
+    #   end of a line, but those spaces disrupt Zola static site generator
+    lines = [e + '  ' if '+++' not in e else e for e in post.content]
+
+    text = ''.join(e + '\n' for e in lines)
+
+    return text
+
+
+def write_text_file_if_changed(text: str, text_filepath: Path) -> bool:
+    """
+    Writes text to a file, unless the file already has the same content, and
+        returns whether the file was written
+
+    The text is written to a temporary file that then replaces the original 
+        file, so that a partly written file is never visible
+    """
+
+    text_bytes = text.encode('utf-8')
+
+    try:
+        existing_hash = hashlib.blake2b(text_filepath.read_bytes()).digest()
+    except FileNotFoundError:
+        existing_hash = None
+
+    if existing_hash == hashlib.blake2b(text_bytes).digest():
+        return False
+
+    with write_atomically(text_filepath) as temp_filepath:
+        with open(temp_filepath, 'wb') as f:
+            f.write(text_bytes)
+
+    return True
+
+
+# the name of the file in the markdown directory in which the names of the 
+#   files written by 'write_markdown_files' are saved; it is hidden, so that 
+#   the static site generator and 'scheduler.hash_path' ignore it
+emitted_filenames_filename = '.emitted_md_files.json'
+
+
+def load_emitted_filenames(output_md_path: Path) -> set[str]:
+    """
+    Loads the names of the markdown files that 'write_markdown_files' wrote to
+        'output_md_path', or returns an empty set if none were recorded
+    """
+
+    filepath = output_md_path / emitted_filenames_filename
+    if not filepath.exists():
+        return set()
+
+    with open(filepath, encoding='utf-8') as f:
+        return set(json.load(f))
+
+
+@instrumented('s04.write_markdown_files')
+def write_markdown_files(
+    md_df: pl.DataFrame, output_md_path: Path, worker_n: int=8, 
+    prune: bool=True) -> list[str]:
+    """
+    Writes the text of each markdown file in a DataFrame with 'filename' and 
+        'text' columns to 'output_md_path' in a pool of 'worker_n' threads, 
+        skipping files whose content is unchanged, and returns the names of the
+        files that were written
+
+    The names of the files are recorded in 'output_md_path', so that if 
+        'prune' is 'True', markdown files that were written by an earlier call
+        but that do not belong to any of the posts, e.g., for posts that have 
+        been deleted, are deleted; other files in 'output_md_path', like a 
+        hand-written '_index.md', are left alone
+    """
+
+    # posts with the same filename overwrite each other, so only the last one
+    #   is written
+    post_texts = dict(zip(md_df['filename'], md_df['text']))
+
+    with ThreadPoolExecutor(worker_n) as executor:
+        is_written = list(executor.map(
+            lambda e: write_text_file_if_changed(e[1], output_md_path / e[0]),
+            post_texts.items()))
+
+    written_filenames = [
+        e for e, written in zip(post_texts, is_written) if written]
+
+    emitted_filenames = load_emitted_filenames(output_md_path)
+
+    pruned_n = 0
+    if prune:
+        for e in emitted_filenames - set(post_texts):
+            md_filepath = output_md_path / e
+            if md_filepath.exists():
+                md_filepath.unlink()
+                pruned_n += 1
+        emitted_filenames = set(post_texts)
     else:
-        append_or_overwrite = 'a'
+        emitted_filenames = {
+            e for e in emitted_filenames if (output_md_path / e).exists()}
+        emitted_filenames |= set(post_texts)
+
+    # the directory's modification time records when its files were last 
+    #   brought up to date, even if none of them changed, so that the files 
+    #   can be compared to the step's input by time
+    output_md_path.mkdir(exist_ok=True, parents=True)
+    write_text_file_if_changed(
+        json.dumps(sorted(emitted_filenames), ensure_ascii=False), 
+        output_md_path / emitted_filenames_filename)
+    os.utime(output_md_path)
 
-    with open(text_filename, append_or_overwrite, encoding='utf-8') as txt_file:
-        for e in a_list:
-            txt_file.write(str(e))
-            txt_file.write('\n')
+    record_metrics(
+        files_written=len(written_filenames), 
+        files_unchanged=len(post_texts) - len(written_filenames), 
+        files_pruned=pruned_n, 
+        bytes_written=sum(
+            len(post_texts[e].encode('utf-8')) for e in written_filenames))
 
+    return written_filenames
 
-def main():
+
+# the name of the file in the output directory's 'cache' directory in which 
+#   markdown is cached
+markdown_cache_filename = 's04_markdown.sqlite'
+
+
+@instrumented('s04.convert_posts_to_markdown_files')
+def convert_posts_to_markdown_files(
+    df: pl.DataFrame, output_md_path: Path, worker_n: int=8, 
+    cache: PostCache | None=None) -> list[str]:
     """
-    Convert the website post data to markdown files
+    Convert the website post data to markdown files in 'output_md_path' and 
+        return the names of the files that were written
+
+    If 'cache' is given, the markdown of posts that are unchanged since an 
+        earlier run is read from it instead of being converted again
+
+    Only files whose content has changed are written, in a pool of 'worker_n'
+        threads, and files for posts that no longer exist are deleted
     """
 
-    output_path = Path.cwd() / 'output'
-    output_md_path = output_path / 'md_posts'
     output_md_path.mkdir(exist_ok=True, parents=True)
 
-    input_filename = 's03_website_textfile_merged.parquet'
-    input_filepath = output_path / input_filename 
+    if cache is not None:
+        md_df = render_posts_markdown_cached(df, cache)
+    else:
+        md_df = render_posts_markdown(df)
 
-    df = pl.read_parquet(input_filepath)
+    written_filenames = write_markdown_files(md_df, output_md_path, worker_n)
 
-    posts = []
+    return written_filenames
 
-    for row in df.iter_rows(named=True):
-        post = convert_post_to_markdown(row)
-        posts.append(post)
 
-    for post in posts:
+def main(
+    use_cache: bool=True, worker_n: int=8, output_path: Path | None=None):
+    """
+    Convert the website post data to markdown files (see 
+        'convert_posts_to_markdown_files')
 
-        output_filepath = output_md_path / post.filename
+    If 'use_cache' is 'True', the markdown of posts that are unchanged since an
+        earlier run is read from a cache in the output directory instead of 
+        being converted again
 
-        # some markdown formats/readers display new lines when 2 spaces are at 
-        #   the end of a line, but those spaces disrupt Zola static site 
-        #   generator
-        post.content = [e + '  ' if '+++' not in e else e for e in post.content]
+    The input file and the markdown files are in 'output_path', which 
+        defaults to the 'output' directory in the current working directory
+    """
+
+    if output_path is None:
+        output_path = Path.cwd() / 'output'
+    output_md_path = output_path / 'md_posts'
 
-        write_list_to_text_file(post.content, output_filepath, True)
+    input_name = 's03_website_textfile_merged'
+
+    with instrument_stage('s04', output_path):
+
+        # only the columns that the markdown is made from are read, so that 
+        #   the posts' HTML is not
+        df = (
+            scan_intermediate(output_path, input_name)
+            .select(markdown_input_colnames)
+            .collect())
+        record_metrics(
+            bytes_read=get_intermediate_bytes(output_path, input_name))
+
+        if use_cache:
+            cache_filepath = output_path / 'cache' / markdown_cache_filename
+            with PostCache(
+                cache_filepath, version=markdown_cache_version) as cache:
+                convert_posts_to_markdown_files(
+                    df, output_md_path, worker_n, cache)
+        else:
+            convert_posts_to_markdown_files(df, output_md_path, worker_n)
 
 
 if __name__ == '__main__':
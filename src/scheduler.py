@@ -0,0 +1,371 @@
+#! /usr/bin/env python3
+
+import json
+import time
+import hashlib
+import traceback
+import multiprocessing
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Callable
+from concurrent.futures import (
+    Future, ProcessPoolExecutor, wait, FIRST_COMPLETED)
+
+import s01
+import s02
+import s03
+import s04
+from intermediates import (
+    IntermediateFormat, find_intermediate, write_atomically)
+from url_normalization import url_rules_filepath
+
+
+@dataclass
+class Task:
+    """
+    A unit of the pipeline that runs 'function(**kwargs)' in a process of its
+        own
+
+    inputs, outputs:  the files and directories that the task reads and
+        writes; a task waits for the tasks that write its inputs, and it is
+        skipped if the content of its inputs and outputs is unchanged since it
+        last ran (see 'run_tasks'); an intermediate may be named without the
+        suffix of its format
+    settings:  a description of the options that change the task's outputs,
+        so that the task runs again if they change
+    """
+    name: str
+    function: Callable[..., object]
+    kwargs: dict=field(default_factory=dict)
+    inputs: tuple[Path, ...]=()
+    outputs: tuple[Path, ...]=()
+    settings: str=''
+
+
+@dataclass
+class TaskResult:
+    """
+    What happened to a task in 'run_tasks'
+
+    status:  'ran', 'skipped' because its inputs and outputs were unchanged,
+        'failed' or 'not run' because a task that it waits for failed
+    seconds:  how long the task ran
+    error:  the traceback of the error, if the task failed
+    """
+    name: str
+    status: str
+    seconds: float=0.
+    error: str | None=None
+
+
+# increment when a change to the tasks changes their outputs, so that every
+#   task runs again instead of being skipped
+task_state_version = 1
+
+# the name of the file in the output directory in which the content hashes of
+#   each task's inputs and outputs are saved
+task_state_filename = 'tasks.json'
+
+
+def resolve_path(path: Path) -> Path | None:
+    """
+    Returns the file or directory 'path' or, if it names an intermediate
+        without its suffix, the file or directory in which the intermediate is
+        saved, or 'None' if neither exists
+    """
+
+    if path.exists():
+        return path
+
+    return find_intermediate(path.parent, path.name)
+
+
+def hash_path(path: Path) -> str | None:
+    """
+    Returns a hash of the content of a file or, for a directory, of the names
+        and content of the files in it, or 'None' if it does not exist
+
+    Hidden files, like the temporary files of an interrupted write, are left
+        out
+    """
+
+    resolved_path = resolve_path(path)
+    if resolved_path is None:
+        return None
+
+    if resolved_path.is_dir():
+        filepaths = sorted(
+            e for e in resolved_path.rglob('*')
+            if e.is_file() and not e.name.startswith('.'))
+    else:
+        filepaths = [resolved_path]
+
+    digest = hashlib.blake2b(digest_size=16)
+    for filepath in filepaths:
+        if filepath != resolved_path:
+            relative_name = filepath.relative_to(resolved_path).as_posix()
+            digest.update(relative_name.encode('utf-8') + b'\0')
+        with open(filepath, 'rb') as f:
+            while chunk := f.read(2**20):
+                digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def load_task_state(filepath: Path) -> dict:
+    """
+    Loads the hashes of each task's inputs and outputs saved by
+        'save_task_state', or returns an empty state if there are none or if
+        they were saved by a different version of the tasks
+    """
+
+    if not filepath.exists():
+        return {}
+
+    with open(filepath, encoding='utf-8') as f:
+        state_dict = json.load(f)
+
+    if state_dict.get('version') != task_state_version:
+        return {}
+
+    return state_dict['tasks']
+
+
+def save_task_state(state: dict, filepath: Path):
+    """
+    Saves the hashes of each task's inputs and outputs, replacing the earlier
+        file only after it is completely written
+    """
+
+    state_dict = {'version': task_state_version, 'tasks': state}
+
+    with write_atomically(filepath) as temp_filepath:
+        with open(temp_filepath, 'w', encoding='utf-8') as f:
+            json.dump(state_dict, f, indent=2)
+
+
+def hash_paths(paths: tuple[Path, ...]) -> dict[str, str | None]:
+    return {str(e): hash_path(e) for e in paths}
+
+
+def is_task_unchanged(
+    task: Task, input_hashes: dict[str, str | None],
+    task_state: dict | None) -> bool:
+    """
+    Returns whether a task's settings and the content of its inputs and
+        outputs are the same as when it last ran, so that running it again
+        would not change its outputs
+    """
+
+    if task_state is None or task_state['settings'] != task.settings:
+        return False
+    if None in input_hashes.values():
+        return False
+    if input_hashes != task_state['inputs']:
+        return False
+
+    # the outputs are hashed last, because they are the largest
+    output_hashes = hash_paths(task.outputs)
+
+    return None not in output_hashes.values() and (
+        output_hashes == task_state['outputs'])
+
+
+def get_task_dependencies(tasks: list[Task]) -> dict[str, set[str]]:
+    """
+    Returns the names of the tasks that write the inputs of each task
+    """
+
+    producers = {}
+    for task in tasks:
+        for e in task.outputs:
+            if e in producers:
+                raise ValueError(
+                    f'Tasks {producers[e]!r} and {task.name!r} both write '
+                    f'{str(e)!r}')
+            producers[e] = task.name
+
+    dependencies = {
+        task.name: {producers[e] for e in task.inputs if e in producers}
+        for task in tasks}
+
+    return dependencies
+
+
+def run_tasks(
+    tasks: list[Task], state_filepath: Path, worker_n: int=2,
+    force: bool=False) -> list[TaskResult]:
+    """
+    Runs each task as soon as the tasks that write its inputs have finished,
+        up to 'worker_n' tasks at a time in a pool of processes, and returns
+        the results in the order of 'tasks'
+
+    A task is skipped if its inputs and outputs have the same content hashes
+        as when it last ran, as recorded in 'state_filepath', unless 'force' is
+        'True'; content, rather than modification times, is compared, so that
+        a file that is rewritten with the same content does not make the tasks
+        after it run again
+    """
+
+    dependencies = get_task_dependencies(tasks)
+    state = load_task_state(state_filepath)
+
+    results = {}
+    pending = {e.name: e for e in tasks}
+    running: dict[Future, tuple[Task, dict, float]] = {}
+
+    mp_context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(worker_n, mp_context=mp_context) as executor:
+
+        while pending or running:
+
+            # skipping a task may let the tasks after it start, so the pending
+            #   tasks are checked until none changes
+            is_changed = True
+            while is_changed:
+                is_changed = False
+                for name, task in list(pending.items()):
+                    task_results = [
+                        results.get(e) for e in dependencies[name]]
+                    if any(
+                        e is not None and e.status in ('failed', 'not run')
+                        for e in task_results):
+                        results[name] = TaskResult(name, 'not run')
+                    elif None in task_results:
+                        continue
+                    else:
+                        input_hashes = hash_paths(task.inputs)
+                        if not force and is_task_unchanged(
+                            task, input_hashes, state.get(name)):
+                            results[name] = TaskResult(name, 'skipped')
+                        else:
+                            future = executor.submit(
+                                task.function, **task.kwargs)
+                            running[future] = (
+                                task, input_hashes, time.perf_counter())
+                    del pending[name]
+                    is_changed = True
+
+            if not running:
+                if pending:
+                    raise ValueError(
+                        'Tasks wait for each other in a cycle:  '
+                        f'{", ".join(pending)}')
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task, input_hashes, start_time = running.pop(future)
+                seconds = time.perf_counter() - start_time
+                try:
+                    future.result()
+                except Exception as e:
+                    results[task.name] = TaskResult(
+                        task.name, 'failed', seconds,
+                        ''.join(traceback.format_exception(e)))
+                    state.pop(task.name, None)
+                else:
+                    results[task.name] = TaskResult(
+                        task.name, 'ran', seconds)
+                    state[task.name] = {
+                        'settings': task.settings, 'inputs': input_hashes,
+                        'outputs': hash_paths(task.outputs)}
+                # saved after each task, so that an interrupted run keeps the
+                #   tasks that finished
+                save_task_state(state, state_filepath)
+
+    return [results[e.name] for e in tasks]
+
+
+def create_pipeline_tasks(
+    input_path: Path, output_path: Path,
+    dump_filename: str='localhost.sql.gz',
+    textfile_filename: str='01posts.txt', table_prefix: str='_5A5_',
+    gzip_command: str | None='auto', worker_n: int=1, use_cache: bool=True,
+    intermediate_format: IntermediateFormat | None=None) -> list[Task]:
+    """
+    Returns the tasks of steps 01 through 04, with step 03 split in two, so
+        that the text file is read while the SQL dump file is
+
+        s01 (dump) -> s02 ------------> s03_merge -> s04
+        s03_textfile (text file) ----/
+
+    The tasks that extract or normalize URLs also read the URL rules file, so
+        that they run again if the rules change
+    """
+
+    if intermediate_format is None:
+        intermediate_format = IntermediateFormat()
+    format_settings = repr(intermediate_format)
+
+    tasks = [
+        Task(
+            's01', s01.main,
+            kwargs=dict(
+                table_prefix=table_prefix, worker_n=worker_n,
+                input_path=input_path, output_path=output_path,
+                intermediate_format=intermediate_format,
+                dump_filename=dump_filename, gzip_command=gzip_command),
+            inputs=(input_path / dump_filename,),
+            outputs=(output_path / 's01_posts',),
+            settings=f'{table_prefix=}, {format_settings}'),
+        Task(
+            's03_textfile', s03.main_textfile,
+            kwargs=dict(
+                input_path=input_path, output_path=output_path,
+                intermediate_format=intermediate_format,
+                textfile_filename=textfile_filename),
+            inputs=(input_path / textfile_filename, url_rules_filepath),
+            outputs=(output_path / s03.textfile_posts_name,),
+            settings=format_settings),
+        Task(
+            's02', s02.main,
+            kwargs=dict(
+                worker_n=worker_n, use_cache=use_cache,
+                output_path=output_path,
+                intermediate_format=intermediate_format),
+            inputs=(output_path / 's01_posts', url_rules_filepath),
+            outputs=(output_path / 's02_website_read_posts',),
+            settings=format_settings),
+        Task(
+            's03_merge', s03.main_merge,
+            kwargs=dict(
+                output_path=output_path,
+                intermediate_format=intermediate_format),
+            inputs=(
+                output_path / 's02_website_read_posts',
+                output_path / s03.textfile_posts_name, url_rules_filepath),
+            outputs=(
+                output_path / 's03_website_textfile_merged',
+                output_path / 's03_unmatched_url_candidates.csv'),
+            settings=format_settings),
+        Task(
+            's04', s04.main,
+            kwargs=dict(
+                use_cache=use_cache, worker_n=worker_n,
+                output_path=output_path),
+            inputs=(output_path / 's03_website_textfile_merged',),
+            outputs=(output_path / 'md_posts',)),
+        ]
+
+    return tasks
+
+
+def format_task_results(results: list[TaskResult]) -> str:
+    """
+    Formats the results of 'run_tasks' as a line for each task, followed by
+        the error of each task that failed
+    """
+
+    lines = []
+    for e in results:
+        if e.status == 'ran':
+            lines.append(f'{e.name}:  ran in {e.seconds:.1f} seconds')
+        else:
+            lines.append(f'{e.name}:  {e.status}')
+
+    for e in results:
+        if e.error:
+            lines.append(f'\n{e.name} failed:\n{e.error.rstrip()}')
+
+    return '\n'.join(lines)
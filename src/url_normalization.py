@@ -0,0 +1,188 @@
+#! /usr/bin/env python3
+
+import re
+import json
+import hashlib
+import polars as pl
+from pathlib import Path
+from functools import lru_cache
+from dataclasses import dataclass
+
+
+url_rules_filepath = Path(__file__).parent / 'url_rules.json'
+
+
+@dataclass
+class UrlRules:
+    """
+    The rules in the URL rules file, compiled so that each kind of rule is
+        applied in a single step
+
+    Rules are applied in this order:
+        remove_pattern:  text that is removed wherever it occurs
+        truncations:  (text that a URL must contain, pattern that matches from
+            the first occurrence of the text at which to cut the URL to its end)
+        suffix_pattern:  the suffixes that are stripped from the end of a URL;
+            each group of suffixes in the file is stripped at most once, in
+            order
+        replacements:  whole URLs that are replaced by other URLs
+    """
+    remove_pattern: str | None
+    truncations: list[tuple[str, str]]
+    suffix_pattern: str | None
+    replacements: dict[str, str]
+
+    def __post_init__(self):
+        self.remove_regex = (
+            re.compile(self.remove_pattern) if self.remove_pattern else None)
+
+
+def compile_url_rules(rules: dict) -> UrlRules:
+    """
+    Compiles the rules read from a URL rules file
+    """
+
+    # try longer texts first, so that a text that contains another is removed
+    #   whole
+    remove_texts = sorted(rules.get('remove', []), key=len, reverse=True)
+    if remove_texts:
+        remove_pattern = '|'.join(re.escape(e) for e in remove_texts)
+    else:
+        remove_pattern = None
+
+    truncations = [
+        (e['if_contains'], '(?s)' + re.escape(e['at']) + '.*')
+        for e in rules.get('truncate', [])]
+
+    # a later group of suffixes is stripped after an earlier one, so it comes
+    #   before it in the pattern
+    suffix_groups = [
+        '(?:' + '|'.join(re.escape(e) for e in group) + ')?'
+        for group in rules.get('strip_suffixes', []) if group]
+    if suffix_groups:
+        suffix_pattern = ''.join(reversed(suffix_groups)) + '$'
+    else:
+        suffix_pattern = None
+
+    url_rules = UrlRules(
+        remove_pattern=remove_pattern,
+        truncations=truncations,
+        suffix_pattern=suffix_pattern,
+        replacements=dict(rules.get('replace', {})))
+
+    return url_rules
+
+
+def load_url_rules(filepath: Path | str) -> UrlRules:
+    """
+    Reads and compiles the rules in a URL rules file
+    """
+
+    with open(filepath, encoding='utf-8') as f:
+        rules = json.load(f)
+
+    return compile_url_rules(rules)
+
+
+@lru_cache(maxsize=None)
+def get_url_rules(filepath: Path | str=url_rules_filepath) -> UrlRules:
+    """
+    Returns the compiled rules in a URL rules file, which are read only once
+    """
+
+    return load_url_rules(filepath)
+
+
+def hash_url_rules(url_rules: UrlRules) -> str:
+    """
+    Returns a hash of the compiled rules, so that results that were derived
+        with different rules, like cached URLs, can be told apart
+    """
+
+    rules = [
+        url_rules.remove_pattern, url_rules.truncations,
+        url_rules.suffix_pattern, sorted(url_rules.replacements.items())]
+    digest = hashlib.blake2b(
+        json.dumps(rules, ensure_ascii=False).encode('utf-8'), digest_size=16)
+
+    return digest.hexdigest()
+
+
+def remove_extraneous_text(
+    a_string: str, url_rules: UrlRules | None=None) -> str:
+    """
+    Removes the text that the URL rules' 'remove' rules specify from a string
+    """
+
+    if url_rules is None:
+        url_rules = get_url_rules()
+
+    if url_rules.remove_regex:
+        a_string = url_rules.remove_regex.sub('', a_string)
+
+    return a_string
+
+
+def normalize_url(a_string: str, url_rules: UrlRules | None=None) -> str:
+    """
+    Applies all of the URL rules to a string with 'normalize_url_expr', so that
+        a single URL is normalized exactly as a column of them is; e.g., the
+        patterns' '$' matches only at the very end of the string, not before a
+        final newline as in Python's 're'
+
+    >>> url_rules = compile_url_rules({
+    ...     'remove': ['utm'], 'truncate': [{'if_contains': 'x.com', 'at': '?'}],
+    ...     'strip_suffixes': [['/']], 'replace': {'a.com': 'b.com'}})
+    >>> urls = ['x.com/a?utm', 'y.com/a/', 'y.com/a/\\n', 'a.com/', '']
+    >>> [normalize_url(e, url_rules) for e in urls]
+    ['x.com/a', 'y.com/a', 'y.com/a/\\n', 'b.com', '']
+    >>> df = normalize_url_column(pl.DataFrame({'url': urls}), 'url', url_rules)
+    >>> df['url'].to_list() == [normalize_url(e, url_rules) for e in urls]
+    True
+    """
+
+    normalized = pl.select(
+        normalize_url_expr(pl.lit(a_string, dtype=pl.Utf8), url_rules)).item()
+
+    return normalized
+
+
+def normalize_url_expr(
+    expr: pl.Expr, url_rules: UrlRules | None=None) -> pl.Expr:
+    """
+    Applies all of the URL rules to a column of strings as a single expression,
+        so that the column is materialized only once
+    """
+
+    if url_rules is None:
+        url_rules = get_url_rules()
+
+    if url_rules.remove_pattern:
+        expr = expr.str.replace_all(url_rules.remove_pattern, '')
+
+    for contained, pattern in url_rules.truncations:
+        expr = (
+            pl.when(expr.str.contains(contained, literal=True))
+            .then(expr.str.replace(pattern, ''))
+            .otherwise(expr))
+
+    if url_rules.suffix_pattern:
+        expr = expr.str.replace(url_rules.suffix_pattern, '')
+
+    if url_rules.replacements:
+        expr = expr.replace(url_rules.replacements)
+
+    return expr
+
+
+def normalize_url_column(
+    df: pl.DataFrame, url_colname: str='url',
+    url_rules: UrlRules | None=None) -> pl.DataFrame:
+    """
+    Applies all of the URL rules to the URLs in a DataFrame column
+    """
+
+    df2 = df.with_columns(
+        normalize_url_expr(pl.col(url_colname), url_rules).alias(url_colname))
+
+    return df2